@@ -5,13 +5,26 @@ A tool for ROM hacking that provides hex editing, free space finding, and script
 
 import tkinter as tk
 from tkinter import filedialog, messagebox, scrolledtext, Menu, ttk, Toplevel, BooleanVar
+from tkinter import font as tkfont
 import os
 import pyperclip
 import ctypes
-import shutil
-import threading
 import configparser
-import queue
+import multiprocessing
+import time
+from bisect import bisect_left
+from functools import partial
+import allocator
+import instrumentation
+import parallel_scan
+from analysis_cache import AnalysisCache
+from jobs import JobScheduler
+from pattern_search import MAX_HITS, SearchPattern
+from workspace import Workspace
+from ufsf_core import (ALIGNMENTS, FILL_TYPES, FILLER_SETS, FreeBlockList, describe_references, format_fillers,
+                       format_offset, parse_fillers, parse_offset)
+from hex_rows import HEX_WIDTH, RowCache, format_rows
+from scan_engine import BLOCK_FREE_00, BLOCK_FREE_FF, BLOCK_MIXED, BLOCK_USED, align_up
 
 #----------------------------------------------------------------------
 # GLOBAL VARIABLES AND INITIALIZATION
@@ -21,20 +34,24 @@ import queue
 if os.name == 'nt':
    ctypes.windll.user32.ShowWindow(ctypes.windll.kernel32.GetConsoleWindow(), 0)
 
+# Spawned worker processes would re-run this whole script, so scan in-process there
+if "fork" not in multiprocessing.get_all_start_methods():
+    parallel_scan.WORKERS = 1
+# Fork the scan workers now, while no job thread or Tk is running yet
+parallel_scan.start()
+
 # Core data variables
-rom_data_original = b''  # Original data
-rom_data = b''           # Working copy for edits
-rom_path = ''
+workspace = Workspace()  # Every open ROM, one tab each (see workspace)
+rom = None               # Active RomImage (original + working copy, see ufsf_core)
+row_cache = None         # Formatted hex rows of the active ROM (see hex_rows)
+rom_views = {}           # RomImage -> (row cache, top line, minimap cache) of inactive tabs
+analysis_cache = AnalysisCache()  # Saved free run/pointer indexes (see analysis_cache)
+scheduler = JobScheduler()  # Background searches, loads, saves and erases (see jobs)
+saving = []              # ROMs with a save job queued or running, once per job
+HIT_PAGE = 200           # Search hits added to a hit list per scroll
 species_dict = {}
 item_dict = {}
 flag_dict = {}
-loading_popup = None
-progress_queue = None
-
-# Viewport Buffer
-current_view_start = 0  # First line currently rendered
-view_buffer_size = 500  # Number of lines to render above/below viewport
-total_line_count = 0    # Total number of lines in the ROM
 
 # Load dictionary data files
 for file, target_dict in [("species.dat", species_dict), ("items.dat", item_dict), ("flags.dat", flag_dict)]:
@@ -89,140 +106,447 @@ class ToolTip:
             self.tip_window.destroy()
         self.tip_window = None
 
+class HexViewport:
+    """Fixed-size hex view that only ever holds the rows on screen.
+
+    The Text widgets contain visible_rows lines at a time and the scrollbar
+    is driven from our own model (top_line out of line_count), so a scroll
+    position always maps to the same ROM offset and render cost doesn't
+    depend on the ROM size.
+    """
+    WHEEL_LINES = 3  # Rows scrolled per mouse wheel notch
+
+    def __init__(self, display, gutter, scrollbar):
+        self.display = display
+        self.gutter = gutter
+        self.scrollbar = scrollbar
+        self.rows = None            # RowCache of the loaded ROM
+        self.top_line = 0           # ROM line shown in the first widget row
+        self.visible_rows = int(display.cget("height"))
+        self.highlight_offset = None
+        self.marks = []             # Sorted offsets of search hits marked in the view
+        self.mark_length = 0        # Bytes marked from each hit
+        self.view_changed = None    # Called as view_changed(start, end) after each render
+        self.line_height = tkfont.Font(font=display.cget("font")).metrics("linespace")
+
+        scrollbar.config(command=self.on_scrollbar)
+        display.bind("<Configure>", self.on_resize)
+        for widget in (display, gutter):
+            widget.bind("<MouseWheel>", self.on_mousewheel)
+            widget.bind("<Button-4>", self.on_mousewheel)
+            widget.bind("<Button-5>", self.on_mousewheel)
+        display.bind("<Up>", lambda e: self.on_arrow(-1))
+        display.bind("<Down>", lambda e: self.on_arrow(1))
+        display.bind("<Prior>", lambda e: self.scroll_by(-self.page_size()))  # Page Up
+        display.bind("<Next>", lambda e: self.scroll_by(self.page_size()))    # Page Down
+        display.bind("<Control-Home>", lambda e: self.scroll_to(0))
+        display.bind("<Control-End>", lambda e: self.scroll_to(self.line_count))
+
+    @property
+    def line_count(self):
+        return self.rows.line_count if self.rows else 0
+
+    def page_size(self):
+        return max(1, self.visible_rows - 1)
+
+    def set_rows(self, rows):
+        """Show a new ROM (RowCache), starting from the top"""
+        self.rows = rows
+        self.top_line = 0
+        self.highlight_offset = None
+        self.marks = []
+        self.render()
+
+    #----------------------------------------------------------------------
+    # SCROLLING
+    #----------------------------------------------------------------------
+
+    def clamp(self, line):
+        """Clamp a top line so the view stays full"""
+        return max(0, min(line, self.line_count - self.visible_rows))
+
+    def scroll_to(self, line):
+        """Make line the first visible row"""
+        line = self.clamp(line)
+        if line != self.top_line:
+            self.top_line = line
+            self.render()
+        return "break"
+
+    def scroll_by(self, lines):
+        return self.scroll_to(self.top_line + lines)
+
+    def on_scrollbar(self, *args):
+        """Scrollbar command: ('moveto', fraction) or ('scroll', n, 'units'/'pages')"""
+        if args[0] == "moveto":
+            self.scroll_to(round(float(args[1]) * self.line_count))
+        elif args[0] == "scroll":
+            amount = int(args[1])
+            self.scroll_by(amount * self.page_size() if args[2] == "pages" else amount)
+
+    def on_mousewheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            return self.scroll_by(-self.WHEEL_LINES)
+        return self.scroll_by(self.WHEEL_LINES)
+
+    def on_arrow(self, direction):
+        """Move the cursor a row, scrolling when it would leave the view"""
+        row, col = map(int, self.display.index("insert").split("."))
+        if (direction < 0 and row > 1) or (direction > 0 and row < self.visible_rows):
+            return None  # Let the Text widget move the cursor
+        self.scroll_by(direction)
+        self.display.mark_set("insert", f"{row}.{col}")
+        return "break"
+
+    def on_resize(self, event):
+        """Fit the number of rendered rows to the widget height"""
+        padding = 2 * (int(self.display.cget("borderwidth")) + int(self.display.cget("pady"))
+                       + int(self.display.cget("highlightthickness")))
+        rows = max(1, (event.height - padding) // self.line_height)
+        if rows != self.visible_rows:
+            self.visible_rows = rows
+            self.top_line = self.clamp(self.top_line)
+            self.render()
+
+    #----------------------------------------------------------------------
+    # RENDERING
+    #----------------------------------------------------------------------
+
+    @instrumentation.timed("render: hex view")
+    def render(self):
+        """Redraw the visible rows, the offset gutter and the scrollbar"""
+        insert = self.display.index("insert")
+        lines = self.rows.get_rows(self.top_line, self.visible_rows) if self.rows else []
+        self.display.delete("1.0", tk.END)
+        self.display.insert("1.0", "\n".join(lines))
+        self.display.mark_set("insert", insert)
+        self.display.yview_moveto(0)
+
+        self.gutter.config(state='normal')
+        self.gutter.delete("1.0", tk.END)
+        self.gutter.insert("1.0", "\n".join(f"{(self.top_line + i) * 16:08X}" for i in range(len(lines))))
+        self.gutter.config(state='disabled')
+        self.gutter.yview_moveto(0)
+
+        self.paint_highlight()
+        self.paint_marks()
+        if self.line_count:
+            self.scrollbar.set(self.top_line / self.line_count,
+                               (self.top_line + len(lines)) / self.line_count)
+        else:
+            self.scrollbar.set(0, 1)
+        if self.view_changed:
+            self.view_changed(self.top_line * 16, (self.top_line + len(lines)) * 16)
+
+    @instrumentation.timed("render: hex repaint")
+    def repaint(self, start, end):
+        """Redraw only the on-screen rows covering bytes start .. end-1"""
+        first = max(start // 16, self.top_line)
+        last = min((end - 1) // 16, self.top_line + self.visible_rows - 1)
+        if not self.rows or first > last:
+            return
+        insert = self.display.index("insert")
+        for line, text in enumerate(self.rows.get_rows(first, last - first + 1), first):
+            row = line - self.top_line + 1
+            self.display.delete(f"{row}.0", f"{row}.0 lineend")
+            self.display.insert(f"{row}.0", text)
+        self.display.mark_set("insert", insert)
+        if self.highlight_offset is not None and first <= self.highlight_offset // 16 <= last:
+            self.paint_highlight()
+        if self.marks:
+            self.paint_marks()
+
+    def paint_highlight(self):
+        """Tag the highlighted byte if it is on screen"""
+        self.display.tag_remove("highlight", "1.0", tk.END)
+        if self.highlight_offset is None:
+            return
+        row = self.highlight_offset // 16 - self.top_line
+        if 0 <= row < self.visible_rows:
+            col_start = (self.highlight_offset % 16) * 3
+            self.display.tag_add("highlight", f"{row + 1}.{col_start}", f"{row + 1}.{col_start + 2}")
+
+    def paint_marks(self):
+        """Tag the marked bytes on screen, all in one tag_add call"""
+        self.display.tag_remove("match", "1.0", tk.END)
+        if not self.marks:
+            return
+        view_start = self.top_line * 16
+        view_end = view_start + self.visible_rows * 16
+        # Hits starting above the view may still reach into it
+        first = bisect_left(self.marks, view_start - self.mark_length + 1)
+        indices = []
+        for hit in self.marks[first:bisect_left(self.marks, view_end)]:
+            start, end = max(hit, view_start), min(hit + self.mark_length, view_end)
+            while start < end:  # One range per row the hit covers
+                row_end = min(end, start - start % 16 + 16)
+                row = start // 16 - self.top_line + 1
+                indices += [f"{row}.{(start % 16) * 3}", f"{row}.{((row_end - 1) % 16) * 3 + 2}"]
+                start = row_end
+        if indices:
+            self.display.tag_add("match", *indices)
+
+    def set_marks(self, offsets, length):
+        """Mark length bytes at each of the sorted offsets (search hits), retagging without a redraw"""
+        self.marks = offsets
+        self.mark_length = length
+        self.paint_marks()
+
+    def highlight(self, offset):
+        """Highlight the byte at offset (kept while scrolling)"""
+        self.highlight_offset = offset
+        self.paint_highlight()
+
+    def show_offset(self, offset):
+        """Scroll so offset is in the middle of the view and highlight it"""
+        self.highlight_offset = offset
+        self.top_line = self.clamp(offset // 16 - self.visible_rows // 2)
+        self.render()
+        row = offset // 16 - self.top_line + 1
+        self.display.mark_set("insert", f"{row}.{(offset % 16) * 3}")
+
+    def offset_at(self, index):
+        """ROM offset of the hex byte at a Text index, or None outside the hex columns"""
+        row, col = map(int, self.display.index(index).split("."))
+        if col >= HEX_WIDTH:
+            return None
+        offset = (self.top_line + row - 1) * 16 + col // 3
+        return offset if self.rows and offset < len(self.rows.data) else None
+
+class Minimap:
+    """Whole-ROM free space overview drawn on a Canvas beside the hex view.
+
+    Each pixel row summarizes one block of the ROM (see RomImage.block_map).
+    Block maps are cached per block size (zoom level) and only the blocks an
+    edit touches are reclassified. Clicking or dragging jumps to the block.
+    """
+    COLORS = {BLOCK_FREE_FF: "#4caf50", BLOCK_FREE_00: "#2196f3",
+              BLOCK_MIXED: "#ffc107", BLOCK_USED: "#606060"}
+
+    def __init__(self, canvas, jump):
+        self.canvas = canvas
+        self.jump = jump            # Called as jump(offset) on click
+        self.rom = None
+        self.cache = {}             # Block size -> bytearray of block classes
+        self.view = (0, 0)          # Byte range shown in the hex view
+        canvas.bind("<Configure>", lambda e: self.draw())
+        canvas.bind("<Button-1>", self.on_click)
+        canvas.bind("<B1-Motion>", self.on_click)
+
+    def set_rom(self, rom, cache=None):
+        """Show a new ROM, reusing its block maps (cache) from an earlier set_rom if given"""
+        self.rom = rom
+        self.cache = {} if cache is None else cache
+        self.draw()
+
+    def block_size(self):
+        """Bytes per pixel row at the current height, rounded up to whole hex rows"""
+        rows = max(1, self.canvas.winfo_height())
+        return max(16, (len(self.rom) + rows * 16 - 1) // (rows * 16) * 16)
+
+    def classes(self):
+        block_size = self.block_size()
+        if block_size not in self.cache:
+            self.cache[block_size] = self.rom.block_map(block_size)[1]
+        return self.cache[block_size]
+
+    def update(self, start, end):
+        """Reclassify the blocks covering bytes start .. end-1 at every cached zoom level"""
+        if not self.rom:
+            return
+        for block_size, classes in self.cache.items():
+            first, changed = self.rom.block_map(block_size, start, end)
+            classes[first:first + len(changed)] = changed
+        self.draw()
+
+    @instrumentation.timed("render: minimap")
+    def draw(self):
+        self.canvas.delete("all")
+        if not self.rom:
+            return
+        classes = self.classes()
+        width = self.canvas.winfo_width()
+        # One rectangle per stretch of rows with the same class
+        y = 0
+        while y < len(classes):
+            kind = classes[y]
+            end = y + 1
+            while end < len(classes) and classes[end] == kind:
+                end += 1
+            self.canvas.create_rectangle(0, y, width, end, fill=self.COLORS[kind], width=0)
+            y = end
+        self.draw_view()
+
+    def draw_view(self):
+        """Outline the part of the ROM shown in the hex view"""
+        self.canvas.delete("view")
+        if not self.rom:
+            return
+        block_size = self.block_size()
+        top = self.view[0] // block_size
+        bottom = max(top + 2, self.view[1] // block_size)
+        self.canvas.create_rectangle(0, top, self.canvas.winfo_width() - 1, bottom,
+                                     outline="red", tags="view")
+
+    def show_view(self, start, end):
+        self.view = (start, end)
+        self.draw_view()
+
+    def on_click(self, event):
+        if self.rom:
+            y = max(0, event.y)
+            self.jump(min(y * self.block_size(), len(self.rom) - 1))
+
 #----------------------------------------------------------------------
 # HEX EDITOR UTILITY FUNCTIONS
 #----------------------------------------------------------------------
 
 def hex_viewer(data):
     """Generate formatted hex view of binary data"""
-    lines = []
-    for i in range(0, len(data), 16):
-        hex_bytes = ' '.join(f'{b:02X}' for b in rom_data[i:i+16])
-        ascii_repr = ''.join(chr(b) if 32 <= b <= 126 else '.' for b in rom_data[i:i+16])
-        lines.append(f"{i:08X}\t{hex_bytes:<47}    {ascii_repr}")
-    return '\n'.join(lines)
-
-def update_hex_line_numbers():
-    """Update line numbers in hex editor"""
-    if not rom_data:
-        return
-    line_count = (len(rom_data) + 15) // 16
-    offsets = "\n".join(f"{i*16:08X}" for i in range(line_count))
-    hex_line_numbers.config(state='normal')
-    hex_line_numbers.delete("1.0", "end")
-    hex_line_numbers.insert("1.0", offsets)
-    hex_line_numbers.config(state='disabled')
-
-# 3. Replace on_hex_cursor_move with this version
+    return '\n'.join(f"{i*16:08X}\t{row}" for i, row in enumerate(format_rows(data)))
+
 def on_hex_cursor_move(event):
     """Track cursor position in hex display and update offset"""
-    try:
-        index = hex_display.index(tk.CURRENT)
-        line = int(index.split('.')[0]) - 1
-        col = int(index.split('.')[1])
-
-        # Ensure we're clicking on a hex byte, not ascii or spaces
-        if col >= 48:  # ASCII section
-            return
-            
-        byte_pos = col // 3
-        if byte_pos > 15:  # Out of range
-            return
-            
-        # Calculate the actual file offset accounting for virtual rendering
-        actual_line = current_view_start + line
-        offset = (actual_line * 16) + byte_pos
+    offset = hex_view.offset_at("insert")
+    if offset is None:  # ASCII section, past the end of the ROM or no ROM
+        return
 
-        # Update both offset displays with the same value
-        fmt = offset_format_var.get()
-        if fmt == "0x":
-            formatted_offset = f"0x{offset:X}"
-        elif fmt == "$":
-            formatted_offset = f"${offset:X}"
+    # Update both offset displays with the same value
+    formatted_offset = format_offset(offset, offset_format_var.get())
+    start_offset_var.set(formatted_offset)
+    search_offset_var.set(formatted_offset)
+
+    # Highlight the byte
+    hex_view.highlight(offset)
+
+def on_rom_edited(target, start, end):
+    """Edit notification from a ROM: drop the stale rows and repaint the visible ones"""
+    if target is not rom:
+        # Background job on another tab: its views are rebuilt when it is shown again
+        if target in rom_views:
+            cache, top_line, _ = rom_views[target]
+            cache.invalidate(start, end)
+            rom_views[target] = (cache, top_line, None)
+        return
+    row_cache.invalidate(start, end)
+    hex_view.repaint(start, end)
+    minimap.update(start, end)
+
+def on_rom_edited_any_thread(target, start, end):
+    """ROM listener; edits made by background jobs are repainted from the Tk thread"""
+    scheduler.run_on_ui(on_rom_edited, target, start, end)
+
+def jump_to_offset(offset):
+    """Fill in the Go to Offset field and scroll there"""
+    search_offset_var.set(format_offset(offset, offset_format_var.get()))
+    scroll_to_offset()
+
+def on_hex_key(event):
+    """Overwrite-mode hex editing: a hex digit replaces the nibble under the cursor"""
+    if event.state & 0x4:  # Leave Ctrl shortcuts (copy, undo...) alone
+        return None
+    if event.keysym in ("BackSpace", "Delete", "Return", "KP_Enter", "Tab"):
+        return "break"  # Bytes can only be overwritten, never inserted or removed
+    if not event.char or not event.char.isprintable():
+        return None  # Navigation keys
+    if not rom or event.char not in "0123456789abcdefABCDEF" or scheduler.busy(rom) or base_saving(rom):
+        return "break"  # No typing over a ROM a background job is working on
+
+    row, col = map(int, hex_display.index("insert").split("."))
+    if col % 3 == 2:  # On the gap between bytes: edit the next byte
+        col += 1
+    offset = hex_view.offset_at(f"{row}.{col}")
+    if offset is None:
+        return "break"
+
+    # Replace one nibble and write the byte (on_rom_edited repaints its row)
+    shift = 4 if col % 3 == 0 else 0
+    value = (rom.data[offset] & ~(0xF << shift)) | (int(event.char, 16) << shift)
+    rom.write(offset, bytes([value]))
+
+    # Move to the next nibble, scrolling when the cursor leaves the last row
+    if shift:
+        hex_display.mark_set("insert", f"{row}.{col + 1}")
+    elif offset + 1 < len(rom):
+        if (offset + 1) % 16:
+            hex_display.mark_set("insert", f"{row}.{col + 2}")
+        elif row < hex_view.visible_rows:
+            hex_display.mark_set("insert", f"{row + 1}.0")
         else:
-            formatted_offset = str(offset)
-            
-        # Update both fields
-        start_offset_var.set(formatted_offset)
-        search_offset_var.set(formatted_offset)
-        
-        # Highlight the byte
-        hex_display.tag_remove("highlight", "1.0", "end")
-        col_start = byte_pos * 3
-        hex_display.tag_add("highlight", f"{line+1}.{col_start}", f"{line+1}.{col_start+2}")
-
-    except Exception as e:
-        print(f"DEBUG: Error in on_hex_cursor_move - {e}")
-
-def update_hex_editor():
-    """Refresh hex editor display with current ROM data"""
-    if rom_data:
-        hex_display.delete("1.0", tk.END)
-        lines = []
-
-        for i in range(0, len(rom_data), 16):
-            hex_bytes = ' '.join(f'{b:02X}' for b in rom_data[i:i+16])
-            ascii_repr = ''.join(chr(b) if 32 <= b <= 126 else '.' for b in rom_data[i:i+16])
-            lines.append(f"{hex_bytes:<47}    {ascii_repr}")
-
-        chunk_size = 256
-        for i in range(0, len(lines), chunk_size):
-            hex_display.insert(tk.END, "\n".join(lines[i:i+chunk_size]) + "\n")
-            hex_display.update_idletasks()
-
-        hex_display.see("1.0")
-        update_hex_line_numbers()
-
-def update_rom_data_from_hex_editor():
-    """Sync changes from hex editor back to ROM data"""
-    global rom_data
-    try:
-        lines = hex_display.get("1.0", tk.END).splitlines()
-        new_data = bytearray()
-
-        for line in lines:
-            hex_part = line[:47].strip()
-            if not hex_part:
-                continue
-            hex_bytes = hex_part.split()
-            new_data.extend(int(b, 16) for b in hex_bytes)
-
-        rom_data = bytes(new_data)
-    except Exception as e:
-        messagebox.showerror("Error", f"Failed to update ROM data from editor:\n{e}")
+            hex_view.scroll_by(1)
+            hex_display.mark_set("insert", f"{row}.0")
+    return "break"
 
 # Highlight management
 def highlight_byte(offset):
     """Highlight the byte at the specified offset"""
-    if not rom_data or offset >= len(rom_data):
+    if not rom or offset >= len(rom):
         return
-        
-    # Calculate line and column for this offset
-    line = offset // 16 + 1  # +1 because text widget lines start at 1
-    col_offset = offset % 16
-    col_start = col_offset * 3  # Each byte takes 3 characters (2 hex digits + 1 space)
-    
-    # Clear any existing highlights
-    hex_display.tag_remove("highlight", "1.0", "end")
-    
-    # Create highlight tag if it doesn't exist
-    if not "highlight" in hex_display.tag_names():
-        hex_display.tag_configure("highlight", background="yellow", foreground="black")
-        
-    # Apply the highlight to the byte at the offset position
-    hex_display.tag_add("highlight", f"{line}.{col_start}", f"{line}.{col_start+2}")
+    hex_view.highlight(offset)
 
 #----------------------------------------------------------------------
 # ROM FILE OPERATIONS
 #----------------------------------------------------------------------
 
-def browse_file():
+def browse_file(new_tab=False):
     """Open file dialog to select a ROM"""
-    global rom_data, rom_path
     path = filedialog.askopenfilename(title="Select a GBA ROM", filetypes=[("GBA ROM", "*.gba")])
     if path:
-        rom_path = path
-        load_rom_threaded(path)
+        load_rom_threaded(path, new_tab)
+
+def show_rom(target):
+    """Make target the active ROM: the hex view, finder and tools all work on it"""
+    global rom, row_cache
+    if rom is not None and rom is not target:
+        rom_views[rom] = (row_cache, hex_view.top_line, minimap.cache)
+    rom = target
+    if target is None:
+        row_cache = None
+        hex_view.set_rows(None)
+        minimap.set_rom(None)
+        rom_status_var.set("No ROM loaded.")
+        rom_status_label.config(fg="red")
+        disable_rom_controls()
+        return
+    row_cache, top_line, minimap_cache = rom_views.pop(target, (RowCache(target.data), 0, None))
+    hex_view.set_rows(row_cache)
+    hex_view.scroll_to(top_line)
+    minimap.set_rom(target, minimap_cache)
+    status = f"ROM: {os.path.basename(target.path)} ({len(target)} bytes)"
+    if target.data.is_shared:
+        status += f", {workspace.shared_fraction(target):.0%} shared with {os.path.basename(workspace.base.path)}"
+    rom_status_var.set(status)
+    rom_status_label.config(fg="blue")
+    enable_rom_controls()
+
+def on_rom_tab_changed(event):
+    """Switch the active ROM when another ROM tab is selected"""
+    if not rom_tabs.tabs():
+        return
+    target = workspace.roms[rom_tabs.index("current")]
+    if target is not rom:
+        show_rom(target)
+
+def close_rom(target=None, confirm=True):
+    """Close a ROM tab (the active one by default), asking first if it has unsaved changes"""
+    global rom
+    target = target or rom
+    if target is None:
+        return
+    if scheduler.busy(target):
+        messagebox.showerror("Error", "Wait for the ROM's background work to finish first.")
+        return
+    if confirm and target.is_modified and not messagebox.askyesno(
+            "Close ROM", f"{os.path.basename(target.path)} has unsaved changes. Close it anyway?"):
+        return
+    index = workspace.roms.index(target)
+    rom_views.pop(target, None)
+    if target is rom:
+        rom = None  # Nothing to remember for a closed tab
+    workspace.close(target)
+    rom_tabs.forget(index)
+    if not workspace.roms:
+        show_rom(None)
 
 def load_last_rom():
     """Attempt to load the most recently opened ROM"""
@@ -236,9 +560,22 @@ def load_last_rom():
     except Exception:
         messagebox.showerror("Error", "No previous ROM found.")
 
-def load_rom_threaded(path):
-    """Load ROM file with virtual rendering for the hex editor"""
-    global rom_path, total_line_count, current_view_start, loading_popup, progress_queue
+def load_rom_threaded(path, new_tab=False):
+    """Load ROM file with virtual rendering for the hex editor (into the current tab unless new_tab)"""
+    if scheduler.busy("workspace"):
+        messagebox.showerror("Error", "A ROM is already being loaded.")
+        return
+    replaced = None if new_tab else rom  # Closed once the new ROM has loaded
+    if replaced is not None:
+        if scheduler.busy(replaced):
+            messagebox.showerror("Error", "Wait for the current ROM's background work to finish first.")
+            return
+        if replaced.is_modified and not messagebox.askyesno(
+                "Open ROM", f"{os.path.basename(replaced.path)} has unsaved changes. Replace it anyway?"):
+            return
+    # A ROM replacing the base can't share the base's pages, as the base is about to close
+    share = replaced is None or replaced is not workspace.base
+
     loading_popup = Toplevel(root)
     loading_popup.title("Loading ROM")
     loading_popup.geometry("400x160")
@@ -249,342 +586,319 @@ def load_rom_threaded(path):
     load_progress.pack(pady=(0, 10))
     load_progress["value"] = 0
 
-    progress_queue = queue.Queue()
-    rom_path = path
+    use_mmap = mmap_rom_var.get()
+    cache = analysis_cache if cache_analysis_var.get() else None
+    load_start_time = time.time()
 
-    def update_progress_ui():
-        """Update UI from progress queue"""
-        try:
-            while not progress_queue.empty():
-                which, value, message = progress_queue.get_nowait()
-                if which == "load":
-                    load_progress["value"] = value
-                    if message:
-                        loading_label.config(text=message)
-        except Exception as e:
-            print(f"UI update error: {e}")
-        finally:
-            if loading_popup.winfo_exists():
-                loading_popup.after(50, update_progress_ui)
-
-    def load_and_update():
+    def load(job):
         """Worker thread for loading ROM"""
-        import time
-        global rom_data, rom_data_original, total_line_count, current_view_start 
-        load_start_time = time.time()
-
+        # Map (or read) the ROM and index its free space
+        file_size = os.path.getsize(path)
+        job.progress(0, f"Loading ROM ({file_size/1024/1024:.1f} MB)...")
+        # ROMs after the first only keep the pages that differ from it
+        loaded = workspace.open(path, use_mmap, job.progress, cache, share)
         try:
-            # Load the full ROM into memory
-            file_size = os.path.getsize(path)
-            progress_queue.put(("load", 0, f"Loading ROM ({file_size/1024/1024:.1f} MB)..."))
-            
-            rom_bytes = bytearray()
-            read_total = 0
-            with open(path, 'rb') as f:
-                while True:
-                    chunk = f.read(16384)
-                    if not chunk:
-                        break
-                    rom_bytes.extend(chunk)
-                    read_total += len(chunk)
-                    percent = int((read_total / file_size) * 100)
-                    progress_queue.put(("load", percent, None))
-
-            # Store both copies of the ROM data
-            rom_data_original = bytes(rom_bytes)  # Store original copy
-            rom_data = bytes(rom_bytes)           # Working copy for edits
-            
-            progress_queue.put(("load", 100, "Preparing virtual hex view..."))
-            
-            # Reset view state
-            current_view_start = 0
-            total_line_count = (len(rom_data) + 15) // 16
-            
-            # Prepare the hex editor
-            hex_display.config(state='normal')
-            hex_display.delete("1.0", tk.END)
-            
-            # Set up scrollbar settings
-            hex_scroll.config(command=on_virtual_scroll)
-            
-            # Render initial view
-            render_visible_region()
-            update_hex_line_numbers_virtual()
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"An error occurred while loading the ROM:\n{e}")
-        finally:
-            if loading_popup.winfo_exists():
-                loading_popup.destroy()
-            rom_status_label.config(fg="blue")
-            enable_rom_controls()
-            load_end_time = time.time()
-            duration = load_end_time - load_start_time
-            rom_status_var.set(f"ROM loaded: {os.path.basename(path)} ({len(rom_data)} bytes) in {duration:.2f} sec")
-            with open("last_rom_path.txt", "w") as f:
-                f.write(path)
-
-    # Start the progress update timer
-    update_progress_ui()
-    
-    # Start the loading thread
-    threading.Thread(target=load_and_update, daemon=True).start()
-    
-def on_virtual_scroll(*args):
-    """Handle scrolling in virtual mode"""
-    # Handle scrollbar commands
-    hex_display.yview(*args)
-    hex_line_numbers.yview(*args)
-    
-    # Get the new position
-    start, end = hex_display.yview()
-    
-    # Calculate the first visible line
-    visible_start = int(start * total_line_count)
-    
-    # Check if we need to update the view
-    buffer_top = max(0, current_view_start)
-    buffer_bottom = min(total_line_count, current_view_start + view_buffer_size * 2)
-    
-    # If scrolled outside the buffered area, re-render
-    if visible_start < buffer_top + view_buffer_size//2 or visible_start > buffer_bottom - view_buffer_size//2:
-        # Update rendering in a slight delay to avoid multiple renders during fast scrolling
-        hex_display.after(10, render_visible_region)
-    
-def render_visible_region():
-    """Render only the current visible region plus buffer"""
-    global current_view_start
-    
-    if not rom_data:
+            # Build the pointer index now rather than on the first search
+            job.progress(100, "Indexing pointers...")
+            loaded.pointer_index
+            job.progress(100, "Preparing hex view...")
+        except BaseException:
+            workspace.close(loaded)
+            raise
+        loaded.listeners.append(partial(on_rom_edited_any_thread, loaded))
+        return loaded
+
+    def on_progress(percent, message):
+        load_progress["value"] = percent
+        if message:
+            loading_label.config(text=message)
+
+    def on_done(loaded):
+        if replaced in workspace.roms:
+            close_rom(replaced, confirm=False)
+        # Add its tab and show the first page of the ROM and its free space overview
+        rom_tabs.add(tk.Frame(rom_tabs, height=0), text=os.path.basename(path))
+        show_rom(loaded)
+        rom_tabs.select(len(workspace.roms) - 1)
+        duration = time.time() - load_start_time
+        rom_status_var.set(f"{rom_status_var.get()}, loaded in {duration:.2f} sec")
+        with open("last_rom_path.txt", "w") as f:
+            f.write(path)
+
+    def on_finish():
+        if loading_popup.winfo_exists():
+            loading_popup.destroy()
+        if job.cancelled and rom is None:
+            rom_status_var.set("Loading cancelled.")
+
+    job = scheduler.submit("Load ROM", load, key="workspace", on_progress=on_progress, on_done=on_done,
+                           on_error=lambda e: messagebox.showerror(
+                               "Error", f"An error occurred while loading the ROM:\n{e}"),
+                           on_finish=on_finish)
+    tk.Button(loading_popup, text="Cancel", command=job.cancel).pack()
+    loading_popup.protocol("WM_DELETE_WINDOW", job.cancel)
+
+def run_rom_job(name, func, *args, on_done=None, on_error=None, on_finish=None, target=None):
+    """Run func(job, *args) on a ROM (the active one by default) in the background, with progress in the status bar"""
+    status = rom_status_var.get()
+    rom_status_var.set(f"{name}...")
+
+    def on_progress(percent, message):
+        rom_status_var.set(f"{name}: {message or f'{percent}%'}")
+
+    def finish():
+        if job.cancelled:
+            rom_status_var.set(f"{name} cancelled.")
+        elif rom_status_var.get().startswith(name):
+            rom_status_var.set(status)  # Put the ROM status back unless a callback set its own
+        if on_finish:
+            on_finish()
+
+    job = scheduler.submit(name, func, *args, key=target or rom, on_progress=on_progress, on_done=on_done,
+                           on_error=on_error or (lambda e: messagebox.showerror("Error", f"{name} failed:\n{e}")),
+                           on_finish=finish)
+    return job
+
+def base_saving(target):
+    """True while the base ROM, which target reads shared pages from, is being saved"""
+    return target.data.is_shared and workspace.base in saving
+
+def cancel_jobs():
+    """Cancel every background job"""
+    scheduler.cancel_all()
+
+def pump_jobs():
+    """Deliver background job results and progress on the Tk thread, then check again shortly"""
+    try:
+        scheduler.pump()
+        cancel_button.config(state='normal' if scheduler.busy() else 'disabled')
+    finally:
+        root.after(50, pump_jobs)
+
+def save_rom():
+    if not rom:
+        messagebox.showerror("Error", "No ROM loaded.")
+        return
+
+    def on_done(saved):
+        rom_status_var.set(f"{os.path.basename(saved.path)}: {saved.describe()}")
+        if saved.backup_path:
+            messagebox.showinfo("ROM Saved", f"ROM saved and backup created at:\n{saved.backup_path}")
+
+    # Write the changed ranges (or the whole image, atomically), backing up the file on first save
+    saved_rom = rom
+    saving.append(saved_rom)
+    run_rom_job("Saving ROM", lambda job, target, atomic: workspace.save(target, atomic=atomic),
+                rom, atomic_save_var.get(), on_done=on_done,
+                on_error=lambda e: messagebox.showerror("Error", f"Failed to save ROM:\n{e}"),
+                on_finish=lambda: saving.remove(saved_rom))
+
+def export_patch():
+    """Export the edits made since the ROM was opened/saved as an IPS/UPS/BPS patch"""
+    if not rom:
+        messagebox.showerror("Error", "No ROM loaded.")
         return
-    
-    # Get the current position in the view
-    start, end = hex_display.yview()
-    
-    # Calculate the first visible line
-    visible_start = int(start * total_line_count)
-    
-    # Calculate render range with buffer
-    render_start = max(0, visible_start - view_buffer_size)
-    render_end = min(total_line_count, visible_start + view_buffer_size)
-    
-    # Save scroll position
-    current_position = hex_display.yview()
-    
-    # Clear and rebuild the display
-    hex_display.config(state='normal')
-    hex_display.delete("1.0", tk.END)
-    
-    # Format and insert only the lines in our render range
-    lines = []
-    for i in range(render_start, render_end):
-        offset = i * 16
-        chunk_end = min(offset + 16, len(rom_data))
-        hex_bytes = ' '.join(f'{b:02X}' for b in rom_data[offset:chunk_end])
-        hex_bytes = f"{hex_bytes:<47}"
-        ascii_repr = ''.join(chr(b) if 32 <= b <= 126 else '.' for b in rom_data[offset:chunk_end])
-        lines.append(f"{hex_bytes}    {ascii_repr}")
-    
-    hex_display.insert("1.0", "\n".join(lines))
-    
-    # Track the new view boundaries
-    current_view_start = render_start
-    
-    # Set internal yview so Tkinter knows total content size
-    # This requires a bit of a trick with ROW_COUNT dummy lines
-    total_height = total_line_count
-    first_visible = render_start / total_height
-    size_ratio = min(1.0, (render_end - render_start) / total_height)
-    
-    # Update scrolling
-    hex_display.yview_moveto(first_visible)
-    hex_scroll.set(start, end)  # Preserve scroll position
-    
-    # Update line numbers for the rendered region
-    update_hex_line_numbers_virtual()
-    hex_scroll.set(start, end)
-
-
-def update_hex_line_numbers_virtual():
-    """Update line numbers for virtual rendering"""
-    if not rom_data:
+    if scheduler.busy(rom) or base_saving(rom):
+        messagebox.showerror("Error", "Wait for the ROM's background work to finish first.")
         return
-    
-    hex_line_numbers.config(state='normal')
-    hex_line_numbers.delete("1.0", "end")
-    
-    # Only render line numbers for visible area
-    offsets = "\n".join(f"{(current_view_start+i)*16:08X}" for i in range(view_buffer_size * 2))
-    hex_line_numbers.insert("1.0", offsets)
-    hex_line_numbers.config(state='disabled')
-
-# Update the hex editor's scroll binding
-   
-def after_scroll():
-    """Handle scroll events with slight delay to avoid multiple renders"""
-    hex_display.after(10, render_visible_region)
-
-def setup_virtual_hex_editor():
-    # Update scrollbar command
-    hex_scroll.config(command=on_virtual_scroll)
-    
-    # Bind additional scroll events
-    hex_display.bind("<MouseWheel>", lambda e: after_scroll())
-    hex_display.bind("<Up>", lambda e: after_scroll())
-    hex_display.bind("<Down>", lambda e: after_scroll())
-    hex_display.bind("<Prior>", lambda e: after_scroll())  # Page Up
-    hex_display.bind("<Next>", lambda e: after_scroll())   # Page Down
-    
-    # Update initial state
-    total_line_count = (len(rom_data) + 15) // 16 if rom_data else 0
+    if not rom.is_modified:
+        messagebox.showinfo("Export Patch", "There are no changes to export.")
+        return
+    path = filedialog.asksaveasfilename(
+        title="Export Patch", defaultextension=".bps",
+        initialfile=os.path.splitext(os.path.basename(rom.path))[0],
+        filetypes=[("BPS Patch", "*.bps"), ("UPS Patch", "*.ups"), ("IPS Patch", "*.ips")])
+    if not path:
+        return
+    fmt = os.path.splitext(path)[1].lstrip(".").lower()
+    try:
+        patch = rom.make_patch(fmt)
+        with open(path, 'wb') as f:
+            f.write(patch)
+    except (OSError, ValueError) as e:
+        messagebox.showerror("Error", f"Failed to export patch:\n{e}")
+        return
+    rom_status_var.set(f"Exported {fmt.upper()} patch: {os.path.basename(path)} ({len(patch)} bytes)")
 
-def save_rom():
-    global rom_data, rom_data_original, rom_path
-    if not rom_data:
+def apply_patch():
+    """Apply an IPS/UPS/BPS patch to the loaded ROM"""
+    if not rom:
         messagebox.showerror("Error", "No ROM loaded.")
         return
-    
-    # Create backup
-    backup_path = rom_path + ".bak"
-    shutil.copyfile(rom_path, backup_path)
-    
-    # Save complete working copy
-    with open(rom_path, 'wb') as f:
-        f.write(rom_data)
-    
-    # Update original reference to match saved state
-    rom_data_original = bytes(rom_data)
-    
-    messagebox.showinfo("ROM Saved", f"ROM saved and backup created at:\n{backup_path}")
+    if scheduler.busy(rom) or base_saving(rom):
+        messagebox.showerror("Error", "Wait for the ROM's background work to finish first.")
+        return
+    path = filedialog.askopenfilename(
+        title="Apply Patch", filetypes=[("ROM Patches", "*.ips *.ups *.bps"), ("All Files", "*.*")])
+    if not path:
+        return
+    try:
+        with open(path, 'rb') as f:
+            patch = f.read()
+    except OSError as e:
+        messagebox.showerror("Error", f"Failed to apply patch:\n{e}")
+        return
+
+    def applied(count):
+        rom_status_var.set(f"Applied {os.path.basename(path)} ({count} changes). Save the ROM to keep them.")
+
+    run_rom_job("Applying patch", lambda job, target: target.apply_patch(patch), rom, on_done=applied,
+                on_error=lambda e: messagebox.showerror("Error", f"Failed to apply patch:\n{e}"))
 
 #----------------------------------------------------------------------
 # FREE SPACE FINDER FUNCTIONS
 #----------------------------------------------------------------------
 
-def parse_offset(raw, fmt):
-    """Parse offset string based on format (0x, $, plain)"""
-    raw = raw.strip()
-    if fmt == "0x":
-        if not raw.lower().startswith("0x"):
-            raise ValueError("Expected offset to start with '0x'")
-        return int(raw, 16)
-    elif fmt == "$":
-        if not raw.startswith("$"):
-            raise ValueError("Expected offset to start with '$'")
-        return int(raw[1:], 16)
-    elif fmt == "plain":
-        try:
-            return int(raw, 16)
-        except ValueError:
-            return int(raw)
-    else:
-        raise ValueError("Invalid format type.")    
-
 def is_range_free(start, size, check_byte):
     """Check if a block of memory is filled with a specific byte value"""
-    global rom_data
-    block = bytes([check_byte] * size)
-    return rom_data[start:start+size] == block
+    return rom.is_range_free(start, size, check_byte)
+
+def read_search_options():
+    """Return (start, size, skip, fillers, tolerance, alignment) from the finder fields; ValueError if invalid"""
+    fmt = offset_format_var.get()
+    start_offset = parse_offset(start_offset_var.get(), fmt)
+    needed_size = int(size_var.get())
+    skip_interval = int(skip_interval_var.get()) if skip_interval_var.get() else 0
+    fillers = parse_fillers(search_type.get())
+    tolerance = int(tolerance_var.get()) if tolerance_var.get() else 0
+    alignment = int(align_var.get())
+    return start_offset, needed_size, skip_interval, fillers, tolerance, alignment
 
 def search_free_space():
     """Find a block of free space in ROM and provide detailed information"""
-    global rom_data
-    if not rom_data:
+    if not rom:
         messagebox.showerror("Error", "Please load a ROM first.")
         return
 
     try:
-        fmt = offset_format_var.get()
-        start_offset = parse_offset(start_offset_var.get(), fmt)
-        needed_size = int(size_var.get())
-        skip_interval = int(skip_interval_var.get()) if skip_interval_var.get() else 0
-        selected_type = search_type.get()
-        check_val = 0xFF if selected_type == "FF" else 0x00
+        start_offset, needed_size, skip_interval, fillers, tolerance, alignment = read_search_options()
     except ValueError as e:
         messagebox.showerror("Error", f"Offset error: {e}")
         return
 
     fs_output.delete("1.0", tk.END)
-    fs_output.insert(tk.END, f"Searching for {needed_size} bytes of 0x{check_val:02X}...\n")
-    fs_output.update()
-
-    # Find the free space
-    found = False
-    for i in range(start_offset, len(rom_data) - needed_size - skip_interval + 1):
-        # Check if block starts with our search value
-        if rom_data[i] == check_val:
-            # Count consecutive bytes of our search value
-            j = i
-            while j < len(rom_data) and rom_data[j] == check_val:
-                j += 1
-            
-            # Calculate block size
-            block_size = j - i
-            
-            # If block is large enough (including skip interval)
-            if block_size >= needed_size + skip_interval:
-                found = True
-                
-                # Find where the next non-free block starts
-                next_block_start = j
-                
-                # Find the next free block after this one
-                next_free_start = None
-                for k in range(j, min(len(rom_data), j + 1000)):  # Look ahead a bit more
-                    if rom_data[k] == check_val:
-                        # Count consecutive free bytes
-                        consecutive = 1
-                        while k + consecutive < len(rom_data) and rom_data[k + consecutive] == check_val:
-                            consecutive += 1
-                        if consecutive >= needed_size:  # Only report if it's a usable block
-                            next_free_start = k
-                            break
-                
-                # Format the results with detailed information
-                result = (
-                    f"Start: 0x{i:X}\n"
-                    f"End: 0x{i + needed_size - 1 + skip_interval:X}\n"
-                    f"Size requested: {needed_size} bytes\n"
-                    f"Skip interval: {skip_interval} bytes\n"
-                    f"Total allocation: {needed_size + skip_interval} bytes\n"
-                    f"Total free block size: {block_size} bytes\n"
-                    f"Remaining in block: {block_size - needed_size - skip_interval} bytes\n"
-                    f"Next available offset: 0x{i + needed_size + skip_interval:X}\n"
-                    f"Block extends to: 0x{j-1:X}\n"
-                )
-                
-                # Add info about the next block of data
-                if next_block_start < len(rom_data):
-                    bytes_until_next_allocated = 0
-                    if next_free_start:
-                        result += f"Next usable free block ({needed_size}+ bytes): 0x{next_free_start:X}\n"
-                        bytes_until_next_allocated = next_free_start - next_block_start
-                        result += f"Bytes of allocated data between: {bytes_until_next_allocated}\n"
-                
-                fs_output.delete("1.0", tk.END)
-                fs_output.insert(tk.END, result)
-                
-                # Update the navigation field for convenience
-                fmt = offset_format_var.get()
-                if fmt == "0x":
-                    search_offset_var.set(f"0x{i:X}")
-                elif fmt == "$":
-                    search_offset_var.set(f"${i:X}")
-                else:
-                    search_offset_var.set(str(i))
-                
-                # Auto-scroll to the found offset
-                scroll_to_offset()
-                return
-    
-    if not found:
+    fs_output.insert(tk.END, f"Searching for {needed_size} bytes of {format_fillers(fillers)}...\n")
+    searched = rom
+
+    def on_done(result):
+        if result is None:
+            fs_output.delete("1.0", tk.END)
+            fs_output.insert(tk.END, f"No free space of {needed_size + skip_interval} bytes ({format_fillers(fillers)}) found starting from offset 0x{start_offset:X}.")
+            return
+
         fs_output.delete("1.0", tk.END)
-        fs_output.insert(tk.END, f"No free space of {needed_size + skip_interval} bytes (0x{check_val:02X}) found starting from offset 0x{start_offset:X}.")
+        fs_output.insert(tk.END, result.describe())
+        if searched is not rom:
+            return  # Another tab is showing now, leave the hex view alone
+
+        # Update the navigation field for convenience
+        search_offset_var.set(format_offset(result.start, offset_format_var.get()))
+
+        # Auto-scroll to the found offset
+        scroll_to_offset()
+
+    # Find the free space in the background, so long scans can be cancelled
+    run_rom_job("Searching", lambda job: searched.find_free_space(
+        needed_size, fillers, start_offset, skip_interval, alignment, tolerance, references=True), on_done=on_done)
+
+def find_all_free_space():
+    """List every free block matching the finder settings, loading more as the list scrolls"""
+    if not rom:
+        messagebox.showerror("Error", "Please load a ROM first.")
+        return
+    try:
+        start_offset, needed_size, skip_interval, fillers, tolerance, alignment = read_search_options()
+    except ValueError as e:
+        messagebox.showerror("Error", f"Offset error: {e}")
+        return
+    searched = rom
+    fmt = offset_format_var.get()
+
+    find_all_top = tk.Toplevel(root)
+    find_all_top.title(f"Find All: {needed_size + skip_interval} bytes of {format_fillers(fillers)}")
+    find_all_top.geometry("560x560")
+
+    summary_var = tk.StringVar()
+    tk.Label(find_all_top, textvariable=summary_var, anchor="w").pack(fill='x', padx=10, pady=(10, 0))
+
+    list_frame = tk.Frame(find_all_top)
+    list_frame.pack(fill='both', expand=True, padx=10, pady=10)
+    columns = ("offset", "size", "end", "pointers")
+    blocks_tree = ttk.Treeview(list_frame, columns=columns, show="headings", selectmode="browse")
+    for column, width in zip(columns, (120, 120, 120, 80)):
+        blocks_tree.column(column, width=width, anchor="e")
+    blocks_tree_scrollbar = ttk.Scrollbar(list_frame, orient="vertical", command=blocks_tree.yview)
+    blocks_tree_scrollbar.pack(side="right", fill="y")
+    blocks_tree.pack(side="left", fill='both', expand=True)
+
+    # The list being shown, and whether a page of it is loading
+    state = {"blocks": None, "loading": False}
+
+    def show_summary():
+        blocks = state["blocks"]
+        more = "" if blocks.exhausted else " so far, scroll down for more"
+        summary_var.set(f"{len(blocks)} free blocks{more} (click a column to sort, a block to jump to it)")
+
+    def load_page(job, blocks):
+        page = blocks.load_page()
+        return blocks, page, [len(searched.references(start, end - start)) for start, end in page]
+
+    def on_page(result):
+        blocks, page, pointers = result
+        if blocks is not state["blocks"] or not find_all_top.winfo_exists():
+            return  # Re-sorted (or closed) while the page was loading
+        for (start, end), count in zip(page, pointers):
+            blocks_tree.insert("", "end", iid=str(start), values=(
+                format_offset(start, fmt), end - start, format_offset(end - 1, fmt), count or ""))
+        show_summary()
+
+    def on_page_finished():
+        state["loading"] = False
+        if find_all_top.winfo_exists() and blocks_tree.yview()[1] >= 0.9:
+            load_more()  # Still at the bottom of the list
+
+    def load_more():
+        blocks = state["blocks"]
+        if state["loading"] or blocks.exhausted:
+            return
+        state["loading"] = True
+        summary_var.set(f"{len(blocks)} free blocks, loading more...")
+        run_rom_job("Finding all free blocks", load_page, blocks, on_done=on_page,
+                    on_finish=on_page_finished, target=searched)
+
+    def show_order(order):
+        """Restart the list in another order"""
+        state["blocks"] = FreeBlockList(searched, needed_size, fillers, start_offset, skip_interval,
+                                        alignment, tolerance, order)
+        blocks_tree.delete(*blocks_tree.get_children())
+        arrows = {"offset": ("offset", " \u25b2"), "largest": ("size", " \u25bc"), "smallest": ("size", " \u25b2")}
+        sorted_column, arrow = arrows[order]
+        for column, title in zip(columns, ("Offset", "Free Bytes", "Block End", "Pointers")):
+            blocks_tree.heading(column, text=title + (arrow if column == sorted_column else ""))
+        load_more()
+
+    def on_scroll(first, last):
+        blocks_tree_scrollbar.set(first, last)
+        if float(last) >= 0.9:
+            load_more()
+
+    def on_select(event):
+        selection = blocks_tree.selection()
+        if not selection or searched is not rom:
+            return
+        search_offset_var.set(format_offset(int(selection[0]), offset_format_var.get()))
+        scroll_to_offset()
+
+    blocks_tree.configure(yscrollcommand=on_scroll)
+    blocks_tree.bind("<<TreeviewSelect>>", on_select)
+    blocks_tree.heading("offset", command=lambda: show_order("offset"))
+    blocks_tree.heading("size", command=lambda: show_order(
+        "smallest" if state["blocks"].order == "largest" else "largest"))
+    show_order("offset")
 
 # 2. Replace scroll_to_offset function with this version
 def scroll_to_offset():
     """Scroll the hex editor to a specific offset and highlight it"""
-    global current_view_start, total_line_count
     raw = search_offset_var.get().strip()
     fmt = offset_format_var.get()
 
@@ -605,62 +919,18 @@ def scroll_to_offset():
         else:
             raise ValueError("Invalid format selection.")
 
-        if offset < 0 or offset >= len(rom_data):
+        if offset < 0 or offset >= len(rom):
             raise ValueError("Offset out of bounds.")
 
-        # Calculate line number and position within line
-        target_line = offset // 16
-        byte_pos = offset % 16
-        
-        # Force a complete re-render centered on the target line
-        view_start = max(0, target_line - (view_buffer_size // 2))
-        view_end = min(total_line_count, view_start + view_buffer_size * 2)
-        
-        # Update the current view state
-        current_view_start = view_start
-        
-        # Clear the display before rendering
-        hex_display.config(state='normal')
-        hex_display.delete("1.0", tk.END)
-        
-        # Format and insert only the lines in our render range
-        lines = []
-        for i in range(view_start, view_end):
-            offset_i = i * 16
-            chunk_end = min(offset_i + 16, len(rom_data))
-            hex_bytes = ' '.join(f'{b:02X}' for b in rom_data[offset_i:chunk_end])
-            hex_bytes = f"{hex_bytes:<47}"
-            ascii_repr = ''.join(chr(b) if 32 <= b <= 126 else '.' for b in rom_data[offset_i:chunk_end])
-            lines.append(f"{hex_bytes}    {ascii_repr}")
-        
-        hex_display.insert("1.0", "\n".join(lines))
-        
-        # Update line numbers for the rendered region
-        update_hex_line_numbers_virtual()
-        
-        # Calculate widget position (line in the visible area)
-        widget_line = target_line - view_start + 1  # +1 because text widget lines start at 1
-        col_start = byte_pos * 3  # Each byte is 2 hex digits + 1 space
-        
-        # Force the widget to update
-        hex_display.update()
-        
-        # Clear existing highlights
-        hex_display.tag_remove("highlight", "1.0", "end")
-        
-        # Apply new highlight
-        hex_display.tag_add("highlight", f"{widget_line}.{col_start}", f"{widget_line}.{col_start+2}")
-        
-        # Scroll to position with extra space around
-        hex_display.see(f"{widget_line}.0")
-        hex_display.update()
+        # Center the offset in the view and highlight it
+        hex_view.show_offset(offset)
 
     except ValueError as e:
         messagebox.showerror("Error", f"Invalid offset: {e}")
 
 def calculate_offset():
     """Calculate end offset based on start offset and size"""
-    if not rom_data:
+    if not rom:
         messagebox.showerror("Error", "No ROM loaded.")
         return
     try:
@@ -675,21 +945,27 @@ def calculate_offset():
 
         end = start_int + size - 1
 
-        if start_int < 0 or end >= len(rom_data):
+        if start_int < 0 or end >= len(rom):
             raise ValueError("Offset out of bounds.")
 
         result = f"0x{end:X}"
         pyperclip.copy(result)
 
-        ff_free = is_range_free(start_int, size, 0xFF)
-        zero_free = is_range_free(start_int, size, 0x00)
-
-        if ff_free or zero_free:
-            calc_output.config(fg="blue")
-            msg = f"End Offset: {result}\nDesignated range is free."
+        alignment = int(calc_align_var.get())
+        aligned_start = align_up(start_int, alignment)
+        align_msg = ""
+        if aligned_start != start_int:
+            align_msg = f"\nNot {alignment}-byte aligned (next aligned: 0x{aligned_start:X})"
+
+        references = rom.references(start_int, size)
+        if rom.free_value(start_int, size) is not None:
+            calc_output.config(fg="darkorange" if references else "blue")
+            msg = f"End Offset: {result}\nDesignated range is free.{align_msg}"
+            if references:
+                msg += "\n" + describe_references(references)
         else:
             calc_output.config(fg="red")
-            msg = f"End Offset: {result}\nWARNING: Range includes offsets used by the ROM!"
+            msg = f"End Offset: {result}\nWARNING: Range includes offsets used by the ROM!{align_msg}"
 
         calc_output.config(state='normal')
         calc_output.delete("1.0", tk.END)
@@ -942,17 +1218,16 @@ def calculate_difference():
         result = size
         
         # Check if the range is free (all 0xFF or all 0x00)
-        ff_free = is_range_free(start, size, 0xFF)
-        zero_free = is_range_free(start, size, 0x00)
+        free_value = rom.free_value(start, size)
         
         # Format the result message
-        if ff_free or zero_free:
-            calc_output.config(fg="blue")
+        if free_value is not None:
+            references = rom.references(start, size)
+            calc_output.config(fg="darkorange" if references else "blue")
             msg = f"Byte Difference: {result} bytes\n"
-            if ff_free:
-                msg += "Range is free (0xFF)"
-            else:
-                msg += "Range is free (0x00)"
+            msg += f"Range is free (0x{free_value:02X})"
+            if references:
+                msg += "\n" + describe_references(references)
         else:
             calc_output.config(fg="red")
             msg = f"Byte Difference: {result} bytes\nWARNING: Range includes offsets used by the ROM!"
@@ -971,8 +1246,7 @@ def calculate_difference():
 
 def erase_range():
     """Erase a range of bytes in the ROM"""
-    global rom_data
-    if not rom_data:
+    if not rom:
         messagebox.showerror("Error", "No ROM loaded.")
         return
     confirm = messagebox.askyesno(
@@ -982,29 +1256,26 @@ def erase_range():
     )
     if not confirm:
         return
+    if base_saving(rom):
+        messagebox.showerror("Error", "Wait for the base ROM to finish saving first.")
+        return
     try:
         start = parse_offset_str(er_start_range.get())
         end = parse_offset_str(er_end_range.get())
-        value = 0xFF if byte_type_range.get() == "FF" else 0x00
+        value = FILL_TYPES[byte_type_range.get()]
 
-        if start > end or end >= len(rom_data):
+        if start > end or end >= len(rom):
             raise ValueError("Invalid range")
 
-        temp_data = bytearray(rom_data)
-        for i in range(start, end + 1):
-            temp_data[i] = value
-
-        rom_data = bytes(temp_data)
-        messagebox.showinfo("Success", f"Erased bytes from 0x{start:X} to 0x{end:X}")
-        update_hex_editor()
+        run_rom_job("Erasing", lambda job, target: target.erase(start, end - start + 1, value), rom,
+                    on_done=lambda _: messagebox.showinfo("Success", f"Erased bytes from 0x{start:X} to 0x{end:X}"))
 
     except Exception as e:
         messagebox.showerror("Error", str(e))
 
 def erase_count():
     """Erase specific number of bytes from the ROM"""
-    global rom_data
-    if not rom_data:
+    if not rom:
         messagebox.showerror("Error", "No ROM loaded.")
         return
     confirm = messagebox.askyesno(
@@ -1014,21 +1285,296 @@ def erase_count():
     )
     if not confirm:
         return
+    if base_saving(rom):
+        messagebox.showerror("Error", "Wait for the base ROM to finish saving first.")
+        return
     try:
         start = parse_offset_str(er_start_count.get())
         count = int(er_count.get())
-        value = 0xFF if byte_type_count.get() == "FF" else 0x00
+        value = FILL_TYPES[byte_type_count.get()]
         end = start + count
-        if end > len(rom_data):
+        if end > len(rom):
             raise ValueError("Out of bounds")
-        temp_data = bytearray(rom_data)
-        temp_data[start:end] = bytes([value] * count)
-        rom_data = bytes(temp_data)
-        messagebox.showinfo("Success", f"Erased {count} bytes from 0x{start:X}")
-        update_hex_editor()
+        run_rom_job("Erasing", lambda job, target: target.erase(start, count, value), rom,
+                    on_done=lambda _: messagebox.showinfo("Success", f"Erased {count} bytes from 0x{start:X}"))
     except Exception as e:
         messagebox.showerror("Error", str(e))
 
+def undo_edit(event=None):
+    """Undo the last edit made to the ROM"""
+    if rom and not scheduler.busy(rom) and not base_saving(rom):
+        rom.undo()  # Repaints through on_rom_edited
+    return "break"
+
+def redo_edit(event=None):
+    """Redo the last undone edit"""
+    if rom and not scheduler.busy(rom) and not base_saving(rom):
+        rom.redo()
+    return "break"
+
+def show_free_space_report():
+    """Show free space totals, run lengths, the largest blocks and fragmentation"""
+    if not rom:
+        messagebox.showerror("Error", "No ROM loaded.")
+        return
+    report_top = tk.Toplevel(root)
+    report_top.title("Free Space Report")
+    report_top.geometry("560x500")
+
+    report_text = scrolledtext.ScrolledText(report_top, wrap=tk.NONE, font=("Courier", 10))
+    report_text.pack(fill='both', expand=True, padx=10, pady=(10, 5))
+    report_text.insert("1.0", "Analysing free space...")
+    report_text.config(state='disabled')
+
+    def on_done(report):
+        if not report_top.winfo_exists():
+            return
+        report_text.config(state='normal')
+        report_text.delete("1.0", tk.END)
+        report_text.insert("1.0", report.describe())
+        report_text.config(state='disabled')
+
+    run_rom_job("Free space report", lambda job, target: target.free_space_report(), rom, on_done=on_done)
+
+    tk.Button(report_top, text="Copy to Clipboard",
+              command=lambda: pyperclip.copy(report_text.get("1.0", tk.END))).pack(pady=(0, 10))
+
+def show_batch_allocator():
+    """Place a whole list of (name, size, alignment) requests in free space at once"""
+    if not rom:
+        messagebox.showerror("Error", "No ROM loaded.")
+        return
+    alloc_top = tk.Toplevel(root)
+    alloc_top.title("Batch Allocator")
+    alloc_top.geometry("600x560")
+
+    tk.Label(alloc_top, text="Requests (one 'name size [alignment]' per line):").pack(anchor="w", padx=10, pady=(10, 0))
+    requests_text = scrolledtext.ScrolledText(alloc_top, height=10)
+    requests_text.pack(fill='x', padx=10)
+    requests_text.insert("1.0", "# name size [alignment]\nmy_script 0x40 4\nmy_text 120\n")
+
+    options = tk.Frame(alloc_top)
+    options.pack(fill='x', padx=10, pady=5)
+    tk.Label(options, text="Search Type:").pack(side="left")
+    alloc_type = tk.StringVar(value=search_type.get() if search_type.get() in FILL_TYPES else "FF")
+    ttk.OptionMenu(options, alloc_type, alloc_type.get(), "FF", "00").pack(side="left", padx=(0, 10))
+    tk.Label(options, text="Strategy:").pack(side="left")
+    alloc_strategy = tk.StringVar(value=allocator.STRATEGIES[0])
+    ttk.Combobox(options, textvariable=alloc_strategy, values=allocator.STRATEGIES,
+                 state='readonly', width=20).pack(side="left", padx=(0, 10))
+    tk.Label(options, text="Start Offset:").pack(side="left")
+    alloc_start = tk.Entry(options, width=12)
+    alloc_start.insert(0, start_offset_var.get())
+    alloc_start.pack(side="left")
+
+    output = scrolledtext.ScrolledText(alloc_top, wrap=tk.NONE, font=("Courier", 10))
+
+    def run_allocation():
+        try:
+            requests = allocator.parse_requests(requests_text.get("1.0", tk.END))
+            start = parse_offset_str(alloc_start.get())
+        except ValueError as e:
+            messagebox.showerror("Error", str(e), parent=alloc_top)
+            return
+        value, strategy = FILL_TYPES[alloc_type.get()], alloc_strategy.get()
+
+        def on_done(placements):
+            if alloc_top.winfo_exists():
+                output.delete("1.0", tk.END)
+                output.insert("1.0", allocator.describe(placements))
+
+        run_rom_job("Allocating", lambda job, target: target.allocate(requests, value, strategy, start), rom,
+                    on_done=on_done,
+                    on_error=lambda e: messagebox.showerror("Error", str(e), parent=alloc_top))
+
+    buttons = tk.Frame(alloc_top)
+    buttons.pack(pady=5)
+    tk.Button(buttons, text="Allocate", command=run_allocation, bg="#e0e0ff", padx=10).pack(side="left", padx=5)
+    tk.Button(buttons, text="Copy to Clipboard",
+              command=lambda: pyperclip.copy(output.get("1.0", tk.END))).pack(side="left", padx=5)
+    output.pack(fill='both', expand=True, padx=10, pady=(0, 10))
+
+def show_pattern_search():
+    """Find every match of hex bytes (?? wildcards) or Gen III text, listed and marked in the hex view"""
+    if not rom:
+        messagebox.showerror("Error", "No ROM loaded.")
+        return
+    search_top = tk.Toplevel(root)
+    search_top.title("Find Bytes / Text")
+    search_top.geometry("560x560")
+
+    options = tk.Frame(search_top)
+    options.pack(fill='x', padx=10, pady=(10, 0))
+    pattern_entry = tk.Entry(options)
+    pattern_entry.pack(side="left", fill='x', expand=True, padx=(0, 5))
+    ToolTip(pattern_entry, "Hex bytes with ?? wildcards (08 ?? ?? 08) or text (POKéMON, \\n \\l \\p allowed)")
+    kind_var = tk.StringVar(value="hex")
+    tk.Radiobutton(options, text="Hex", variable=kind_var, value="hex").pack(side="left")
+    tk.Radiobutton(options, text="Gen III Text", variable=kind_var, value="text").pack(side="left")
+    ignore_case_var = BooleanVar(value=False)
+    tk.Checkbutton(options, text="Ignore Case", variable=ignore_case_var).pack(side="left")
+
+    summary_var = tk.StringVar(value="Enter hex bytes or text and press Search.")
+    tk.Label(search_top, textvariable=summary_var, anchor="w").pack(fill='x', padx=10, pady=(5, 0))
+
+    list_frame = tk.Frame(search_top)
+    list_frame.pack(fill='both', expand=True, padx=10, pady=5)
+    columns = ("offset", "bytes")
+    hits_tree = ttk.Treeview(list_frame, columns=columns, show="headings", selectmode="browse")
+    hits_tree.heading("offset", text="Offset")
+    hits_tree.heading("bytes", text="Bytes")
+    hits_tree.column("offset", width=110, anchor="e")
+    hits_tree.column("bytes", width=380, anchor="w")
+    hits_tree_scrollbar = ttk.Scrollbar(list_frame, orient="vertical", command=hits_tree.yview)
+    hits_tree_scrollbar.pack(side="right", fill="y")
+    hits_tree.pack(side="left", fill='both', expand=True)
+
+    # The hits of the last search, and how many of them are in the list
+    state = {"hits": [], "shown": 0, "length": 0, "rom": None}
+
+    def show_more():
+        """Add the next page of hits to the list"""
+        hits, shown, length, searched = state["hits"], state["shown"], state["length"], state["rom"]
+        fmt = offset_format_var.get()
+        for hit in hits[shown:shown + HIT_PAGE]:
+            hits_tree.insert("", "end", iid=str(hit), values=(
+                format_offset(hit, fmt), searched.data[hit:hit + min(length, 16)].hex(" ").upper()))
+        state["shown"] = min(len(hits), shown + HIT_PAGE)
+
+    def mark_hits():
+        """Mark the hits in the hex view when it shows the searched ROM"""
+        if state["rom"] is rom and hex_view.marks is not state["hits"]:
+            hex_view.set_marks(state["hits"], state["length"])
+
+    def search(event=None):
+        try:
+            pattern = SearchPattern(pattern_entry.get(), kind_var.get(), ignore_case_var.get())
+        except ValueError as e:
+            messagebox.showerror("Error", f"Invalid search: {e}", parent=search_top)
+            return
+        searched = rom
+        summary_var.set(f"Searching for {pattern.describe()}...")
+
+        def on_done(hits):
+            if not search_top.winfo_exists():
+                return
+            if hex_view.marks is state["hits"]:
+                hex_view.set_marks([], 0)
+            state.update(hits=hits, shown=0, length=pattern.length, rom=searched)
+            hits_tree.delete(*hits_tree.get_children())
+            show_more()
+            mark_hits()
+            limited = f" (stopped at {MAX_HITS})" if len(hits) >= MAX_HITS else ""
+            summary_var.set(f"{len(hits)} matches of {pattern.describe()}{limited}")
+
+        run_rom_job("Searching", lambda job, target: target.find_pattern(pattern), searched, on_done=on_done)
+
+    def step(direction):
+        """Select the previous/next hit"""
+        items = hits_tree.get_children()
+        selection = hits_tree.selection()
+        index = items.index(selection[0]) + direction if selection else 0
+        if index >= len(items) and state["shown"] < len(state["hits"]):
+            show_more()
+            items = hits_tree.get_children()
+        if items:
+            item = items[max(0, min(index, len(items) - 1))]
+            hits_tree.selection_set(item)
+            hits_tree.see(item)
+
+    def on_scroll(first, last):
+        hits_tree_scrollbar.set(first, last)
+        if float(last) >= 0.9 and state["shown"] < len(state["hits"]):
+            show_more()
+
+    def on_select(event):
+        selection = hits_tree.selection()
+        if not selection or state["rom"] is not rom:
+            return
+        mark_hits()
+        search_offset_var.set(format_offset(int(selection[0]), offset_format_var.get()))
+        scroll_to_offset()
+
+    def close():
+        if hex_view.marks is state["hits"]:
+            hex_view.set_marks([], 0)
+        search_top.destroy()
+
+    hits_tree.configure(yscrollcommand=on_scroll)
+    hits_tree.bind("<<TreeviewSelect>>", on_select)
+    pattern_entry.bind("<Return>", search)
+    search_top.protocol("WM_DELETE_WINDOW", close)
+
+    buttons = tk.Frame(search_top)
+    buttons.pack(pady=(0, 10))
+    tk.Button(buttons, text="Search", command=search, bg="#e0e0ff", padx=10).pack(side="left", padx=5)
+    tk.Button(buttons, text="Previous", command=lambda: step(-1)).pack(side="left", padx=5)
+    tk.Button(buttons, text="Next", command=lambda: step(1)).pack(side="left", padx=5)
+    pattern_entry.focus_set()
+
+def diagnostics_extra():
+    """The open ROMs and scan settings, to go with the timings in a diagnostics export"""
+    roms = []
+    for target in workspace.roms:
+        cache = row_cache if target is rom else rom_views.get(target, (None,))[0]
+        roms.append({"path": target.path, "size": len(target), "active": target is rom,
+                     "memory_mapped": target.data.is_mapped, "shared_fraction": workspace.shared_fraction(target),
+                     "overlay_bytes": target.data.overlay_size,
+                     "row_cache": {"rows": len(cache.rows), "hits": cache.hits, "misses": cache.misses} if cache else None})
+    settings = {"scan_workers": parallel_scan.WORKERS, "memory_map": mmap_rom_var.get(),
+                "cache_analysis": cache_analysis_var.get(), "atomic_saves": atomic_save_var.get()}
+    return {"roms": roms, "settings": settings}
+
+def show_diagnostics():
+    """Show the timings, counters and last profile capture, exportable as JSON"""
+    diag_top = tk.Toplevel(root)
+    diag_top.title("Diagnostics")
+    diag_top.geometry("760x560")
+
+    diag_text = scrolledtext.ScrolledText(diag_top, wrap=tk.NONE, font=("Courier", 10))
+    diag_text.pack(fill='both', expand=True, padx=10, pady=(10, 5))
+
+    def refresh():
+        diag_text.config(state='normal')
+        diag_text.delete("1.0", tk.END)
+        diag_text.insert("1.0", instrumentation.describe())
+        diag_text.config(state='disabled')
+
+    def reset():
+        instrumentation.reset()
+        refresh()
+
+    def export():
+        path = filedialog.asksaveasfilename(
+            title="Export Diagnostics", defaultextension=".json", initialfile="ufsf_diagnostics.json",
+            filetypes=[("JSON", "*.json")], parent=diag_top)
+        if not path:
+            return
+        try:
+            instrumentation.export_json(path, diagnostics_extra())
+        except OSError as e:
+            messagebox.showerror("Error", f"Failed to export diagnostics:\n{e}", parent=diag_top)
+            return
+        rom_status_var.set(f"Exported diagnostics: {os.path.basename(path)}")
+
+    buttons = tk.Frame(diag_top)
+    buttons.pack(pady=(0, 10))
+    tk.Button(buttons, text="Refresh", command=refresh).pack(side="left", padx=5)
+    tk.Button(buttons, text="Reset", command=reset).pack(side="left", padx=5)
+    tk.Button(buttons, text="Export JSON...", command=export).pack(side="left", padx=5)
+    tk.Button(buttons, text="Copy to Clipboard",
+              command=lambda: pyperclip.copy(diag_text.get("1.0", tk.END))).pack(side="left", padx=5)
+    refresh()
+
+def toggle_profiling():
+    """Start a cProfile/tracemalloc capture, or stop it and show the results"""
+    if profile_var.get():
+        instrumentation.start_capture()
+        rom_status_var.set("Profiling... do the slow thing, then untick Tools -> Profile to see the results.")
+    else:
+        instrumentation.stop_capture()
+        show_diagnostics()
+
 def show_erase_tool():
     """Show dialog for erasing ROM data"""
     global er_start_range, er_end_range, byte_type_range
@@ -1110,6 +1656,11 @@ search_offset_var = tk.StringVar(value="0")
 size_var = tk.StringVar(value="32")
 calc_format_var = tk.StringVar(value="0x")
 search_type = tk.StringVar(value="FF")
+tolerance_var = tk.StringVar(value="0")
+mmap_rom_var = BooleanVar(value=True)
+atomic_save_var = BooleanVar(value=False)
+cache_analysis_var = BooleanVar(value=True)
+profile_var = BooleanVar(value=False)
 
 # ROM control state management
 rom_controls = []
@@ -1131,8 +1682,14 @@ notebook.pack(expand=1, fill='both')
 
 # ROM status display
 rom_status_var = tk.StringVar(value="No ROM loaded.")
-rom_status_label = tk.Label(root, textvariable=rom_status_var, anchor="w", fg="red")
-rom_status_label.pack(fill='x', padx=10, pady=(5, 0))
+status_bar = tk.Frame(root)
+status_bar.pack(fill='x', padx=10, pady=(5, 0))
+rom_status_label = tk.Label(status_bar, textvariable=rom_status_var, anchor="w", fg="red")
+rom_status_label.pack(side="left", fill='x', expand=True)
+
+# Stops every running background job (searches, loads, saves, erases)
+cancel_button = tk.Button(status_bar, text="Cancel", command=cancel_jobs, state='disabled')
+cancel_button.pack(side="right")
 
 #----------------------------------------------------------------------
 # HEX EDITOR TAB
@@ -1140,6 +1697,12 @@ rom_status_label.pack(fill='x', padx=10, pady=(5, 0))
 
 # Main hex editor frame
 frame_hex = tk.Frame(notebook)
+
+# One tab per open ROM
+rom_tabs = ttk.Notebook(frame_hex)
+rom_tabs.pack(fill='x', padx=10, pady=(10, 0))
+rom_tabs.bind("<<NotebookTabChanged>>", on_rom_tab_changed)
+
 hex_frame = tk.Frame(frame_hex)
 hex_frame.pack(fill='both', expand=True, padx=10, pady=10)
 
@@ -1149,18 +1712,29 @@ hex_line_numbers.pack(side='left', fill='y')
 hex_display = tk.Text(hex_frame, wrap=tk.NONE, width=70)
 hex_display.pack(side='left', fill='both', expand=True)
 
-# Configure highlight tag during initialization
+# Configure highlight tags during initialization (search hits under the cursor highlight)
+hex_display.tag_configure("match", background="#ffd8a0")
 hex_display.tag_configure("highlight", background="#ffff00", foreground="#000000")
 
-# Scrollbar setup for hex editor
-hex_scroll = ttk.Scrollbar(hex_frame, orient='vertical', command=lambda *args: (hex_display.yview(*args), hex_line_numbers.yview(*args)))
+# Scrollbar setup for hex editor (driven by the viewport, not the Text widgets)
+hex_scroll = ttk.Scrollbar(hex_frame, orient='vertical')
 hex_scroll.pack(side='right', fill='y')
-hex_display['yscrollcommand'] = lambda *args: (hex_scroll.set(*args), hex_line_numbers.yview_moveto(args[0]))
-hex_line_numbers['yscrollcommand'] = lambda *args: (hex_scroll.set(*args), hex_display.yview_moveto(args[0]))
+hex_view = HexViewport(hex_display, hex_line_numbers, hex_scroll)
+
+# Free space minimap beside the scrollbar
+hex_minimap = tk.Canvas(hex_frame, width=24, highlightthickness=0, background='lightgray', cursor="hand2")
+hex_minimap.pack(side='right', fill='y')
+minimap = Minimap(hex_minimap, jump_to_offset)
+hex_view.view_changed = minimap.show_view
 
 # Event bindings for hex editor
+hex_display.bind("<Key>", on_hex_key)
+hex_display.bind("<<Paste>>", lambda e: "break")
+hex_display.bind("<<Cut>>", lambda e: "break")
 hex_display.bind("<KeyRelease>", on_hex_cursor_move)
 hex_display.bind("<ButtonRelease>", on_hex_cursor_move)
+hex_display.bind("<Control-z>", undo_edit)
+hex_display.bind("<Control-y>", redo_edit)
 hex_display.config(cursor="xterm", takefocus=True)
 
 
@@ -1181,11 +1755,12 @@ offset_format_label.grid(row=0, column=0, sticky='w', pady=2)
 offset_format_ddl = ttk.Combobox(search_frame, textvariable=offset_format_var, values=["0x", "$", "plain"], width=7, state='readonly')
 offset_format_ddl.grid(row=0, column=1, sticky='w', padx=(0, 10), pady=2)
 
-# Search type selector (FF or 00)
+# Search type selector (FF, 00, FF+00 or custom hex bytes like "FF 01")
 type_label = tk.Label(search_frame, text="Search Type:")
 type_label.grid(row=1, column=0, sticky='w', pady=2)
-search_option_menu = ttk.OptionMenu(search_frame, search_type, "FF", "FF", "00")
-search_option_menu.grid(row=1, column=1, sticky='w', padx=(0, 10), pady=2)
+search_type_ddl = ttk.Combobox(search_frame, textvariable=search_type, values=list(FILLER_SETS), width=9)
+search_type_ddl.grid(row=1, column=1, sticky='w', padx=(0, 10), pady=2)
+ToolTip(search_type_ddl, "Free byte values: pick one or type hex bytes, e.g. FF 00 01")
 
 # Start offset input
 start_label = tk.Label(search_frame, text="Start Offset:")
@@ -1209,10 +1784,29 @@ skip_interval_entry = tk.Entry(search_frame, textvariable=skip_interval_var, wid
 skip_interval_entry.grid(row=4, column=1, sticky='w', padx=(0, 10), pady=2)
 rom_controls.append(skip_interval_entry)
 
-# Search button
-find_btn = tk.Button(search_frame, text="Find Free Space", command=search_free_space, bg="#e0e0ff", padx=10)
-find_btn.grid(row=5, column=0, columnspan=2, pady=10)
+# Alignment of the block start
+align_label = tk.Label(search_frame, text="Alignment:")
+align_label.grid(row=5, column=0, sticky='w', pady=2)
+align_var = tk.StringVar(value="1")
+align_option_menu = ttk.OptionMenu(search_frame, align_var, "1", *(str(a) for a in ALIGNMENTS))
+align_option_menu.grid(row=5, column=1, sticky='w', padx=(0, 10), pady=2)
+
+# Stray (non-free) bytes allowed inside the block
+tolerance_label = tk.Label(search_frame, text="Stray Bytes:")
+tolerance_label.grid(row=6, column=0, sticky='w', pady=2)
+tolerance_entry = tk.Entry(search_frame, textvariable=tolerance_var, width=12)
+tolerance_entry.grid(row=6, column=1, sticky='w', padx=(0, 10), pady=2)
+rom_controls.append(tolerance_entry)
+
+# Search buttons: the first fit, or every fit in a list
+find_buttons = tk.Frame(search_frame)
+find_buttons.grid(row=7, column=0, columnspan=2, pady=10)
+find_btn = tk.Button(find_buttons, text="Find Free Space", command=search_free_space, bg="#e0e0ff", padx=10)
+find_btn.pack(side="left", padx=(0, 5))
 rom_controls.append(find_btn)
+find_all_btn = tk.Button(find_buttons, text="Find All", command=find_all_free_space, padx=10)
+find_all_btn.pack(side="left")
+rom_controls.append(find_all_btn)
 
 # Right side - results area
 results_frame = tk.Frame(fs_controls)
@@ -1371,28 +1965,34 @@ calc_type = tk.StringVar(value="FF")
 calc_option_menu = ttk.OptionMenu(container, calc_type, "FF", "FF", "00")
 calc_option_menu.grid(row=3, column=1, sticky="w")
 
+# Alignment
+tk.Label(container, text="Alignment:").grid(row=4, column=0, sticky="e")
+calc_align_var = tk.StringVar(value="1")
+calc_align_menu = ttk.OptionMenu(container, calc_align_var, "1", *(str(a) for a in ALIGNMENTS))
+calc_align_menu.grid(row=4, column=1, sticky="w")
+
 # Calculate button
 btn_calc = tk.Button(container, text="Calculate", command=calculate_offset)
-btn_calc.grid(row=4, column=0, columnspan=2, pady=5)
+btn_calc.grid(row=5, column=0, columnspan=2, pady=5)
 
 # Output box
 calc_output = tk.Text(container, height=4, width=40, state='disabled')
-calc_output.grid(row=5, column=0, columnspan=2, pady=(0, 10))
+calc_output.grid(row=6, column=0, columnspan=2, pady=(0, 10))
 
 # Offset difference
-tk.Label(container, text="Offset A:").grid(row=6, column=0, sticky="e")
+tk.Label(container, text="Offset A:").grid(row=7, column=0, sticky="e")
 entry_offset_a = tk.Entry(container)
-entry_offset_a.grid(row=6, column=1, sticky="w")
+entry_offset_a.grid(row=7, column=1, sticky="w")
 
-tk.Label(container, text="Offset B:").grid(row=7, column=0, sticky="e")
+tk.Label(container, text="Offset B:").grid(row=8, column=0, sticky="e")
 entry_offset_b = tk.Entry(container)
-entry_offset_b.grid(row=7, column=1, sticky="w")
+entry_offset_b.grid(row=8, column=1, sticky="w")
 
-tk.Button(container, text="Calculate Bytes Between", command=calculate_difference).grid(row=8, column=0, columnspan=2, pady=(5, 10))
+tk.Button(container, text="Calculate Bytes Between", command=calculate_difference).grid(row=9, column=0, columnspan=2, pady=(5, 10))
 
 # Dec/Hex converter
 dec_hex_frame = tk.LabelFrame(container, text="Dec/Hex Converter")
-dec_hex_frame.grid(row=9, column=0, columnspan=2, pady=(5,0), sticky="we")
+dec_hex_frame.grid(row=10, column=0, columnspan=2, pady=(5,0), sticky="we")
 
 dec_var = tk.StringVar()
 hex_var = tk.StringVar()
@@ -1421,13 +2021,37 @@ root.config(menu=menu_bar)
 file_menu = Menu(menu_bar, tearoff=0)
 file_menu.add_command(label="Load Last ROM", command=load_last_rom)
 file_menu.add_command(label="Open ROM", command=browse_file)
+file_menu.add_command(label="Open ROM in New Tab", command=lambda: browse_file(new_tab=True))
 file_menu.add_command(label="Save ROM", command=save_rom)
+file_menu.add_command(label="Close ROM", command=close_rom)
+file_menu.add_separator()
+file_menu.add_command(label="Apply Patch...", command=apply_patch)
+file_menu.add_command(label="Export Patch...", command=export_patch)
+file_menu.add_separator()
+file_menu.add_checkbutton(label="Memory-Map ROM Files", variable=mmap_rom_var)
+file_menu.add_checkbutton(label="Atomic Saves (Temp File + Rename)", variable=atomic_save_var)
+file_menu.add_checkbutton(label="Cache ROM Analysis", variable=cache_analysis_var)
+file_menu.add_command(label="Clear Analysis Cache", command=analysis_cache.clear)
 menu_bar.add_cascade(label="File", menu=file_menu)
 
+# Edit menu
+edit_menu = Menu(menu_bar, tearoff=0)
+edit_menu.add_command(label="Undo", accelerator="Ctrl+Z", command=undo_edit)
+edit_menu.add_command(label="Redo", accelerator="Ctrl+Y", command=redo_edit)
+edit_menu.add_separator()
+edit_menu.add_command(label="Find Bytes / Text...", accelerator="Ctrl+F", command=show_pattern_search)
+menu_bar.add_cascade(label="Edit", menu=edit_menu)
+root.bind("<Control-f>", lambda e: show_pattern_search())
+
 # Tools menu
 tools_menu = Menu(menu_bar, tearoff=0)
 tools_menu.add_command(label="Offset Calculator", command=lambda: offset_top.deiconify())
 tools_menu.add_command(label="Erase Offset Range", command=show_erase_tool)
+tools_menu.add_command(label="Free Space Report", command=show_free_space_report)
+tools_menu.add_command(label="Batch Allocator", command=show_batch_allocator)
+tools_menu.add_separator()
+tools_menu.add_command(label="Diagnostics", command=show_diagnostics)
+tools_menu.add_checkbutton(label="Profile (cProfile + tracemalloc)", variable=profile_var, command=toggle_profiling)
 menu_bar.add_cascade(label="Tools", menu=tools_menu)
 
 #----------------------------------------------------------------------
@@ -1435,5 +2059,5 @@ menu_bar.add_cascade(label="Tools", menu=tools_menu)
 #----------------------------------------------------------------------
 
 if __name__ == "__main__":
-    setup_virtual_hex_editor()
+    pump_jobs()
     root.mainloop()
@@ -0,0 +1,193 @@
+"""
+Batch free space allocation for Ultimate Free Space Finder.
+Packs a whole list of (name, size, alignment) requests into the free runs of
+a ROM in one go, best-fit or first-fit-decreasing, instead of one manual
+search per script/table, and returns a placement table.
+"""
+
+from bisect import bisect_left, insort
+
+from scan_engine import align_up
+
+STRATEGIES = ("best-fit", "first-fit-decreasing")
+CHUNK_SIZE = 32   # Holes per first-fit chunk (chunks split at twice this)
+
+class Placement:
+    """One allocation request and where it was placed (offset is None if it didn't fit)"""
+    def __init__(self, name, size, alignment=1, offset=None):
+        self.name = name
+        self.size = size
+        self.alignment = alignment
+        self.offset = offset
+
+    @property
+    def placed(self):
+        return self.offset is not None
+
+    @property
+    def end(self):
+        """Last offset of the placed block"""
+        return self.offset + self.size - 1
+
+#----------------------------------------------------------------------
+# REQUEST LISTS
+#----------------------------------------------------------------------
+
+def _number(raw):
+    """Parse a size/alignment: 0x/$ prefixed hex, otherwise decimal"""
+    if raw.lower().startswith("0x"):
+        return int(raw, 16)
+    if raw.startswith("$"):
+        return int(raw[1:], 16)
+    return int(raw)
+
+def parse_requests(text):
+    """Parse 'name size [alignment]' lines (commas or spaces, # comments) into Placements"""
+    requests = []
+    for line_no, line in enumerate(text.splitlines(), 1):
+        fields = line.split("#", 1)[0].replace(",", " ").split()
+        if not fields:
+            continue
+        try:
+            if len(fields) not in (2, 3):
+                raise ValueError("expected: name size [alignment]")
+            size = _number(fields[1])
+            alignment = _number(fields[2]) if len(fields) == 3 else 1
+            if size <= 0 or alignment <= 0:
+                raise ValueError("size and alignment must be positive")
+        except ValueError as e:
+            raise ValueError(f"Line {line_no}: {e}")
+        requests.append(Placement(fields[0], size, alignment))
+    return requests
+
+#----------------------------------------------------------------------
+# SOLVERS
+#----------------------------------------------------------------------
+
+class _MaxTree:
+    """Max segment tree over hole lengths for first-fit queries"""
+    def __init__(self, values):
+        self.size = 1
+        while self.size < len(values):
+            self.size *= 2
+        self.tree = [0] * (2 * self.size)
+        self.tree[self.size:self.size + len(values)] = values
+        for node in range(self.size - 1, 0, -1):
+            self.tree[node] = max(self.tree[2 * node], self.tree[2 * node + 1])
+
+    def set(self, pos, value):
+        node = self.size + pos
+        self.tree[node] = value
+        node //= 2
+        while node:
+            self.tree[node] = max(self.tree[2 * node], self.tree[2 * node + 1])
+            node //= 2
+
+    def first_at_least(self, first, need):
+        """Index of the first slot at position >= first holding >= need, or -1"""
+        node, lo, hi = 1, 0, self.size
+        stack = []
+        while True:
+            if hi > first and self.tree[node] >= need:
+                if hi - lo == 1:
+                    return lo
+                mid = (lo + hi) // 2
+                stack.append((2 * node + 1, mid, hi))
+                node, hi = 2 * node, mid
+            elif stack:
+                node, lo, hi = stack.pop()
+            else:
+                return -1
+
+def _carve(start, end, offset, size):
+    """Holes left over after placing size bytes at offset inside [start, end)"""
+    return [(lo, hi) for lo, hi in ((start, offset), (offset + size, end)) if hi > lo]
+
+def _best_fit(runs, order):
+    """Place each request in the smallest hole it fits in (after alignment)"""
+    holes = sorted((end - start, start) for start, end in runs)
+    for item in order:
+        # Every hole is checked in size order: a short one may still fit once aligned,
+        # and any hole of size + alignment - 1 bytes or more fits, which ends the scan
+        for pos in range(bisect_left(holes, (item.size, -1)), len(holes)):
+            length, start = holes[pos]
+            offset = align_up(start, item.alignment)
+            if offset + item.size <= start + length:
+                break
+        else:
+            continue
+        del holes[pos]
+        item.offset = offset
+        for lo, hi in _carve(start, start + length, offset, item.size):
+            insort(holes, (hi - lo, lo))
+
+def _longest(holes):
+    return max((end - start for start, end in holes), default=0)
+
+def _first_fit(runs, order):
+    """Place each request in the lowest hole it fits in (after alignment).
+
+    Holes are kept in address order in chunks of at most 2 * CHUNK_SIZE,
+    with a max tree over the chunks' longest holes to skip whole chunks.
+    """
+    chunks = [list(runs[i:i + CHUNK_SIZE]) for i in range(0, len(runs), CHUNK_SIZE)] or [[]]
+    longest = [_longest(holes) for holes in chunks]
+    tree = _MaxTree(longest)
+    for item in order:
+        size, alignment = item.size, item.alignment
+        # Chunks with a long enough hole are tried in address order until one fits once aligned
+        pos = tree.first_at_least(0, size)
+        while pos != -1:
+            holes = chunks[pos]
+            for i, (start, end) in enumerate(holes):
+                if end - start < size:
+                    continue
+                offset = align_up(start, alignment)
+                if offset + size <= end:
+                    holes[i:i + 1] = _carve(start, end, offset, size)
+                    item.offset = offset
+                    break
+            if item.placed:
+                if len(holes) > 2 * CHUNK_SIZE:
+                    chunks[pos:pos + 1] = [holes[:CHUNK_SIZE], holes[CHUNK_SIZE:]]
+                    longest[pos:pos + 1] = [_longest(chunks[pos]), _longest(chunks[pos + 1])]
+                    tree = _MaxTree(longest)
+                else:
+                    longest[pos] = _longest(holes)
+                    tree.set(pos, longest[pos])
+                break
+            pos = tree.first_at_least(pos + 1, size)
+
+def allocate(runs, requests, strategy="best-fit"):
+    """Pack requests (Placements) into free runs [(start, end)], setting their offsets.
+
+    Both strategies place the largest requests first; best-fit picks the
+    tightest hole, first-fit-decreasing the lowest one. Requests that don't
+    fit keep offset None. Returns the requests in their original order.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown strategy: {strategy}")
+    for item in requests:
+        item.offset = None
+    order = sorted(requests, key=lambda item: item.size, reverse=True)
+    if strategy == "best-fit":
+        _best_fit(runs, order)
+    else:
+        _first_fit(runs, order)
+    return requests
+
+def describe(placements):
+    """Return the placement table as text"""
+    width = max([len("Name")] + [len(item.name) for item in placements])
+    lines = [f"{'Name':<{width}}  {'Offset':>10}  {'End':>10}  {'Size':>8}  Align"]
+    for item in placements:
+        if item.placed:
+            where = f"{f'0x{item.offset:X}':>10}  {f'0x{item.end:X}':>10}"
+        else:
+            where = f"{'NO SPACE':>10}  {'':>10}"
+        lines.append(f"{item.name:<{width}}  {where}  {item.size:>8}  {item.alignment}")
+    placed = [item for item in placements if item.placed]
+    lines.append("")
+    lines.append(f"Placed {len(placed)} of {len(placements)} requests "
+                 f"({sum(item.size for item in placed)} bytes)")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,130 @@
+"""
+Persistent analysis cache for Ultimate Free Space Finder.
+Free run and pointer indexes are saved to a cache directory keyed by a
+per-chunk zlib CRC32 of the ROM, so reopening an unchanged ROM skips the
+scans entirely. When a ROM was edited outside the tool, the last analysis
+of the same path is reused and only the chunks whose CRCs changed are
+rescanned.
+"""
+
+import json
+import os
+import pickle
+import zlib
+from array import array
+
+import parallel_scan
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".ufsf_cache")
+CACHE_VERSION = 1
+HASH_CHUNK_SIZE = 1 << 20  # Bytes per CRC32
+CACHE_ENTRIES = 16         # Analyses kept before the oldest are deleted
+
+def chunk_hashes(data, workers=None):
+    """Return the CRC32 of every HASH_CHUNK_SIZE chunk of data"""
+    pieces = parallel_scan.map_chunks(data, zlib.crc32, chunk_size=HASH_CHUNK_SIZE, workers=workers)
+    return [crc for _, _, crc in pieces]
+
+def changed_ranges(old_hashes, new_hashes):
+    """Return the (start, end) byte ranges of consecutive chunks whose hashes differ"""
+    ranges = []
+    for chunk, (old, new) in enumerate(zip(old_hashes, new_hashes)):
+        if old == new:
+            continue
+        start = chunk * HASH_CHUNK_SIZE
+        if ranges and ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], start + HASH_CHUNK_SIZE)
+        else:
+            ranges.append((start, start + HASH_CHUNK_SIZE))
+    return ranges
+
+class CachedAnalysis:
+    """The saved indexes of one ROM image"""
+    def __init__(self, size, hashes, runs, pointers, params):
+        self.version = CACHE_VERSION
+        self.size = size
+        self.hashes = hashes      # chunk_hashes of the image analysed
+        self.runs = runs          # Fill value -> (starts, ends), see FreeRunIndex
+        self.pointers = pointers  # (sources, targets), see PointerIndex, or None if it wasn't built
+        self.params = params      # Index settings the analysis was made with
+
+class AnalysisCache:
+    """Directory of CachedAnalysis files, one per ROM content, plus the last one per path"""
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = directory
+
+    def _key(self, size, hashes):
+        return f"{size:x}-{zlib.crc32(array('I', hashes).tobytes()):08x}"
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key + ".pkl")
+
+    def _paths_file(self):
+        return os.path.join(self.directory, "paths.json")
+
+    def _read_paths(self):
+        try:
+            with open(self._paths_file(), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _read_entry(self, key):
+        try:
+            with open(self._entry_path(key), 'rb') as f:
+                analysis = pickle.load(f)
+        except Exception:  # A missing or broken entry is just a miss
+            return None
+        return analysis if getattr(analysis, "version", None) == CACHE_VERSION else None
+
+    def lookup(self, path, size, hashes, params):
+        """Return (analysis, changed ranges) for a ROM, or None if nothing usable is cached.
+
+        An exact content match has no changed ranges. Otherwise the last
+        analysis of the same path is returned along with the byte ranges
+        whose chunks changed since, which the caller has to rescan.
+        """
+        candidates = [self._key(size, hashes)]
+        last_key = self._read_paths().get(os.path.abspath(path)) if path else None
+        if last_key and last_key != candidates[0]:
+            candidates.append(last_key)
+        for key in candidates:
+            analysis = self._read_entry(key)
+            if (analysis is not None and analysis.size == size and analysis.params == params
+                    and len(analysis.hashes) == len(hashes)):
+                return analysis, changed_ranges(analysis.hashes, hashes)
+        return None
+
+    def store(self, path, analysis):
+        """Save an analysis and remember it as the last one for path (errors are ignored)"""
+        key = self._key(analysis.size, analysis.hashes)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            temp_path = self._entry_path(key) + ".tmp"
+            with open(temp_path, 'wb') as f:
+                pickle.dump(analysis, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self._entry_path(key))
+            if path:
+                paths = self._read_paths()
+                paths[os.path.abspath(path)] = key
+                with open(self._paths_file(), 'w') as f:
+                    json.dump(paths, f, indent=1)
+            self._prune()
+        except OSError:
+            pass
+
+    def _prune(self):
+        """Delete the least recently written entries beyond CACHE_ENTRIES"""
+        entries = [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                   if name.endswith(".pkl")]
+        entries.sort(key=os.path.getmtime, reverse=True)
+        for stale in entries[CACHE_ENTRIES:]:
+            os.remove(stale)
+
+    def clear(self):
+        """Delete every cached analysis"""
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith((".pkl", ".json", ".tmp")):
+                os.remove(os.path.join(self.directory, name))
@@ -0,0 +1,264 @@
+"""
+Benchmark suite for Ultimate Free Space Finder.
+Builds deterministic 16 MB and 32 MB synthetic ROMs (see synthetic_rom)
+and times the core operations headlessly: loading, free space searches
+from several start offsets, hex and text pattern searches, range checks,
+erase + undo, single-byte edits (also on a badly fragmented 32 MB ROM),
+hex row formatting (what the hex view renders) and saving. Results are written as
+JSON; --compare checks them against a saved run and exits with status 1
+when an operation got slower than the allowed ratio.
+
+Examples:
+    python benchmarks/bench.py -o baseline.json
+    python benchmarks/bench.py --sizes 16 --repeat 3 --compare baseline.json
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parallel_scan
+import synthetic_rom
+from analysis_cache import AnalysisCache
+from hex_rows import RowCache, format_rows
+from pattern_search import SearchPattern
+from ufsf_core import RomImage
+
+RESULTS_VERSION = 1
+PAGE_ROWS = 40          # Rows on screen in the hex view
+QUERIES = 2000          # Random ranges checked per is_range_free run
+EDITS = 200             # Single-byte writes per edit latency run
+FRAGMENTED_SIZE = 32    # MB of the extra, badly fragmented ROM the edit latency is also timed on
+SEARCH_SIZE = 256       # Bytes asked for by the search benchmarks
+SEARCH_STARTS = (0.0, 0.25, 0.5, 0.75)  # Search start offsets, as a fraction of the ROM
+PATTERN_SEARCHES = (("hex", "08 ?? ?? 08", False), ("hex", "?? ?? ?? 08", False),
+                    ("text", "POKéMON", False), ("text", "pokémon", True))  # (kind, pattern, ignore case)
+
+def measure(func, repeat, number=1, setup=None, batch=1):
+    """Time func() number times per run, repeat runs; return ms per operation stats.
+
+    batch is the number of operations one func() call does.
+    """
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        gc.collect()
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start) * 1000 / (number * batch))
+    return {"runs": repeat, "calls": number * batch, "min_ms": round(min(times), 4),
+            "median_ms": round(statistics.median(times), 4), "mean_ms": round(statistics.fmean(times), 4)}
+
+def bench_edits(rom, repeat, rng):
+    """Time single-byte writes (what a hex editor keystroke does, reindexing included) and return {name: stats}"""
+    rom.pointer_index  # The GUI builds it at load; edits keep it up to date like the run index
+    offsets = [rng.randrange(len(rom)) for _ in range(EDITS)]
+    def edits():
+        for offset in offsets:
+            rom.write(offset, bytes([rng.randrange(256)]))
+    results = {"edit 1 byte": measure(edits, repeat, batch=len(offsets))}
+    # The run index refreshes what the edits moved on the next search
+    results["search after edits"] = measure(lambda: rom.find_free_space(SEARCH_SIZE, 0xFF, alignment=4), repeat,
+                                            setup=edits)
+    return results
+
+def bench_rom(path, size, repeat, workdir):
+    """Run every benchmark on one synthetic ROM file and return {name: stats}"""
+    results = {}
+
+    def load():
+        RomImage.load(path).close()
+    results["load"] = measure(load, repeat)
+
+    cache = AnalysisCache(os.path.join(workdir, "cache"))
+    RomImage.load(path, cache=cache).close()  # Fill the cache
+    results["load (cache hit)"] = measure(lambda: RomImage.load(path, cache=cache).close(), repeat)
+
+    rom = RomImage.load(path)
+    try:
+        def pointer_index():
+            rom._pointers = None
+            rom.pointer_index
+        results["pointer index"] = measure(pointer_index, repeat)
+
+        for fraction in SEARCH_STARTS:
+            start = int(size * fraction)
+            for name, value in (("FF", 0xFF), ("00", 0x00)):
+                results[f"search {name} @{fraction:.0%}"] = measure(
+                    lambda: rom.find_free_space(SEARCH_SIZE, value, start, alignment=4), repeat, number=200)
+        results["search FF+00 (scan)"] = measure(
+            lambda: rom.find_free_space(SEARCH_SIZE, (0xFF, 0x00)), repeat, setup=rom.filler_runs.clear)
+        results["search FF+00 tolerance 2 (scan)"] = measure(
+            lambda: rom.find_free_space(SEARCH_SIZE, (0xFF, 0x00), tolerance=2), repeat,
+            setup=rom.filler_runs.clear)
+        for kind, raw, ignore_case in PATTERN_SEARCHES:
+            pattern = SearchPattern(raw, kind, ignore_case)
+            results[f"find {kind} {pattern.describe()}"] = measure(lambda: rom.find_pattern(pattern), repeat)
+
+        rng = random.Random(size)
+        queries = [(rng.randrange(size - 4096), rng.choice((16, 256, 4096)), rng.choice((0xFF, 0x00)))
+                   for _ in range(QUERIES)]
+        def range_checks():
+            for start, length, value in queries:
+                rom.is_range_free(start, length, value)
+        results["is_range_free"] = measure(range_checks, repeat, batch=len(queries))
+
+        offsets = [rng.randrange(0, size - 4096, 16) for _ in range(50)]
+        def erase_undo():
+            for offset in offsets:
+                rom.erase(offset, 4096, 0xFF)
+                rom.undo()
+        results["erase 4KB + undo"] = measure(erase_undo, repeat, batch=len(offsets))
+        results.update(bench_edits(rom, repeat, rng))
+
+        lines = [rng.randrange(rom.line_count - PAGE_ROWS) for _ in range(200)]
+        def cold_pages():
+            rows = RowCache(rom.data)
+            for line in lines:
+                rows.get_rows(line, PAGE_ROWS)
+        results["rows: cold page"] = measure(cold_pages, repeat, batch=len(lines))
+        warm = RowCache(rom.data)
+        warm.get_rows(lines[0], PAGE_ROWS)
+        results["rows: warm page"] = measure(lambda: warm.get_rows(lines[0], PAGE_ROWS), repeat, number=500)
+        block = bytes(rom.data[0:0x10000])
+        results["format_rows 64KB"] = measure(lambda: format_rows(block), repeat)
+        results["free space report"] = measure(rom.free_space_report, repeat)
+    finally:
+        rom.close()
+
+    # Saves work on a copy so the next size starts from an untouched file
+    save_path = os.path.join(workdir, "save.gba")
+    shutil.copyfile(path, save_path)
+    rom = RomImage.load(save_path)
+    try:
+        def edit():
+            rom.write(rng.randrange(size), b'\x42')
+        results["save (changed ranges)"] = measure(lambda: rom.save(backup=False), repeat, setup=edit)
+        results["save (atomic)"] = measure(lambda: rom.save(backup=False, atomic=True), repeat, setup=edit)
+    finally:
+        rom.close()
+    return results
+
+def git_revision():
+    """The checked out commit, if this is a git checkout"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def run(sizes, repeat, seed):
+    """Benchmark every size and return the results document"""
+    document = {"version": RESULTS_VERSION, "revision": git_revision(), "seed": seed, "repeat": repeat,
+                "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                                "cpus": os.cpu_count(), "scan_workers": parallel_scan.WORKERS},
+                "roms": {}}
+    workdir = tempfile.mkdtemp(prefix="ufsf_bench_")
+    try:
+        for megabytes in sizes:
+            size = megabytes * synthetic_rom.MB
+            path = os.path.join(workdir, f"synthetic_{megabytes}mb.gba")
+            crc, runs = synthetic_rom.write(path, size, seed)
+            print(f"{megabytes} MB ROM (crc32 {crc:08X}, {len(runs)} free runs)...", file=sys.stderr)
+            document["roms"][f"{megabytes}MB"] = {"size": size, "crc32": f"{crc:08X}",
+                                                  "results": bench_rom(path, size, repeat, workdir)}
+        # Edit latency must not grow with the number of free runs either
+        size = FRAGMENTED_SIZE * synthetic_rom.MB
+        path = os.path.join(workdir, "fragmented.gba")
+        crc, runs = synthetic_rom.write(path, size, seed, synthetic_rom.FRAGMENTED_RUNS_PER_MB)
+        print(f"{FRAGMENTED_SIZE} MB fragmented ROM (crc32 {crc:08X}, {len(runs)} free runs)...", file=sys.stderr)
+        rom = RomImage.load(path)
+        try:
+            results = bench_edits(rom, repeat, random.Random(size))
+        finally:
+            rom.close()
+        document["roms"][f"{FRAGMENTED_SIZE}MB fragmented"] = {"size": size, "crc32": f"{crc:08X}", "results": results}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return document
+
+def describe(document):
+    """Text table of a results document"""
+    lines = []
+    for rom_name, rom in document["roms"].items():
+        lines.append(f"{rom_name} (crc32 {rom['crc32']}):")
+        for name, stats in rom["results"].items():
+            lines.append(f"  {name:<34}{stats['min_ms']:>12.4f} ms  (median {stats['median_ms']:.4f})")
+    return "\n".join(lines)
+
+def compare(document, baseline, max_ratio, min_ms):
+    """Return text lines comparing the fastest runs to baseline, and the names that regressed.
+
+    The minimum is compared rather than the median: other load on the
+    machine only ever adds time, so it is the steadier of the two.
+    """
+    lines, regressions = [], []
+    for rom_name, rom in document["roms"].items():
+        base_rom = baseline["roms"].get(rom_name)
+        if base_rom is None:
+            continue
+        if base_rom["crc32"] != rom["crc32"]:
+            lines.append(f"{rom_name}: synthetic ROM differs from the baseline (seed or generator changed)")
+            continue
+        for name, stats in rom["results"].items():
+            base = base_rom["results"].get(name)
+            if base is None:
+                continue
+            ratio = stats["min_ms"] / base["min_ms"] if base["min_ms"] else float("inf")
+            slower = ratio > max_ratio and stats["min_ms"] >= min_ms
+            if slower:
+                regressions.append(f"{rom_name} {name}")
+            lines.append(f"  {rom_name:<6}{name:<34}{base['min_ms']:>12.4f} -> {stats['min_ms']:>12.4f} ms"
+                         f"  x{ratio:.2f}{'  REGRESSION' if slower else ''}")
+    return lines, regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the core operations on synthetic GBA ROMs")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[16, 32], help="ROM sizes in MB")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per benchmark (the fastest is compared)")
+    parser.add_argument("--seed", type=int, default=1, help="synthetic ROM seed")
+    parser.add_argument("--workers", type=int, help="scan processes (default: parallel_scan.WORKERS)")
+    parser.add_argument("-o", "--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--compare", metavar="BASELINE", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--max-ratio", type=float, default=1.25,
+                        help="slowdown against the baseline that counts as a regression")
+    parser.add_argument("--min-ms", type=float, default=0.05,
+                        help="ignore slowdowns of benchmarks faster than this (timer noise)")
+    args = parser.parse_args(argv)
+    if args.workers:
+        parallel_scan.WORKERS = args.workers
+
+    document = run(args.sizes, args.repeat, args.seed)
+    print(describe(document), file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=1)
+    else:
+        json.dump(document, sys.stdout, indent=1)
+        print()
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        lines, regressions = compare(document, baseline, args.max_ratio, args.min_ms)
+        print("\n".join([f"Compared with {args.compare}:"] + lines), file=sys.stderr)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}", file=sys.stderr)
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+"""
+Deterministic synthetic GBA ROMs for the benchmarks.
+The same size and seed always give the same bytes: random "used" data
+with FF and 00 free runs of known lengths laid over it, a pointer table
+referring to some of those runs, and an FF-filled expansion area at the
+end, like a hack that grew past the original 16 MB.
+"""
+
+import random
+import zlib
+
+MB = 1 << 20
+ROM_BASE = 0x08000000      # GBA address of ROM offset 0
+POINTER_TABLE = 0x1000     # Where the pointers to free runs are written
+RUNS_START = 0x10000       # No free runs before this (header, pointer table)
+RUNS_PER_MB = 64           # Free runs laid over the used area, per MB
+FRAGMENTED_RUNS_PER_MB = 8192  # The same for a badly fragmented ROM (~120k runs in 16 MB of data)
+RUN_LENGTHS = [(16, 256, 70), (256, 4096, 25), (4096, 65536, 5)]  # (min, max, weight %)
+FF_SHARE = 0.75            # The other free runs are 00
+POINTED_SHARE = 0.25       # Free runs something still points to
+
+def used_size(size):
+    """Bytes of the ROM holding (random) data; the rest is FF expansion space"""
+    return min(size, 16 * MB) - MB
+
+def generate(size, seed=1, runs_per_mb=RUNS_PER_MB):
+    """Return (bytearray image, [(start, length, value)] free runs laid over the used area)"""
+    rng = random.Random(f"ufsf-{size}-{seed}" + ("" if runs_per_mb == RUNS_PER_MB else f"-{runs_per_mb}"))
+    used = used_size(size)
+    data = bytearray(rng.randbytes(used))
+    data += b'\xFF' * (size - used)
+
+    runs = []
+    count = used // MB * runs_per_mb
+    ranges, weights = zip(*[((low, high), weight) for low, high, weight in RUN_LENGTHS])
+    # Spread the runs evenly, each at a random spot inside its own slot
+    slot = (used - RUNS_START) // count
+    for index in range(count):
+        low, high = rng.choices(ranges, weights)[0]
+        length = min(rng.randrange(low, high), slot // 2)
+        start = RUNS_START + index * slot + rng.randrange(slot - length)
+        value = 0xFF if rng.random() < FF_SHARE else 0x00
+        data[start:start + length] = bytes([value]) * length
+        runs.append((start, length, value))
+
+    pointed = [run for run in runs if rng.random() < POINTED_SHARE]
+    table = b''.join((ROM_BASE + start).to_bytes(4, "little") for start, _, _ in pointed)
+    data[POINTER_TABLE:POINTER_TABLE + len(table)] = table
+    return data, runs
+
+def write(path, size, seed=1, runs_per_mb=RUNS_PER_MB):
+    """Write a synthetic ROM to path and return (crc32, free runs)"""
+    data, runs = generate(size, seed, runs_per_mb)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return zlib.crc32(data), runs
@@ -0,0 +1,82 @@
+"""
+Hex row formatting for Ultimate Free Space Finder.
+One shared row formatter for every hex view, built on bytes.hex and a
+256-entry bytes.translate table, with a bounded LRU cache of formatted rows
+keyed by line index so scrolling over the same area is almost free.
+"""
+
+from collections import OrderedDict
+
+import instrumentation
+
+BYTES_PER_ROW = 16
+HEX_WIDTH = BYTES_PER_ROW * 3 - 1        # "XX XX ... XX" is 47 characters
+ROW_GAP = "    "
+ASCII_COLUMN = HEX_WIDTH + len(ROW_GAP)  # Column where the ASCII text starts
+ROW_CACHE_SIZE = 4096                    # Formatted rows kept per ROM
+
+# Printable ASCII maps to itself, everything else to '.'
+ASCII_TABLE = bytes(b if 32 <= b <= 126 else ord('.') for b in range(256))
+
+def format_row(chunk):
+    """Format up to 16 bytes as a hex view row: hex bytes, gap, ASCII"""
+    hex_bytes = chunk.hex(' ').upper()
+    return f"{hex_bytes:<{HEX_WIDTH}}{ROW_GAP}{chunk.translate(ASCII_TABLE).decode('ascii')}"
+
+def format_rows(data):
+    """Format a block of bytes into hex view rows"""
+    instrumentation.count("rows formatted", (len(data) + BYTES_PER_ROW - 1) // BYTES_PER_ROW)
+    return [format_row(data[i:i + BYTES_PER_ROW]) for i in range(0, len(data), BYTES_PER_ROW)]
+
+class RowCache:
+    """Bounded LRU cache of formatted rows keyed by line index"""
+    def __init__(self, data, capacity=ROW_CACHE_SIZE):
+        self.data = data          # Anything sliceable: bytes, RomBuffer...
+        self.capacity = capacity
+        self.rows = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def line_count(self):
+        return (len(self.data) + BYTES_PER_ROW - 1) // BYTES_PER_ROW
+
+    def get_rows(self, first, count):
+        """Return the formatted rows first .. first+count-1 (clipped to the ROM)"""
+        first = max(0, first)
+        last = min(first + count, self.line_count)
+        rows = self.rows
+        missing = [line for line in range(first, last) if line not in rows]
+        if missing:
+            # One read covers every missing row
+            lo, hi = missing[0], missing[-1] + 1
+            block = self.data[lo * BYTES_PER_ROW:hi * BYTES_PER_ROW]
+            for line in missing:
+                pos = (line - lo) * BYTES_PER_ROW
+                rows[line] = format_row(block[pos:pos + BYTES_PER_ROW])
+        self.misses += len(missing)
+        self.hits += (last - first) - len(missing)
+        instrumentation.count("rows formatted", len(missing))
+        instrumentation.count("row cache hits", (last - first) - len(missing))
+
+        result = []
+        for line in range(first, last):
+            rows.move_to_end(line)
+            result.append(rows[line])
+        while len(rows) > self.capacity:
+            rows.popitem(last=False)
+        return result
+
+    def invalidate(self, start, end):
+        """Drop the cached rows covering bytes start .. end-1"""
+        first = start // BYTES_PER_ROW
+        last = (end - 1) // BYTES_PER_ROW
+        if last - first + 1 > len(self.rows):
+            for line in [line for line in self.rows if first <= line <= last]:
+                del self.rows[line]
+        else:
+            for line in range(first, last + 1):
+                self.rows.pop(line, None)
+
+    def clear(self):
+        self.rows.clear()
@@ -0,0 +1,206 @@
+"""
+Performance instrumentation for Ultimate Free Space Finder.
+Named timers and counters that the core, the CLI and the GUI record into,
+plus an optional cProfile/tracemalloc capture, so a report like "scrolling
+is slow on my ROM" comes with numbers. Everything is process-wide and
+thread-safe; snapshot() returns plain dicts ready for json.
+"""
+
+import cProfile
+import functools
+import io
+import json
+import os
+import platform
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+PROFILE_LINES = 30  # Functions listed in a capture report
+MEMORY_LINES = 15   # Allocation sites listed in a capture report
+
+_lock = threading.Lock()
+_timings = {}    # Name -> Timing
+_counters = {}   # Name -> int
+_capture = None  # Running Capture, if any
+last_capture = None  # Report of the last finished capture
+
+class Timing:
+    """Call count and total/min/max/last duration of one timer"""
+    __slots__ = ("count", "total", "min", "max", "last")
+
+    def __init__(self):
+        self.count = 0
+        self.total = self.max = self.last = 0.0
+        self.min = float("inf")
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        self.last = seconds
+
+    def as_dict(self):
+        """Milliseconds, rounded for reading"""
+        ms = lambda seconds: round(seconds * 1000, 3)
+        return {"count": self.count, "total_ms": ms(self.total), "mean_ms": ms(self.total / self.count),
+                "min_ms": ms(self.min), "max_ms": ms(self.max), "last_ms": ms(self.last)}
+
+def record(name, seconds):
+    """Add one duration to a timer"""
+    with _lock:
+        _timings.setdefault(name, Timing()).add(seconds)
+
+def count(name, amount=1):
+    """Add to a counter"""
+    if amount:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + amount
+
+class timed:
+    """Time a block (with timed("search"): ...) or every call of a function (@timed("search"))"""
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start)
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(self.name):
+                return func(*args, **kwargs)
+        return wrapper
+
+def reset():
+    """Forget every timing and counter"""
+    with _lock:
+        _timings.clear()
+        _counters.clear()
+
+#----------------------------------------------------------------------
+# PROFILE CAPTURE
+#----------------------------------------------------------------------
+
+class Capture:
+    """cProfile of the starting thread and of every run_profiled call, plus tracemalloc.
+
+    From Python 3.12 cProfile runs on sys.monitoring, which sees every
+    thread and allows one profiler at a time, so the starting thread's
+    profiler covers the run_profiled calls too.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.profiles = [cProfile.Profile()]
+        self.own_tracemalloc = not tracemalloc.is_tracing()
+        if self.own_tracemalloc:
+            tracemalloc.start()
+        self.profiles[0].enable()
+
+    def add(self, profile):
+        with _lock:
+            self.profiles.append(profile)
+
+    def stop(self):
+        """Stop capturing and return the report"""
+        self.profiles[0].disable()
+        stream = io.StringIO()
+        stats = pstats.Stats(*self.profiles, stream=stream)
+        stats.sort_stats("cumulative").print_stats(PROFILE_LINES)
+        current, peak = tracemalloc.get_traced_memory()
+        top = tracemalloc.take_snapshot().statistics("lineno")[:MEMORY_LINES]
+        if self.own_tracemalloc:
+            tracemalloc.stop()
+        return {"seconds": round(time.perf_counter() - self.started, 3),
+                "profile": stream.getvalue(),
+                "memory": {"current_bytes": current, "peak_bytes": peak, "top": [str(stat) for stat in top]}}
+
+def capturing():
+    return _capture is not None
+
+def start_capture():
+    """Start a cProfile/tracemalloc capture (on the calling thread plus run_profiled calls)"""
+    global _capture
+    if _capture is None:
+        _capture = Capture()
+
+def stop_capture():
+    """Stop the capture and return its report (also kept as last_capture), or None"""
+    global _capture, last_capture
+    if _capture is None:
+        return None
+    capture, _capture = _capture, None
+    last_capture = capture.stop()
+    return last_capture
+
+def _profiler_active():
+    """True if a profiler already sees the calling thread"""
+    monitoring = getattr(sys, "monitoring", None)  # Python 3.12+: one process-wide profiler
+    if monitoring is not None:
+        return monitoring.get_tool(monitoring.PROFILER_ID) is not None
+    return sys.getprofile() is not None
+
+def run_profiled(func, *args):
+    """Call func(*args), under its own profiler while a capture runs and none sees this thread (for worker threads)"""
+    capture = _capture
+    if capture is None or _profiler_active():
+        return func(*args)
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(func, *args)
+    finally:
+        capture.add(profile)
+
+#----------------------------------------------------------------------
+# REPORTS
+#----------------------------------------------------------------------
+
+def snapshot(extra=None):
+    """Timings, counters, the last capture and the environment as a json-ready dict"""
+    with _lock:
+        timings = {name: timing.as_dict() for name, timing in sorted(_timings.items())}
+        counters = dict(sorted(_counters.items()))
+    data = {"timings": timings, "counters": counters,
+            "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                            "cpus": os.cpu_count()}}
+    if extra:
+        data.update(extra)
+    if last_capture:
+        data["capture"] = last_capture
+    return data
+
+def export_json(path, extra=None):
+    """Write snapshot(extra) to a JSON file"""
+    with open(path, 'w') as f:
+        json.dump(snapshot(extra), f, indent=1)
+
+def describe(data=None):
+    """Text report of a snapshot (the current one by default)"""
+    data = data or snapshot()
+    lines = ["Timings (ms):",
+             f"  {'name':<28}{'calls':>7}{'total':>11}{'mean':>10}{'max':>10}{'last':>10}"]
+    for name, timing in data["timings"].items():
+        lines.append(f"  {name:<28}{timing['count']:>7}{timing['total_ms']:>11.1f}{timing['mean_ms']:>10.2f}"
+                     f"{timing['max_ms']:>10.2f}{timing['last_ms']:>10.2f}")
+    if not data["timings"]:
+        lines.append("  (nothing timed yet)")
+    lines.append("")
+    lines.append("Counters:")
+    for name, value in data["counters"].items():
+        lines.append(f"  {name:<28}{value:>15,}")
+    if not data["counters"]:
+        lines.append("  (nothing counted yet)")
+    capture = data.get("capture")
+    if capture:
+        memory = capture["memory"]
+        lines += ["", f"Last capture ({capture['seconds']} s, peak {memory['peak_bytes'] / 2**20:.1f} MB traced):",
+                  capture["profile"].rstrip(), "", "Top allocations:"]
+        lines += [f"  {stat}" for stat in memory["top"]]
+    return "\n".join(lines)
@@ -0,0 +1,177 @@
+"""
+Background jobs for Ultimate Free Space Finder.
+Searches, saves, erases and analyses run on a small pool of worker threads
+so the window stays responsive. Tk may only be used from its own thread,
+so jobs never touch widgets: progress, results and errors are queued and
+delivered by pump(), which the GUI calls from root.after. Progress reports
+of a job that pile up between two pumps are coalesced into the latest one.
+Cancelling is cooperative: a cancelled job stops at its next progress
+report or checkpoint(), which parallel_scan passes after every chunk.
+"""
+
+import queue
+import threading
+import traceback
+
+from instrumentation import run_profiled, timed
+
+WORKERS = 2  # Worker threads; the heavy scans fan out to parallel_scan's processes anyway
+
+_local = threading.local()
+
+class JobCancelled(Exception):
+    """Raised inside a job that was cancelled, to unwind it"""
+
+def current_job():
+    """The Job running on the calling thread, or None"""
+    return getattr(_local, "job", None)
+
+def checkpoint():
+    """Stop the calling job here if it was cancelled (does nothing outside jobs)"""
+    job = current_job()
+    if job is not None:
+        job.check()
+
+class Job:
+    """One piece of background work: func(job, *args) run on a worker thread"""
+    def __init__(self, scheduler, name, func, args, key, callbacks):
+        self.scheduler = scheduler
+        self.name = name
+        self.func = func
+        self.args = args
+        self.key = key              # Jobs with the same key never run at the same time
+        self.callbacks = callbacks  # Event kind -> callable, run on the UI thread
+        self._cancel = threading.Event()
+
+    def __repr__(self):
+        return f"<Job {self.name}>"
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        """Ask the job to stop; it does so at its next progress report or checkpoint"""
+        self._cancel.set()
+
+    def check(self):
+        if self.cancelled:
+            raise JobCancelled(self.name)
+
+    def progress(self, percent, message=None):
+        """Report progress to the UI thread, stopping here if the job was cancelled"""
+        self.check()
+        self.scheduler.events.put((self, "progress", (percent, message)))
+
+class JobScheduler:
+    """Worker threads running Jobs, plus the event queue the UI thread drains with pump()"""
+    def __init__(self, workers=WORKERS):
+        self.events = queue.Queue()
+        self.ui_thread = threading.current_thread()
+        self._lock = threading.Condition()
+        self._pending = []   # Submitted jobs not started yet, oldest first
+        self._running = []
+        for _ in range(workers):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def submit(self, name, func, *args, key=None, on_done=None, on_error=None,
+               on_progress=None, on_finish=None):
+        """Queue func(job, *args) and return its Job.
+
+        Jobs with the same key (e.g. the RomImage they work on) run one at a
+        time, in the order they were submitted. The callbacks run on the UI
+        thread: on_progress(percent, message), then on_done(result) or
+        on_error(exception), then on_finish() whatever happened. A cancelled
+        job only gets on_finish.
+        """
+        callbacks = {"progress": on_progress, "done": on_done, "error": on_error, "finish": on_finish}
+        job = Job(self, name, func, args, key, callbacks)
+        with self._lock:
+            self._pending.append(job)
+            self._lock.notify_all()
+        return job
+
+    def _take(self):
+        """Wait for the oldest pending job whose key is free and mark it running"""
+        with self._lock:
+            while True:
+                busy = {job.key for job in self._running if job.key is not None}
+                for job in self._pending:
+                    if job.key is None or job.key not in busy:
+                        self._pending.remove(job)
+                        self._running.append(job)
+                        return job
+                self._lock.wait()
+
+    def _work(self):
+        while True:
+            job = self._take()
+            _local.job = job
+            try:
+                job.check()
+                with timed(f"job: {job.name}"):
+                    outcome = ("done", run_profiled(job.func, job, *job.args))
+            except JobCancelled:
+                outcome = ("cancelled", None)
+            except Exception as e:
+                outcome = ("error", e)
+            finally:
+                _local.job = None
+                with self._lock:
+                    self._running.remove(job)
+                    self._lock.notify_all()
+            self.events.put((job,) + outcome)
+
+    def busy(self, key=None):
+        """True while a job with key (any job if None) is pending or running"""
+        with self._lock:
+            jobs = self._pending + self._running
+        return any(key is None or job.key == key for job in jobs)
+
+    def cancel_all(self):
+        """Cancel every pending and running job"""
+        with self._lock:
+            for job in self._pending + self._running:
+                job.cancel()
+
+    def run_on_ui(self, func, *args):
+        """Call func(*args) on the UI thread: now if this is it, else from the next pump()"""
+        if threading.current_thread() is self.ui_thread:
+            func(*args)
+        else:
+            self.events.put((None, "call", (func, args)))
+
+    def pump(self):
+        """Deliver the queued events; call this on the UI thread every few dozen ms"""
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                break
+        # Only the latest progress report of each job is still worth drawing
+        latest = {job: i for i, (job, kind, _) in enumerate(events) if kind == "progress"}
+        for i, (job, kind, value) in enumerate(events):
+            if kind == "progress" and (latest[job] != i or job.cancelled):
+                continue
+            try:
+                self._deliver(job, kind, value)
+            except Exception:  # One broken callback must not drop the other events
+                traceback.print_exc()
+
+    def _deliver(self, job, kind, value):
+        if kind == "call":
+            func, args = value
+            func(*args)
+            return
+        callback = job.callbacks.get(kind)
+        if kind == "progress":
+            if callback:
+                callback(*value)
+            return
+        try:
+            if callback:
+                callback(value)
+        finally:
+            if job.callbacks["finish"]:
+                job.callbacks["finish"]()
@@ -0,0 +1,230 @@
+"""
+Multi-core ROM analysis for Ultimate Free Space Finder.
+Splits the ROM into chunks and runs scan_engine analyses on them in a
+process pool. Workers read the image straight from the memory-mapped ROM
+file when it has no unsaved edits, or from a single multiprocessing
+shared_memory copy otherwise, so the image is never pickled per task.
+The parent merges the per-chunk results, joining runs that cross chunk
+boundaries. Workers are forked, so the pool is only ever started while the
+process has a single thread: the GUI starts it up front with start().
+"""
+
+import atexit
+import mmap
+import multiprocessing
+import os
+import threading
+from collections import deque
+from itertools import islice
+from multiprocessing import resource_tracker, shared_memory
+
+import instrumentation
+import jobs
+from rom_buffer import RomBuffer
+from scan_engine import filler_mask, find_runs, run_end, run_start
+
+CHUNK_SIZE = 1 << 21          # Bytes per task
+PARALLEL_MIN_SIZE = 1 << 22   # Smaller images are scanned in-process
+WORKERS = os.cpu_count() or 1  # Pool size; 1 turns the pool off
+TASKS_PER_WORKER = 2          # Chunks handed to the pool ahead of the one being merged
+
+_pool = None
+_pool_size = 0
+
+#----------------------------------------------------------------------
+# WORKER SIDE
+#----------------------------------------------------------------------
+
+_source_key = None
+_source = None   # The image as seen by this worker: mmap or shared memory
+_handle = None   # What has to be closed to release it
+
+def _open_source(key):
+    """Map the image described by key, reusing the mapping from the last task"""
+    global _source_key, _source, _handle
+    if key == _source_key:
+        return _source
+    _close_source()
+    kind, name = key[:2]
+    if kind == "file":
+        with open(name, 'rb') as f:
+            _handle = _source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    else:
+        _handle = shared_memory.SharedMemory(name=name)
+        _source = _handle.buf
+    _source_key = key
+    return _source
+
+def _close_source():
+    global _source_key, _source, _handle
+    _source = None
+    if _handle is not None:
+        _handle.close()
+    _source_key = _handle = None
+
+def _run_task(job):
+    """Run one chunk: job is (source key, lo, hi, task, args)"""
+    key, lo, hi, task, args = job
+    chunk = bytes(_open_source(key)[lo:hi])
+    return task(chunk, *args)
+
+#----------------------------------------------------------------------
+# POOL
+#----------------------------------------------------------------------
+
+def _context():
+    """fork where the platform has it, so workers don't re-import the main script"""
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+
+def _get_pool(workers):
+    """The pool, started if need be, or None if it can't be started from here"""
+    global _pool, _pool_size
+    if _pool is None or _pool_size != workers:
+        if threading.active_count() > 1:
+            # A child forked while other threads run can hang on a lock one of them held
+            return None
+        shutdown()
+        if os.name == "posix":
+            # Workers share the parent's tracker, which sees the shared memory unlinked
+            resource_tracker.ensure_running()
+        _pool = _context().Pool(workers)
+        _pool_size = workers
+    return _pool
+
+def start(workers=None):
+    """Start the worker pool now; call this before starting any other thread"""
+    workers = WORKERS if workers is None else workers
+    if workers > 1:
+        _get_pool(workers)
+
+def shutdown():
+    """Stop the worker pool (it is started again on demand)"""
+    global _pool, _pool_size
+    if _pool is not None:
+        _pool.terminate()
+        _pool.join()
+    _pool = None
+    _pool_size = 0
+
+atexit.register(shutdown)
+
+class _SharedImage:
+    """Context manager exposing data to the workers; yields the source key"""
+    def __init__(self, data):
+        self.data = data
+        self.shm = None
+
+    def __enter__(self):
+        data = self.data
+        if isinstance(data, RomBuffer) and data.is_mapped and data.file and not data.dirty:
+            # Unedited mapped ROM: workers map the same file themselves
+            stat = os.stat(data.file.name)
+            return ("file", data.file.name, stat.st_mtime_ns, stat.st_size)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+        for lo in range(0, len(data), CHUNK_SIZE):
+            block = data[lo:lo + CHUNK_SIZE]
+            self.shm.buf[lo:lo + len(block)] = block
+        return ("shm", self.shm.name)
+
+    def __exit__(self, *exc):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+
+def use_parallel(data, workers=None):
+    """True if analyses of data are worth spreading over the pool"""
+    workers = WORKERS if workers is None else workers
+    return workers > 1 and len(data) >= PARALLEL_MIN_SIZE
+
+def chunk_bounds(size, chunk_size=CHUNK_SIZE):
+    """Return the (lo, hi) chunks covering size bytes"""
+    return [(lo, min(lo + chunk_size, size)) for lo in range(0, size, chunk_size)]
+
+def map_chunks(data, task, args=(), overlap=0, chunk_size=CHUNK_SIZE, workers=None):
+    """Run task(chunk, *args) over data in chunks and return [(lo, hi, result)].
+
+    chunk is data[lo:hi + overlap], so a match that starts inside the chunk
+    but crosses its end is still visible; tasks should only report matches
+    starting before hi - lo so no two chunks report the same one. task and
+    args must be picklable (task a module-level function). Runs in-process
+    when use_parallel says the pool isn't worth it, or when the pool isn't
+    running and can't be started from this thread (see start). A cancelled
+    background job (see jobs) stops between chunks.
+    """
+    workers = WORKERS if workers is None else workers
+    bounds = chunk_bounds(len(data), chunk_size)
+    instrumentation.count("bytes scanned", len(data))
+    results = []
+    pool = _get_pool(workers) if use_parallel(data, workers) else None
+    if pool is None:
+        for lo, hi in bounds:
+            jobs.checkpoint()
+            results.append(task(bytes(data[lo:hi + overlap]), *args))
+        return [(lo, hi, result) for (lo, hi), result in zip(bounds, results)]
+    with _SharedImage(data) as key:
+        size = len(data)
+        tasks = iter([(key, lo, min(hi + overlap, size), task, args) for lo, hi in bounds])
+        # Only a few chunks are queued at a time, so a cancelled scan has little left to wait for
+        pending = deque(pool.apply_async(_run_task, (item,)) for item in islice(tasks, workers * TASKS_PER_WORKER))
+        try:
+            while pending:
+                results.append(pending.popleft().get())
+                jobs.checkpoint()
+                for item in islice(tasks, 1):
+                    pending.append(pool.apply_async(_run_task, (item,)))
+        finally:
+            # Tasks already handed to the pool still read the image, which goes away next
+            for queued in pending:
+                queued.wait()
+    return [(lo, hi, result) for (lo, hi), result in zip(bounds, results)]
+
+#----------------------------------------------------------------------
+# ANALYSES
+#----------------------------------------------------------------------
+
+def _chunk_runs(chunk, filler_sets, min_length):
+    """Runs of each filler set in chunk, plus the length of the runs touching either edge"""
+    results = []
+    for fillers in filler_sets:
+        if len(fillers) == 1:
+            data, value = chunk, next(iter(fillers))
+        else:
+            data, value = filler_mask(chunk, fillers), 1
+        starts, ends = find_runs(data, value, min_length)
+        prefix = run_end(data, value, 0)
+        suffix = len(data) - run_start(data, value, len(data))
+        results.append((starts, ends, prefix, suffix))
+    return results
+
+def _merge_runs(pieces, min_length):
+    """Join per-chunk runs [(lo, hi, (starts, ends, prefix, suffix))] into runs over the whole image"""
+    starts, ends = [], []
+    for lo, hi, (chunk_starts, chunk_ends, prefix, suffix) in pieces:
+        runs = [(lo + start, lo + end) for start, end in zip(chunk_starts, chunk_ends)]
+        # Runs at the chunk edges may only reach min_length once joined
+        if prefix and (not runs or runs[0][0] != lo):
+            runs.insert(0, (lo, lo + prefix))
+        if suffix and (not runs or runs[-1][1] != hi):
+            runs.append((hi - suffix, hi))
+        for start, end in runs:
+            if ends and ends[-1] == start:
+                ends[-1] = end  # Continues a run from the previous chunk
+            else:
+                starts.append(start)
+                ends.append(end)
+    keep = [i for i in range(len(starts)) if ends[i] - starts[i] >= min_length]
+    return [starts[i] for i in keep], [ends[i] for i in keep]
+
+def find_runs_parallel(data, filler_sets, min_length=1, workers=None):
+    """Return [(starts, ends)] of every run of each filler set at least min_length long.
+
+    Every filler set is scanned in the same pass over each chunk. Matches
+    scan_engine.find_runs (one value) and find_filler_runs (several).
+    """
+    filler_sets = [frozenset(fillers) for fillers in filler_sets]
+    min_length = max(1, min_length)
+    # In-process too, plain bytes chunks keep the scan off RomBuffer's slower reads
+    pieces = map_chunks(data, _chunk_runs, (filler_sets, min_length), workers=workers)
+    return [_merge_runs([(lo, hi, result[i]) for lo, hi, result in pieces], min_length)
+            for i in range(len(filler_sets))]
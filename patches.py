@@ -0,0 +1,356 @@
+"""
+IPS/UPS/BPS patch export and import for Ultimate Free Space Finder.
+Patches are built straight from the original and working images with a
+block-skipping diff (identical 4 KB blocks are compared in C and skipped),
+and applied to a loaded ROM in a single pass over the patch.
+"""
+
+import re
+import zlib
+
+DIFF_BLOCK = 4096       # Blocks compared whole before looking at single bytes
+DIFF_LEAF = 32          # Spans this small are compared byte by byte
+RLE_MIN = 16            # Runs of one byte at least this long are run-length encoded
+CRC_CHUNK = 1 << 20
+
+IPS_MAX_OFFSET = 0xFFFFFF
+IPS_MAX_RECORD = 0xFFFF
+IPS_EOF_OFFSET = 0x454F46  # b"EOF" read as an offset, which IPS can't start a record at
+IPS_RECORD_OVERHEAD = 5    # Offset + size header of a literal record
+
+PATCH_FORMATS = ("ips", "ups", "bps")
+
+_run_pattern = re.compile(rb'(.)\1{%d,}' % (RLE_MIN - 1), re.DOTALL)
+_nonzero_pattern = re.compile(rb'[^\x00]+')
+
+#----------------------------------------------------------------------
+# DIFF
+#----------------------------------------------------------------------
+
+def diff_ranges(source, target, windows=None, block=DIFF_BLOCK):
+    """Return merged (start, end) ranges where target differs from source.
+
+    windows limits the comparison to known candidate ranges (e.g. the dirty
+    pages of a RomBuffer). Bytes past the end of source count as changed.
+    """
+    common = min(len(source), len(target))
+    if windows is None:
+        windows = [(0, common)]
+    ranges = []
+    for lo, hi in windows:
+        hi = min(hi, common)
+        for start in range(lo, hi, block):
+            end = min(start + block, hi)
+            a = source[start:end]
+            b = target[start:end]
+            if a != b:
+                _diff_span(a, b, start, ranges)
+    if len(target) > common:
+        _add_range(ranges, common, len(target))
+    return ranges
+
+def _diff_span(a, b, base, ranges):
+    """Append the byte-exact differing ranges of equal-length a and b"""
+    if a == b:
+        return
+    if len(a) <= DIFF_LEAF:
+        for i, (x, y) in enumerate(zip(a, b)):
+            if x != y:
+                _add_range(ranges, base + i, base + i + 1)
+        return
+    mid = len(a) // 2
+    _diff_span(a[:mid], b[:mid], base, ranges)
+    _diff_span(a[mid:], b[mid:], base + mid, ranges)
+
+def _add_range(ranges, start, end):
+    if ranges and ranges[-1][1] == start:
+        ranges[-1] = (ranges[-1][0], end)
+    else:
+        ranges.append((start, end))
+
+def _merge_gaps(ranges, gap):
+    """Merge ranges separated by at most gap unchanged bytes"""
+    merged = []
+    for start, end in ranges:
+        if merged and start - merged[-1][1] <= gap:
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+def _segments(data):
+    """Split data into (start, end, fill) pieces; fill is the byte of a long run, or None"""
+    pos = 0
+    for match in _run_pattern.finditer(data):
+        if match.start() > pos:
+            yield pos, match.start(), None
+        yield match.start(), match.end(), data[match.start()]
+        pos = match.end()
+    if pos < len(data):
+        yield pos, len(data), None
+
+#----------------------------------------------------------------------
+# ENCODING HELPERS
+#----------------------------------------------------------------------
+
+def crc32(data):
+    """CRC32 of a bytes-like or RomBuffer, computed in chunks"""
+    crc = 0
+    for start in range(0, len(data), CRC_CHUNK):
+        crc = zlib.crc32(data[start:start + CRC_CHUNK], crc)
+    return crc
+
+def _xor(a, b):
+    """XOR two byte strings, zero-padding a to the length of b"""
+    a = bytes(a) + bytes(len(b) - len(a))
+    return (int.from_bytes(a, 'little') ^ int.from_bytes(b, 'little')).to_bytes(len(b), 'little')
+
+def encode_varint(value):
+    """Encode a UPS/BPS variable-length integer"""
+    out = bytearray()
+    while True:
+        x = value & 0x7F
+        value >>= 7
+        if value == 0:
+            out.append(0x80 | x)
+            return bytes(out)
+        out.append(x)
+        value -= 1
+
+def _decode_varint(patch, pos):
+    """Decode a UPS/BPS variable-length integer, returning (value, next position)"""
+    value = 0
+    shift = 1
+    while True:
+        if pos >= len(patch):
+            raise ValueError("Patch is truncated.")
+        x = patch[pos]
+        pos += 1
+        value += (x & 0x7F) * shift
+        if x & 0x80:
+            return value, pos
+        shift <<= 7
+        value += shift
+
+def _check_footer(patch, name):
+    """Validate the patch CRC and return (source_crc, target_crc)"""
+    if len(patch) < 16:
+        raise ValueError(f"{name} patch is truncated.")
+    source_crc, target_crc, patch_crc = (int.from_bytes(patch[i:i + 4], 'little')
+                                         for i in range(len(patch) - 12, len(patch), 4))
+    if zlib.crc32(patch[:-4]) != patch_crc:
+        raise ValueError(f"{name} patch is corrupt (checksum mismatch).")
+    return source_crc, target_crc
+
+#----------------------------------------------------------------------
+# EXPORT
+#----------------------------------------------------------------------
+
+def make_ips(source, target, windows=None):
+    """Build an IPS patch turning source into target"""
+    out = bytearray(b'PATCH')
+
+    def record(offset, data):
+        if offset == IPS_EOF_OFFSET:
+            # Start one byte earlier so the offset doesn't read as "EOF"
+            out.extend((offset - 1).to_bytes(3, 'big') + (2).to_bytes(2, 'big') + target[offset - 1:offset + 1])
+            offset, data = offset + 1, data[1:]
+            if not data:
+                return
+        if offset > IPS_MAX_OFFSET:
+            raise ValueError("IPS patches can't address past 16 MB; export UPS or BPS instead.")
+        out.extend(offset.to_bytes(3, 'big') + len(data).to_bytes(2, 'big') + data)
+
+    def rle_record(offset, size, value):
+        if offset == IPS_EOF_OFFSET:
+            record(offset, bytes([value]))
+            offset, size = offset + 1, size - 1
+            if not size:
+                return
+        if offset > IPS_MAX_OFFSET:
+            raise ValueError("IPS patches can't address past 16 MB; export UPS or BPS instead.")
+        out.extend(offset.to_bytes(3, 'big') + b'\x00\x00' + size.to_bytes(2, 'big') + bytes([value]))
+
+    for start, end in _merge_gaps(diff_ranges(source, target, windows), IPS_RECORD_OVERHEAD):
+        data = bytes(target[start:end])
+        for seg_start, seg_end, value in _segments(data):
+            for pos in range(seg_start, seg_end, IPS_MAX_RECORD):
+                size = min(IPS_MAX_RECORD, seg_end - pos)
+                if value is None:
+                    record(start + pos, data[pos:pos + size])
+                else:
+                    rle_record(start + pos, size, value)
+    out.extend(b'EOF')
+    if len(target) < len(source):
+        out.extend(len(target).to_bytes(3, 'big'))  # Truncation extension
+    return bytes(out)
+
+def make_ups(source, target, windows=None):
+    """Build a UPS patch turning source into target"""
+    out = bytearray(b'UPS1' + encode_varint(len(source)) + encode_varint(len(target)))
+    pos = 0
+    for start, end in diff_ranges(source, target, windows):
+        xor = _xor(source[start:end], bytes(target[start:end]))
+        for match in _nonzero_pattern.finditer(xor):
+            offset = start + match.start()
+            out.extend(encode_varint(offset - pos) + match.group() + b'\x00')
+            pos = offset + len(match.group()) + 1
+    out.extend(crc32(source).to_bytes(4, 'little') + crc32(target).to_bytes(4, 'little'))
+    out.extend(zlib.crc32(out).to_bytes(4, 'little'))
+    return bytes(out)
+
+def make_bps(source, target, windows=None):
+    """Build a BPS patch turning source into target (long runs become TargetCopy)"""
+    out = bytearray(b'BPS1' + encode_varint(len(source)) + encode_varint(len(target)) + encode_varint(0))
+    pos = 0
+    target_relative = 0
+
+    def action(command, length):
+        out.extend(encode_varint(((length - 1) << 2) | command))
+
+    for start, end in diff_ranges(source, target, windows):
+        if start > pos:
+            action(0, start - pos)  # SourceRead: unchanged bytes
+        data = bytes(target[start:end])
+        for seg_start, seg_end, value in _segments(data):
+            if value is None:
+                action(1, seg_end - seg_start)  # TargetRead: literal bytes
+                out.extend(data[seg_start:seg_end])
+                continue
+            # One literal byte, then an overlapping TargetCopy of it
+            run_start = start + seg_start
+            action(1, 1)
+            out.append(value)
+            action(3, seg_end - seg_start - 1)
+            delta = run_start - target_relative
+            out.extend(encode_varint((abs(delta) << 1) | (delta < 0)))
+            target_relative = run_start + seg_end - seg_start - 1
+        pos = end
+    if pos < len(target):
+        action(0, len(target) - pos)
+    out.extend(crc32(source).to_bytes(4, 'little') + crc32(target).to_bytes(4, 'little'))
+    out.extend(zlib.crc32(out).to_bytes(4, 'little'))
+    return bytes(out)
+
+def make_patch(fmt, source, target, windows=None):
+    """Build a patch in the given format (ips, ups or bps)"""
+    makers = {"ips": make_ips, "ups": make_ups, "bps": make_bps}
+    if fmt not in makers:
+        raise ValueError(f"Unknown patch format: {fmt}")
+    return makers[fmt](source, target, windows)
+
+#----------------------------------------------------------------------
+# IMPORT
+#----------------------------------------------------------------------
+
+def _ips_changes(patch, source):
+    pos = 5
+    changes = []
+    while True:
+        if patch[pos:pos + 3] == b'EOF':
+            truncate = patch[pos + 3:pos + 6]
+            if len(truncate) == 3 and int.from_bytes(truncate, 'big') != len(source):
+                raise ValueError("Patch changes the ROM size, which can't be applied to a loaded ROM.")
+            return changes
+        if pos + 5 > len(patch):
+            raise ValueError("IPS patch is truncated.")
+        offset = int.from_bytes(patch[pos:pos + 3], 'big')
+        size = int.from_bytes(patch[pos + 3:pos + 5], 'big')
+        pos += 5
+        if size:
+            data = patch[pos:pos + size]
+            pos += size
+        else:
+            size = int.from_bytes(patch[pos:pos + 2], 'big')
+            data = bytes([patch[pos + 2]]) * size
+            pos += 3
+        if len(data) != size:
+            raise ValueError("IPS patch is truncated.")
+        changes.append((offset, data))
+
+def _ups_changes(patch, source):
+    source_crc, target_crc = _check_footer(patch, "UPS")
+    source_size, pos = _decode_varint(patch, 4)
+    target_size, pos = _decode_varint(patch, pos)
+    if source_size != target_size or source_size != len(source):
+        raise ValueError("Patch changes the ROM size, which can't be applied to a loaded ROM.")
+    if crc32(source) not in (source_crc, target_crc):
+        raise ValueError("This patch was made for a different ROM (checksum mismatch).")
+
+    changes = []
+    offset = 0
+    end_of_records = len(patch) - 12
+    while pos < end_of_records:
+        skip, pos = _decode_varint(patch, pos)
+        offset += skip
+        stop = patch.index(b'\x00', pos, end_of_records)
+        xor = patch[pos:stop]
+        pos = stop + 1
+        changes.append((offset, _xor(source[offset:offset + len(xor)], xor)))
+        offset += len(xor) + 1
+    return changes
+
+def _bps_changes(patch, source):
+    source_crc, target_crc = _check_footer(patch, "BPS")
+    source_size, pos = _decode_varint(patch, 4)
+    target_size, pos = _decode_varint(patch, pos)
+    metadata_size, pos = _decode_varint(patch, pos)
+    pos += metadata_size
+    if source_size != len(source) or target_size != len(source):
+        raise ValueError("Patch changes the ROM size, which can't be applied to a loaded ROM.")
+    if crc32(source) != source_crc:
+        raise ValueError("This patch was made for a different ROM (checksum mismatch).")
+
+    target = bytearray(target_size)
+    out = 0
+    source_relative = 0
+    target_relative = 0
+    end_of_actions = len(patch) - 12
+    while pos < end_of_actions:
+        data, pos = _decode_varint(patch, pos)
+        command, length = data & 3, (data >> 2) + 1
+        if out + length > target_size:
+            raise ValueError("BPS patch writes past the end of the ROM.")
+        if command == 0:    # SourceRead
+            target[out:out + length] = source[out:out + length]
+        elif command == 1:  # TargetRead
+            target[out:out + length] = patch[pos:pos + length]
+            pos += length
+        else:
+            delta, pos = _decode_varint(patch, pos)
+            delta = -(delta >> 1) if delta & 1 else delta >> 1
+            if command == 2:  # SourceCopy
+                source_relative += delta
+                target[out:out + length] = source[source_relative:source_relative + length]
+                source_relative += length
+            else:             # TargetCopy, which may overlap its own output
+                target_relative += delta
+                if not 0 <= target_relative < out:
+                    raise ValueError("BPS patch is corrupt (bad TargetCopy).")
+                period = out - target_relative
+                if period >= length:
+                    target[out:out + length] = target[target_relative:target_relative + length]
+                else:
+                    pattern = bytes(target[target_relative:out])
+                    target[out:out + length] = (pattern * (length // period + 1))[:length]
+                target_relative += length
+        out += length
+    if zlib.crc32(target) != target_crc:
+        raise ValueError("Patched ROM doesn't match the patch checksum.")
+    return [(start, bytes(target[start:end])) for start, end in diff_ranges(source, target)]
+
+def patch_changes(patch, source):
+    """Decode a patch against source and return the (offset, bytes) writes it makes"""
+    patch = bytes(patch)
+    if patch.startswith(b'PATCH'):
+        changes = _ips_changes(patch, source)
+    elif patch.startswith(b'UPS1'):
+        changes = _ups_changes(patch, source)
+    elif patch.startswith(b'BPS1'):
+        changes = _bps_changes(patch, source)
+    else:
+        raise ValueError("Unrecognized patch format (expected IPS, UPS or BPS).")
+    for offset, data in changes:
+        if offset + len(data) > len(source):
+            raise ValueError("Patch writes past the end of the ROM.")
+    return changes
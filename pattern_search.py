@@ -0,0 +1,139 @@
+"""
+Byte pattern and Gen III text search for Ultimate Free Space Finder.
+Hex patterns with ?? wildcards ("08 ?? 00 ??") and strings in the Gen III
+character encoding both compile to one bytes regular expression, so the
+per-byte work runs inside re's C matcher, which turns a pattern without
+wildcards into a plain literal search. The image is searched in
+parallel_scan chunks overlapping by the pattern length, so hits across
+chunk edges are found once and a cancelled job stops between chunks.
+"""
+
+import re
+import string
+
+import parallel_scan
+
+MAX_HITS = 100000        # Hits kept per search; "??" alone would match every byte
+PATTERN_KINDS = ("hex", "text")
+WILDCARD = "??"
+
+UPPERCASE = 0xBB  # Gen III codes of A and a
+LOWERCASE = 0xD5
+
+# Gen III (English) character encoding: (first byte, characters at first byte onward)
+_CHARSET_RUNS = (
+    (0x00, " ÀÁÂÇÈÉÊËÌ"), (0x0B, "ÎÏÒÓÔŒÙÚÛÑßàá"), (0x19, "çèéêëì"), (0x20, "îïòóôœùúûñºª"),
+    (0x2D, "&+"), (0x35, "=;"), (0x51, "¿¡"), (0x5A, "Í%()"), (0x68, "â"), (0x6F, "í"), (0x85, "<>"),
+    (0xA1, "0123456789!?.-·…“”‘’♂♀¥,×/"), (UPPERCASE, string.ascii_uppercase), (LOWERCASE, string.ascii_lowercase),
+    (0xEF, "▶:ÄÖÜäöü"),
+)
+GEN3_CHARSET = {char: first + i for first, chars in _CHARSET_RUNS for i, char in enumerate(chars)}
+GEN3_CHARSET["'"] = GEN3_CHARSET["’"]  # What XSE and most editors type for the apostrophe
+GEN3_ESCAPES = {"n": 0xFE, "l": 0xFA, "p": 0xFB}  # XSE control codes: \n new line, \l scroll, \p new box
+
+#----------------------------------------------------------------------
+# PATTERNS
+#----------------------------------------------------------------------
+
+def parse_hex_pattern(raw):
+    """Parse hex bytes like '08 ?? 00 ??' or '08??00' into [byte value or None for a wildcard]"""
+    digits = "".join(raw.replace(",", " ").split()).upper()
+    if not digits:
+        raise ValueError("No bytes given")
+    if len(digits) % 2:
+        raise ValueError("Every byte needs two hex digits (or ??)")
+    values = []
+    for i in range(0, len(digits), 2):
+        pair = digits[i:i + 2]
+        if pair == WILDCARD:
+            values.append(None)
+        elif all(digit in string.hexdigits for digit in pair):
+            values.append(int(pair, 16))
+        else:
+            raise ValueError(f"Not a byte value: {pair}")
+    return values
+
+def encode_text(text):
+    """Encode a string with the Gen III character table (\\n, \\l and \\p are control codes)"""
+    encoded = bytearray()
+    chars = iter(text)
+    for char in chars:
+        if char == "\\":
+            code = next(chars, "")
+            if code not in GEN3_ESCAPES:
+                raise ValueError(f"Unknown control code: \\{code}")
+            encoded.append(GEN3_ESCAPES[code])
+        elif char in GEN3_CHARSET:
+            encoded.append(GEN3_CHARSET[char])
+        else:
+            raise ValueError(f"'{char}' has no Gen III character")
+    if not encoded:
+        raise ValueError("No text given")
+    return bytes(encoded)
+
+# Maps uppercase letters to lowercase, for searches that ignore case
+CASE_FOLD = bytes.maketrans(bytes(range(UPPERCASE, UPPERCASE + 26)), bytes(range(LOWERCASE, LOWERCASE + 26)))
+
+class SearchPattern:
+    """A hex or Gen III text pattern compiled to a bytes regular expression of fixed length.
+
+    Leading wildcards are left out of the expression and subtracted from
+    the match offsets instead, so it still starts with a literal re can
+    skip ahead to. Searches that ignore case fold the image and the
+    pattern to lowercase with CASE_FOLD rather than matching classes.
+    """
+    def __init__(self, raw, kind="hex", ignore_case=False):
+        if kind not in PATTERN_KINDS:
+            raise ValueError(f"Unknown pattern kind: {kind}")
+        self.raw = raw
+        self.kind = kind
+        self.table = None  # Translation applied to the image before matching
+        if kind == "hex":
+            values = parse_hex_pattern(raw)
+        else:
+            values = encode_text(raw)
+            if ignore_case:
+                self.table = CASE_FOLD
+                values = values.translate(CASE_FOLD)
+        self.length = len(values)
+        self.lead = next((i for i, value in enumerate(values) if value is not None), 0)  # Leading wildcards
+        self.regex = re.compile(b"".join(b"." if value is None else re.escape(bytes([value]))
+                                         for value in values[self.lead:]), re.DOTALL)
+
+    def __repr__(self):
+        return f"<SearchPattern {self.kind} {self.raw!r}>"
+
+    def describe(self):
+        if self.kind == "hex":
+            return self.raw.strip().upper()
+        return f'"{self.raw}"' + (" (any case)" if self.table else "")
+
+#----------------------------------------------------------------------
+# SEARCH
+#----------------------------------------------------------------------
+
+def _chunk_hits(chunk, regex, table, overlap, limit):
+    """Offsets of the first limit matches starting in chunk, leaving out its overlap with the next chunk"""
+    if table is not None:
+        chunk = chunk.translate(table)
+    stop = len(chunk) - overlap
+    hits = []
+    match = regex.search(chunk)
+    while match and match.start() < stop and len(hits) < limit:
+        hits.append(match.start())
+        match = regex.search(chunk, match.start() + 1)  # Overlapping matches count too
+    return hits
+
+def find_pattern(data, pattern, limit=MAX_HITS):
+    """Return the offsets of the first limit matches of a SearchPattern in data, overlapping ones included"""
+    lead = pattern.lead
+    overlap = pattern.length - lead - 1
+    pieces = parallel_scan.map_chunks(data, _chunk_hits, (pattern.regex, pattern.table, overlap, limit + lead),
+                                      overlap=overlap)
+    hits = []
+    for lo, hi, chunk_hits in pieces:
+        # Matches too close to the start for the leading wildcards don't count
+        hits += [lo + hit - lead for hit in chunk_hits if lo + hit >= lead]
+        if len(hits) >= limit:
+            return hits[:limit]
+    return hits
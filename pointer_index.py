@@ -0,0 +1,123 @@
+"""
+Pointer reverse index for Ultimate Free Space Finder.
+A run of 0xFF can still be live data if something points at it, so this
+finds every little-endian 0x08xxxxxx/0x09xxxxxx word that points inside
+the ROM and indexes it by target offset. Edits only rescan the words they
+touch.
+"""
+
+import re
+from bisect import bisect_left, insort
+
+import parallel_scan
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, everything falls back to the stdlib
+    np = None
+
+ROM_BASE = 0x08000000    # GBA address of ROM offset 0
+POINTER_ALIGNMENT = 4    # Pointers in tables and structs are word aligned
+_POINTER_HIGH = re.compile(rb"[\x08\x09]")  # Top byte of a ROM pointer
+
+def _chunk_pointers(chunk, rom_size, alignment, base_phase=0):
+    """Return (sources, targets) of the pointer words that fit in chunk.
+
+    Sources are relative to the chunk; base_phase is the chunk start modulo
+    alignment so only properly aligned words are taken.
+    """
+    first = (-base_phase) % alignment
+    if np is not None and alignment in (1, 2, 4):
+        return _chunk_pointers_numpy(chunk, rom_size, alignment, first)
+    sources, targets = [], []
+    for match in _POINTER_HIGH.finditer(chunk, first + 3):
+        source = match.start() - 3
+        if (source - first) % alignment:
+            continue
+        target = int.from_bytes(chunk[source:source + 4], "little") - ROM_BASE
+        if target < rom_size:
+            sources.append(source)
+            targets.append(target)
+    return sources, targets
+
+def _chunk_pointers_numpy(chunk, rom_size, alignment, first):
+    """Vectorized _chunk_pointers: one word view per alignment phase"""
+    found = []
+    for phase in range(first, 4, alignment):
+        count = (len(chunk) - phase) // 4
+        if count <= 0:
+            continue
+        words = np.frombuffer(chunk, dtype="<u4", count=count, offset=phase)
+        targets = words.astype(np.int64) - ROM_BASE
+        keep = np.flatnonzero((targets >= 0) & (targets < rom_size))
+        found.append((keep * 4 + phase, targets[keep]))
+    if not found:
+        return [], []
+    sources = np.concatenate([s for s, _ in found])
+    targets = np.concatenate([t for _, t in found])
+    order = np.argsort(sources, kind="stable")
+    return sources[order].tolist(), targets[order].tolist()
+
+def find_pointers(data, start=0, end=None, alignment=POINTER_ALIGNMENT, workers=None):
+    """Return (sources, targets) of every ROM pointer word starting in data[start:end].
+
+    targets are ROM offsets (pointer - 0x08000000) inside data; sources are
+    multiples of alignment. Large scans are spread over parallel_scan's pool.
+    """
+    end = len(data) if end is None else min(end, len(data))
+    start = (start + alignment - 1) // alignment * alignment
+    sources, targets = [], []
+    if start >= end or start + 4 > len(data):
+        return sources, targets
+    if start == 0 and end == len(data):
+        # The chunk size is a multiple of every alignment, so chunks start in phase.
+        # The 3 byte overlap completes words that start in a chunk and end in the next.
+        pieces = parallel_scan.map_chunks(data, _chunk_pointers, (len(data), alignment),
+                                          overlap=3, workers=workers)
+    else:
+        chunk = bytes(data[start:min(end + 3, len(data))])
+        pieces = [(start, end, _chunk_pointers(chunk, len(data), alignment))]
+    for lo, _, (chunk_sources, chunk_targets) in pieces:
+        sources += [lo + source for source in chunk_sources]
+        targets += chunk_targets
+    return sources, targets
+
+class PointerIndex:
+    """Reverse index from target offset to the offsets of the pointers referring to it"""
+    def __init__(self, data, alignment=POINTER_ALIGNMENT, pointers=None):
+        """pointers optionally gives the (sources, targets) of data, already found"""
+        self.data = data
+        self.alignment = alignment
+        sources, targets = pointers if pointers is not None else find_pointers(data, alignment=alignment)
+        sources = list(sources)
+        self.sources = sources                     # Sorted pointer offsets
+        self.target_of = dict(zip(sources, targets))
+        self.pointers = sorted(zip(targets, sources))  # Sorted (target, source)
+
+    def __len__(self):
+        return len(self.sources)
+
+    def referrers(self, target):
+        """Offsets of the pointers to target"""
+        return [source for _, source in self.references(target, target + 1)]
+
+    def references(self, start, end):
+        """Return [(target, source)] of every pointer to an offset in start .. end-1"""
+        lo = bisect_left(self.pointers, (start, -1))
+        hi = bisect_left(self.pointers, (end, -1))
+        return self.pointers[lo:hi]
+
+    def update(self, data, lo, hi):
+        """Rescan the pointer words overlapping an edit of data[lo:hi]"""
+        self.data = data
+        win_lo = max(0, lo - 3)
+        first = bisect_left(self.sources, win_lo)
+        last = bisect_left(self.sources, hi)
+        for source in self.sources[first:last]:
+            target = self.target_of.pop(source)
+            del self.pointers[bisect_left(self.pointers, (target, source))]
+        new_sources, new_targets = find_pointers(data, win_lo, hi, self.alignment)
+        self.sources[first:last] = new_sources
+        for source, target in zip(new_sources, new_targets):
+            self.target_of[source] = target
+            insort(self.pointers, (target, source))
@@ -0,0 +1,465 @@
+"""
+ROM edit buffer for Ultimate Free Space Finder.
+The original image is served read-only (zero-copy from an mmap of the file,
+or from a single bytes object) and every edit lands in a copy-on-write
+overlay of fixed-size pages, so memory grows with the edits, not the ROM.
+Every write/fill is recorded as a compact delta for O(edit size) undo/redo.
+A ROM opened next to another one can instead keep only the pages that
+differ from it (SharedPageImage), so near-identical builds share memory.
+"""
+
+import mmap
+import os
+import zlib
+from contextlib import contextmanager
+from bisect import bisect_left, bisect_right, insort
+
+PAGE_SIZE = 4096
+HISTORY_LIMIT = 1000  # Undo steps kept per buffer
+HISTORY_BYTES = 64 << 20  # Bytes of before/after data the undo and redo steps may hold
+READ_BLOCK = 1 << 20  # File read size when building a SharedPageImage
+
+class EditHistory:
+    """Undo/redo stacks of (offset, before, after) deltas.
+
+    after is either the written bytes or, for fills, the fill value. Each
+    stack entry is a list of deltas that are undone/redone together. The
+    oldest steps are dropped past limit steps or byte_limit bytes held,
+    though the newest step is always kept.
+    """
+    def __init__(self, limit=HISTORY_LIMIT, byte_limit=HISTORY_BYTES):
+        self.limit = limit
+        self.byte_limit = byte_limit
+        self.undo_stack = []
+        self.redo_stack = []
+        self.size = 0  # Bytes held by both stacks
+        self._group = None
+
+    def record(self, offset, before, after):
+        if self._group is not None:
+            self._group.append((offset, before, after))
+            return
+        self._push([(offset, before, after)])
+
+    def _push(self, deltas):
+        self.size -= sum(map(_step_size, self.redo_stack))
+        self.redo_stack.clear()
+        self.undo_stack.append(deltas)
+        self.size += _step_size(deltas)
+        while len(self.undo_stack) > 1 and (len(self.undo_stack) > self.limit or self.size > self.byte_limit):
+            self.size -= _step_size(self.undo_stack.pop(0))
+
+    @contextmanager
+    def group(self):
+        """Record every edit made inside the block as a single undo step"""
+        self._group = []
+        try:
+            yield
+        finally:
+            deltas, self._group = self._group, None
+            if deltas:
+                self._push(deltas)
+
+    @property
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    @property
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+class SharedPageImage:
+    """Read-only image stored as its differences from a shared image.
+
+    Every page that also occurs in the shared image, at the same offset or
+    (found by CRC32) anywhere else, is read from there; only the other
+    pages are held in memory, and identical ones only once. shared is a
+    callable returning the shared image, so it follows a RomBuffer whose
+    original image is re-opened after a save.
+    """
+    def __init__(self, shared, refs, size):
+        self.shared = shared
+        self.refs = refs  # Per page: page number in the shared image, or the page's own bytes
+        self.size = size
+
+    @classmethod
+    def open(cls, path, shared):
+        """Read a ROM file, keeping only the pages the shared image doesn't have"""
+        image = shared()
+        shared_pages = len(image) // PAGE_SIZE
+        by_crc = None  # CRC32 -> shared page number, built on the first page not found in place
+        own = {}       # CRC32 -> own pages, so repeated pages are stored once
+        refs = []
+        size = 0
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(READ_BLOCK)
+                if not block:
+                    break
+                for pos in range(0, len(block), PAGE_SIZE):
+                    page = block[pos:pos + PAGE_SIZE]
+                    size += len(page)
+                    number = len(refs)
+                    start = number * PAGE_SIZE
+                    if image[start:start + len(page)] == page:
+                        refs.append(number)
+                        continue
+                    crc = zlib.crc32(page)
+                    if len(page) == PAGE_SIZE:
+                        if by_crc is None:
+                            by_crc = {}
+                            for other in range(shared_pages - 1, -1, -1):
+                                by_crc[zlib.crc32(image[other * PAGE_SIZE:(other + 1) * PAGE_SIZE])] = other
+                        other = by_crc.get(crc)
+                        if other is not None and image[other * PAGE_SIZE:(other + 1) * PAGE_SIZE] == page:
+                            refs.append(other)
+                            continue
+                    twin = own.setdefault(crc, page)
+                    refs.append(twin if twin == page else page)
+        return cls(shared, refs, size)
+
+    @property
+    def shared_pages(self):
+        """Number of pages read from the shared image"""
+        return sum(1 for ref in self.refs if isinstance(ref, int))
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.size)
+            if step != 1:
+                return self[0:self.size][key]
+            return self._read(start, stop)
+        if key < 0:
+            key += self.size
+        if not 0 <= key < self.size:
+            raise IndexError("image index out of range")
+        return self._read(key, key + 1)[0]
+
+    def _read(self, start, stop):
+        if start >= stop:
+            return b''
+        image = None
+        first, last = start // PAGE_SIZE, (stop - 1) // PAGE_SIZE
+        parts = []
+        page = first
+        while page <= last:
+            ref = self.refs[page]
+            if isinstance(ref, bytes):
+                parts.append(ref)
+                page += 1
+                continue
+            # Consecutive shared pages come out of one slice
+            count = 1
+            while page + count <= last and self.refs[page + count] == ref + count:
+                count += 1
+            if image is None:
+                image = self.shared()
+            parts.append(image[ref * PAGE_SIZE:(ref + count) * PAGE_SIZE])
+            page += count
+        base = first * PAGE_SIZE
+        return b''.join(parts)[start - base:stop - base]
+
+    def find(self, sub, start=0, end=None):
+        """bytes.find over the image, in growing windows so nearby matches stay cheap"""
+        end = self.size if end is None else min(end, self.size)
+        pos = max(0, start)
+        if not sub:
+            return pos if pos <= end else -1
+        window = PAGE_SIZE
+        while pos < end:
+            hi = min(end, pos + window)
+            found = self._read(pos, min(end, hi + len(sub) - 1)).find(sub)
+            if found != -1:
+                return pos + found
+            pos = hi
+            window = min(window * 2, READ_BLOCK)
+        return -1
+
+    def detach(self, ranges=None):
+        """Copy the shared pages in [(start, end)] ranges of the shared image (all if None).
+
+        Call this before the shared image changes or goes away; after a full
+        detach the image stands on its own.
+        """
+        image = self.shared()
+        pages = None
+        if ranges is not None:
+            pages = {page for start, end in ranges for page in range(start // PAGE_SIZE, (end - 1) // PAGE_SIZE + 1)}
+        copies = {}
+        for number, ref in enumerate(self.refs):
+            if isinstance(ref, int) and (pages is None or ref in pages):
+                if ref not in copies:
+                    copies[ref] = bytes(image[ref * PAGE_SIZE:(ref + 1) * PAGE_SIZE])
+                self.refs[number] = copies[ref]
+        if ranges is None:
+            self.shared = None  # Nothing is read from the shared image any more
+
+class RomBuffer:
+    """Read-only base image plus a copy-on-write page overlay"""
+    def __init__(self, base, file=None):
+        self.base = base       # bytes or mmap holding the original image
+        self.file = file       # Open file backing an mmap base, if any
+        self.pages = {}        # Page number -> bytearray copy with edits
+        self.dirty = []        # Sorted page numbers present in self.pages
+        self.history = EditHistory()
+
+    @classmethod
+    def open(cls, path, use_mmap=True):
+        """Open a ROM file, memory-mapping it read-only when use_mmap is set"""
+        if use_mmap and os.path.getsize(path) > 0:
+            f = open(path, 'rb')
+            try:
+                return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), f)
+            except (OSError, ValueError):
+                f.close()
+        with open(path, 'rb') as f:
+            return cls(f.read())
+
+    @classmethod
+    def open_shared(cls, path, other):
+        """Open a ROM file as a SharedPageImage over another buffer's original image"""
+        return cls(SharedPageImage.open(path, lambda: other.base))
+
+    @property
+    def is_shared(self):
+        """True while part of the original image is read from another ROM's"""
+        return isinstance(self.base, SharedPageImage) and self.base.shared is not None
+
+    @property
+    def is_mapped(self):
+        return isinstance(self.base, mmap.mmap)
+
+    def close(self):
+        """Release the mmap and file handle (the buffer is unusable after)"""
+        if self.is_mapped:
+            self.base.close()
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def reopen(self, path, use_mmap=True, keep_edits=True):
+        """Re-open the base image from path, e.g. after the file was rewritten.
+
+        The new image is opened and swapped in before the old one is
+        closed, so reads from other threads never see a closed mmap.
+        keep_edits=False drops the overlay, for when path already holds it.
+        """
+        if self.is_shared:
+            fresh = RomBuffer(SharedPageImage.open(path, self.base.shared))
+        else:
+            fresh = RomBuffer.open(path, use_mmap)
+        old = RomBuffer(self.base, self.file)
+        self.base, self.file = fresh.base, fresh.file
+        if not keep_edits:
+            # dirty goes first: a read that still sees a dirty page also finds it in pages
+            self.dirty = []
+            self.pages = {}
+        old.close()
+
+    @property
+    def overlay_size(self):
+        """Bytes held by the edit overlay"""
+        return len(self.pages) * PAGE_SIZE
+
+    def __len__(self):
+        return len(self.base)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return self.read(0, len(self))[key]
+            return self.read(start, stop - start)
+        if key < 0:
+            key += len(self)
+        page = self.pages.get(key // PAGE_SIZE)
+        if page is not None:
+            return page[key % PAGE_SIZE]
+        return self.base[key]
+
+    #----------------------------------------------------------------------
+    # READS
+    #----------------------------------------------------------------------
+
+    def _dirty_between(self, first_page, last_page):
+        """Dirty page numbers in [first_page, last_page]"""
+        lo = bisect_left(self.dirty, first_page)
+        hi = bisect_right(self.dirty, last_page)
+        return self.dirty[lo:hi]
+
+    def read(self, offset, size):
+        """Return size bytes starting at offset (clipped to the ROM)"""
+        end = min(offset + size, len(self))
+        offset = max(0, offset)
+        if offset >= end:
+            return b''
+        pages = self.pages
+        dirty = self._dirty_between(offset // PAGE_SIZE, (end - 1) // PAGE_SIZE)
+        if not dirty:
+            return bytes(self.base[offset:end])
+
+        parts = []
+        pos = offset
+        for page in dirty:
+            page_start = page * PAGE_SIZE
+            if pos < page_start:
+                parts.append(self.base[pos:page_start])
+                pos = page_start
+            page_end = min(page_start + PAGE_SIZE, end)
+            parts.append(pages[page][pos - page_start:page_end - page_start])
+            pos = page_end
+        if pos < end:
+            parts.append(self.base[pos:end])
+        return b''.join(parts)
+
+    def startswith(self, prefix, offset=0):
+        """Check whether the buffer holds prefix at offset"""
+        return self.read(offset, len(prefix)) == prefix
+
+    def _dirty_spans(self, start_page):
+        """Yield (first, last) runs of consecutive dirty pages from start_page on"""
+        i = bisect_left(self.dirty, start_page)
+        while i < len(self.dirty):
+            first = last = self.dirty[i]
+            i += 1
+            while i < len(self.dirty) and self.dirty[i] == last + 1:
+                last = self.dirty[i]
+                i += 1
+            yield first, last
+
+    def find(self, sub, start=0, end=None):
+        """bytes.find over the edited image: clean stretches search the base in place"""
+        size = len(self)
+        end = size if end is None else min(end, size)
+        start = max(0, start)
+        if not self.dirty:
+            return self.base.find(sub, start, end)
+
+        width = len(sub)
+        pos = start
+        for first, last in self._dirty_spans(max(0, start - width) // PAGE_SIZE):
+            span_lo = first * PAGE_SIZE
+            span_hi = min((last + 1) * PAGE_SIZE, size)
+            if span_hi <= pos:
+                continue
+            if span_lo - width + 1 >= end:
+                break
+            # Matches that lie entirely in the clean stretch before this span
+            if pos < span_lo:
+                found = self.base.find(sub, pos, min(span_lo, end))
+                if found != -1:
+                    return found
+            # Matches that touch the span
+            win_lo = max(pos, span_lo - width + 1)
+            win_hi = min(end, span_hi + width - 1)
+            if win_lo < win_hi:
+                found = self.read(win_lo, win_hi - win_lo).find(sub)
+                if found != -1:
+                    return win_lo + found
+            pos = max(pos, span_hi)
+            if pos >= end:
+                return -1
+        return self.base.find(sub, pos, end)
+
+    #----------------------------------------------------------------------
+    # WRITES
+    #----------------------------------------------------------------------
+
+    def _page(self, page):
+        """Return the writable copy of a page, copying it from the base on first write"""
+        buf = self.pages.get(page)
+        if buf is None:
+            page_start = page * PAGE_SIZE
+            buf = self.pages[page] = bytearray(self.base[page_start:page_start + PAGE_SIZE])
+            insort(self.dirty, page)
+        return buf
+
+    def _write(self, offset, data):
+        pos = 0
+        while pos < len(data):
+            page, page_pos = divmod(offset + pos, PAGE_SIZE)
+            step = min(PAGE_SIZE - page_pos, len(data) - pos)
+            self._page(page)[page_pos:page_pos + step] = data[pos:pos + step]
+            pos += step
+
+    def _fill(self, offset, size, value):
+        block = bytes([value]) * min(size, PAGE_SIZE)
+        pos = offset
+        end = offset + size
+        while pos < end:
+            page, page_pos = divmod(pos, PAGE_SIZE)
+            step = min(PAGE_SIZE - page_pos, end - pos)
+            self._page(page)[page_pos:page_pos + step] = block[:step]
+            pos += step
+
+    def write(self, offset, data):
+        """Overwrite len(data) bytes at offset"""
+        if offset < 0 or offset + len(data) > len(self):
+            raise ValueError("Out of bounds")
+        data = bytes(data)
+        self.history.record(offset, self.read(offset, len(data)), data)
+        self._write(offset, data)
+
+    def fill(self, offset, size, value):
+        """Fill size bytes from offset with value"""
+        if offset < 0 or size < 0 or offset + size > len(self):
+            raise ValueError("Out of bounds")
+        self.history.record(offset, self.read(offset, size), value)
+        self._fill(offset, size, value)
+
+    #----------------------------------------------------------------------
+    # UNDO / REDO
+    #----------------------------------------------------------------------
+
+    def undo(self):
+        """Revert the last edit, returning the (start, end) range it spans or None"""
+        if not self.history.undo_stack:
+            return None
+        deltas = self.history.undo_stack.pop()
+        for offset, before, after in reversed(deltas):
+            self._write(offset, before)
+        self.history.redo_stack.append(deltas)
+        return _span(deltas)
+
+    def redo(self):
+        """Reapply the last undone edit, returning the (start, end) range it spans or None"""
+        if not self.history.redo_stack:
+            return None
+        deltas = self.history.redo_stack.pop()
+        for offset, before, after in deltas:
+            if isinstance(after, int):
+                self._fill(offset, len(before), after)
+            else:
+                self._write(offset, after)
+        self.history.undo_stack.append(deltas)
+        return _span(deltas)
+
+    def changed_ranges(self):
+        """Return merged (start, end) ranges of overlay pages that differ from the base"""
+        ranges = []
+        for page in self.dirty:
+            start = page * PAGE_SIZE
+            end = min(start + PAGE_SIZE, len(self))
+            if self.pages[page] == self.base[start:end]:
+                continue
+            if ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+        return ranges
+
+    def tobytes(self):
+        """Return the full edited image as bytes"""
+        return self.read(0, len(self))
+
+def _span(deltas):
+    """(start, end) range covered by a list of deltas"""
+    return (min(offset for offset, _, _ in deltas),
+            max(offset + len(before) for offset, before, _ in deltas))
+
+def _step_size(deltas):
+    """Bytes an undo step holds: the before bytes, plus the after bytes of writes"""
+    return sum(len(before) + (0 if isinstance(after, int) else len(after)) for _, before, after in deltas)
@@ -0,0 +1,453 @@
+"""
+Bulk scanning primitives for Ultimate Free Space Finder.
+Every free-space finder and range check goes through here so the per-byte
+work runs inside bytes.find, in-place block comparisons or NumPy, never in
+a Python loop. Works on bytes, bytearray and mmap objects alike.
+"""
+
+from bisect import bisect_left, bisect_right
+from operator import sub
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, everything falls back to the stdlib
+    np = None
+
+BLOCK_SIZE = 65536  # Size of the cached fill blocks used for bulk compares
+_fill_blocks = {}
+
+#----------------------------------------------------------------------
+# BULK PRIMITIVES
+#----------------------------------------------------------------------
+
+def fill_block(value, size=BLOCK_SIZE):
+    """Return a cached block of value bytes (at most BLOCK_SIZE long)"""
+    block = _fill_blocks.get(value)
+    if block is None:
+        block = _fill_blocks[value] = bytes([value]) * BLOCK_SIZE
+    return block if size >= BLOCK_SIZE else block[:size]
+
+def _matcher(data):
+    """Return a function(block, offset) testing whether data[offset:] starts with block"""
+    startswith = getattr(data, 'startswith', None)
+    if startswith is not None:
+        return startswith  # memcmp in place, no slice copy
+    return lambda block, offset: data[offset:offset + len(block)] == block
+
+def align_up(offset, alignment):
+    """Round offset up to a multiple of alignment"""
+    return (offset + alignment - 1) // alignment * alignment
+
+def is_filled(data, start, size, value):
+    """Check if data[start:start+size] is entirely value"""
+    if start < 0 or size < 0 or start + size > len(data):
+        return False
+    matches = _matcher(data)
+    end = start + size
+    while start < end:
+        step = min(BLOCK_SIZE, end - start)
+        if not matches(fill_block(value, step), start):
+            return False
+        start += step
+    return True
+
+def run_end(data, value, offset, limit=None):
+    """Return the end (exclusive) of the run of value starting at offset"""
+    limit = len(data) if limit is None else min(limit, len(data))
+    matches = _matcher(data)
+    step = 16
+    while offset < limit:
+        step = min(step, BLOCK_SIZE, limit - offset)
+        if not matches(fill_block(value, step), offset):
+            chunk = bytes(data[offset:offset + step])
+            return offset + len(chunk) - len(chunk.lstrip(bytes([value])))
+        offset += step
+        step *= 2
+    return limit
+
+def run_start(data, value, offset, limit=0):
+    """Return the start of the run of value ending (exclusive) at offset"""
+    matches = _matcher(data)
+    step = 16
+    while offset > limit:
+        step = min(step, BLOCK_SIZE, offset - limit)
+        if not matches(fill_block(value, step), offset - step):
+            chunk = bytes(data[offset - step:offset])
+            return offset - (len(chunk) - len(chunk.rstrip(bytes([value]))))
+        offset -= step
+        step *= 2
+    return limit
+
+def find_block(data, value, size, start=0, end=None):
+    """Return the first offset of size consecutive value bytes, or -1"""
+    end = len(data) if end is None else end
+    if size <= BLOCK_SIZE:
+        return data.find(fill_block(value, max(1, size)), start, end)
+    # Long requests: hop between full blocks and verify the remainder
+    block = fill_block(value)
+    while True:
+        found = data.find(block, start, end)
+        if found == -1:
+            return -1
+        run_begin = run_start(data, value, found, start)
+        stop = run_end(data, value, found + BLOCK_SIZE, end)
+        if stop - run_begin >= size:
+            return run_begin
+        start = stop
+
+def find_runs(data, value, min_length=1, start=0, end=None):
+    """Return (starts, ends) of every run of value at least min_length long in data[start:end]"""
+    end = len(data) if end is None else min(end, len(data))
+    if np is not None and end - start >= BLOCK_SIZE and _has_buffer(data):
+        return _find_runs_numpy(data, value, min_length, start, end)
+    min_length = max(1, min_length)
+    pattern = fill_block(value, min(min_length, BLOCK_SIZE))
+    starts, ends = [], []
+    pos = start
+    while True:
+        found = data.find(pattern, pos, end)
+        if found == -1:
+            break
+        if len(pattern) < min_length:
+            found = find_block(data, value, min_length, found, end)
+            if found == -1:
+                break
+        # data.find lands on the first qualifying offset, which is the run start
+        stop = run_end(data, value, found + len(pattern), end)
+        starts.append(found)
+        ends.append(stop)
+        pos = stop
+    return starts, ends
+
+def _has_buffer(data):
+    """Check if data exposes the buffer protocol (NumPy can wrap it in place)"""
+    try:
+        memoryview(data).release()
+        return True
+    except TypeError:
+        return False
+
+def _find_runs_numpy(data, value, min_length, start, end):
+    """Vectorized find_runs: edge detection over a boolean mask"""
+    arr = np.frombuffer(data, dtype=np.uint8, count=end - start, offset=start)
+    mask = np.empty(len(arr) + 2, dtype=np.int8)
+    mask[0] = mask[-1] = 0
+    np.equal(arr, value, out=mask[1:-1], casting='unsafe')
+    edges = np.diff(mask)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    keep = (ends - starts) >= max(1, min_length)
+    return (starts[keep] + start).tolist(), (ends[keep] + start).tolist()
+
+def fill(buffer, start, size, value):
+    """Fill buffer[start:start+size] with value in one slice assignment"""
+    view = memoryview(buffer)
+    end = start + size
+    while start < end:
+        step = min(BLOCK_SIZE, end - start)
+        view[start:start + step] = fill_block(value, step)
+        start += step
+
+#----------------------------------------------------------------------
+# FILLER SETS
+#----------------------------------------------------------------------
+
+def filler_mask(data, fillers, start=0, end=None):
+    """Map data[start:end] to 1 for filler bytes and 0 for anything else, in one translate pass"""
+    end = len(data) if end is None else min(end, len(data))
+    table = bytes(1 if b in fillers else 0 for b in range(256))
+    return bytes(data[start:end]).translate(table)
+
+def find_filler_runs(data, fillers, min_length=1, tolerance=0, start=0, end=None):
+    """Return (starts, ends) of every run of filler bytes at least min_length long in data[start:end].
+
+    fillers is a set of byte values that all count as free, so {0xFF, 0x00}
+    finds mixed runs. With tolerance K a run may contain up to K other
+    bytes; runs are then the maximal windows holding at most K of them, so
+    neighbouring runs can overlap. Starts and ends are both increasing.
+    K is capped at min_length - 1 so every run holds some filler bytes.
+    """
+    end = len(data) if end is None else min(end, len(data))
+    mask = filler_mask(data, fillers, start, end)
+    min_length = max(1, min_length)
+    tolerance = min(tolerance, min_length - 1)
+    if tolerance <= 0:
+        starts, ends = find_runs(mask, 1, min_length)
+    else:
+        starts, ends = _tolerant_runs(mask, min_length, tolerance)
+    return [pos + start for pos in starts], [pos + start for pos in ends]
+
+def _tolerant_runs(mask, min_length, tolerance):
+    """Maximal windows of mask with at most tolerance zeros and at least min_length long.
+
+    Splitting such a window at its zeros leaves at most tolerance + 1 clean
+    pieces, so one of them is at least (min_length - tolerance) / (tolerance + 1)
+    long. Only the clean runs that long seed a search: from each, hop out over
+    the nearest zeros with find/rfind instead of visiting every byte.
+    """
+    piece = max(1, -(-(min_length - tolerance) // (tolerance + 1)))
+    seed_starts, seed_ends = find_runs(mask, 1, piece)
+    windows = set()
+    for seed_start, seed_end in zip(seed_starts, seed_ends):
+        # left[j]: start of the window holding j zeros left of the seed
+        left = [seed_start]
+        pos = seed_start - 1
+        while len(left) <= tolerance and pos >= 0:
+            pos = mask.rfind(b"\x00", 0, pos)
+            left.append(pos + 1)
+        # right[j]: end of the window holding j zeros right of the seed
+        right = [seed_end]
+        pos = seed_end
+        while len(right) <= tolerance and pos < len(mask):
+            found = mask.find(b"\x00", pos + 1)
+            pos = len(mask) if found == -1 else found
+            right.append(pos)
+        for zeros_left, window_start in enumerate(left):
+            window_end = right[min(tolerance - zeros_left, len(right) - 1)]
+            if window_end - window_start >= min_length:
+                windows.add((window_start, window_end))
+
+    # Drop windows that another one contains (near either end of the data)
+    starts, ends = [], []
+    for window_start, window_end in sorted(windows, key=lambda w: (w[0], -w[1])):
+        if not ends or window_end > ends[-1]:
+            starts.append(window_start)
+            ends.append(window_end)
+    return starts, ends
+
+#----------------------------------------------------------------------
+# BLOCK MAP
+#----------------------------------------------------------------------
+
+# Block classes for classify_blocks
+BLOCK_USED, BLOCK_MIXED, BLOCK_FREE_00, BLOCK_FREE_FF = range(4)
+
+def classify_blocks(runs, block_size, start, end):
+    """Classify data[start:end] in block_size blocks from its free runs.
+
+    runs maps 0xFF and 0x00 to their sorted (starts, ends) run lists. A
+    block is BLOCK_FREE_FF/BLOCK_FREE_00 if a single run covers it,
+    BLOCK_MIXED if a run only covers part of it and BLOCK_USED otherwise.
+    Returns a bytearray with one class per block.
+    """
+    count = (end - start + block_size - 1) // block_size
+    classes = bytearray(count)
+    for value, full in ((0xFF, BLOCK_FREE_FF), (0x00, BLOCK_FREE_00)):
+        starts, ends = runs[value]
+        for pos in range(bisect_right(ends, start), bisect_left(starts, end)):
+            run_lo = max(starts[pos], start) - start
+            run_hi = min(ends[pos], end) - start
+            first, last = run_lo // block_size, (run_hi - 1) // block_size
+            full_first = (run_lo + block_size - 1) // block_size
+            full_end = count if run_hi == end - start else run_hi // block_size
+            if full_first < full_end:
+                classes[full_first:full_end] = bytes([full]) * (full_end - full_first)
+            # Blocks at either end of the run that it only partly covers
+            if first < full_first or first >= full_end:
+                classes[first] = BLOCK_MIXED
+            if last >= full_end:
+                classes[last] = BLOCK_MIXED
+    return classes
+
+#----------------------------------------------------------------------
+# FREE RUN INDEX
+#----------------------------------------------------------------------
+
+class FreeRunIndex:
+    """Sorted run-length index of every 0xFF and 0x00 run in the ROM.
+
+    Runs shorter than MIN_RUN are not indexed; requests that small are
+    answered straight from the ROM data instead.
+    """
+    MIN_RUN = 16
+    FILL_VALUES = (0xFF, 0x00)
+
+    def __init__(self, data, runs=None):
+        """runs optionally maps each FILL_VALUES value to its (starts, ends), already found"""
+        self.data = data
+        self.starts = {}
+        self.ends = {}
+        self.trees = {}
+        self.stale = {}  # Value -> first run whose tree leaf is out of date (runs moved), or None
+        self.leaves = {}  # Value -> leaves filled in the tree, at least the run count when it was up to date
+        for value in self.FILL_VALUES:
+            if runs is None:
+                self.starts[value], self.ends[value] = find_runs(data, value, self.MIN_RUN)
+            else:
+                self.starts[value], self.ends[value] = runs[value]
+            self._build_tree(value)
+
+    def _build_tree(self, value):
+        """Build a max segment tree over run lengths for first-fit queries"""
+        starts, ends = self.starts[value], self.ends[value]
+        size = 1
+        while size < len(starts):
+            size *= 2
+        tree = [0] * (2 * size)
+        tree[size:size + len(starts)] = [e - s for s, e in zip(starts, ends)]
+        for node in range(size - 1, 0, -1):
+            tree[node] = max(tree[2 * node], tree[2 * node + 1])
+        self.trees[value] = (size, tree)
+        self.stale[value] = None
+        self.leaves[value] = len(starts)
+
+    def _update_tree(self, value, first, stop):
+        """Refresh the tree leaves of runs first .. stop-1 and their ancestors, rebuilding if it outgrew"""
+        size, tree = self.trees[value]
+        starts, ends = self.starts[value], self.ends[value]
+        if len(starts) > size:
+            self._build_tree(value)
+            return
+        stop = min(stop, size)
+        lengths = list(map(sub, ends[first:stop], starts[first:stop]))
+        tree[size + first:size + stop] = lengths + [0] * (stop - first - len(lengths))
+        lo, hi = (size + first) // 2, (size + stop - 1) // 2
+        while lo:  # One level at a time, each as a single C-level map over the children
+            tree[lo:hi + 1] = map(max, tree[2 * lo:2 * hi + 2:2], tree[2 * lo + 1:2 * hi + 2:2])
+            lo, hi = lo // 2, hi // 2
+
+    def _refresh_tree(self, value):
+        """Bring the leaves of runs moved by earlier edits up to date"""
+        first = self.stale[value]
+        if first is not None:
+            self.stale[value] = None
+            # Leaves past the last run are cleared too, in case the edits removed runs
+            self._update_tree(value, first, max(len(self.starts[value]), self.leaves[value]))
+            self.leaves[value] = len(self.starts[value])
+
+    def _first_run_at_least(self, value, first, need):
+        """Index of the first run at position >= first with length >= need, or -1"""
+        self._refresh_tree(value)
+        size, tree = self.trees[value]
+
+        def descend(node, lo, hi):
+            if hi <= first or tree[node] < need:
+                return -1
+            if hi - lo == 1:
+                return lo
+            mid = (lo + hi) // 2
+            found = descend(2 * node, lo, mid)
+            if found == -1:
+                found = descend(2 * node + 1, mid, hi)
+            return found
+
+        index = descend(1, 0, size)
+        return index if index < len(self.starts[value]) else -1
+
+    def run_at(self, value, offset):
+        """Return the (start, end) of the indexed run containing offset, or None"""
+        pos = bisect_right(self.starts[value], offset) - 1
+        if pos >= 0 and self.ends[value][pos] > offset:
+            return self.starts[value][pos], self.ends[value][pos]
+        return None
+
+    def run_end(self, value, offset):
+        """Return the end (exclusive) of the run of value starting at offset"""
+        run = self.run_at(value, offset)
+        if run:
+            return run[1]
+        return run_end(self.data, value, offset, offset + self.MIN_RUN)
+
+    def find_first_fit(self, value, need, start_offset=0, alignment=1):
+        """Find the first block of need bytes of value at or after start_offset.
+
+        block_start is a multiple of alignment. Returns (block_start, run_end)
+        or None, where run_end is the end (exclusive) of the free run the
+        block sits in.
+        """
+        need = max(1, need)
+        if need < self.MIN_RUN:
+            return self._find_small(value, need, start_offset, alignment)
+
+        run = self.run_at(value, start_offset)
+        if run:
+            block_start = align_up(start_offset, alignment)
+            if run[1] - block_start >= need:
+                return block_start, run[1]
+        # Runs at least need long; the first aligned start in the run must still fit
+        starts, ends = self.starts[value], self.ends[value]
+        pos = self._first_run_at_least(value, bisect_right(starts, start_offset), need)
+        while pos != -1:
+            block_start = align_up(starts[pos], alignment)
+            if ends[pos] - block_start >= need:
+                return block_start, ends[pos]
+            pos = self._first_run_at_least(value, pos + 1, need)
+        return None
+
+    def _find_small(self, value, need, start_offset, alignment):
+        """find_first_fit for requests shorter than MIN_RUN, straight from the data"""
+        pos = start_offset
+        while True:
+            found = find_block(self.data, value, need, pos)
+            if found == -1:
+                return None
+            end = self.run_end(value, found)
+            block_start = align_up(found, alignment)
+            if end - block_start >= need:
+                return block_start, end
+            pos = end
+
+    def is_range_free(self, start, size, value):
+        """Check if data[start:start+size] is entirely value"""
+        if size < self.MIN_RUN:
+            return is_filled(self.data, start, size, value)
+        run = self.run_at(value, start)
+        return run is not None and run[1] >= start + size
+
+    def _edit_runs(self, data, value, lo, hi):
+        """Return (win_lo, win_hi, starts, ends): the window over the runs an edit of data[lo:hi]
+        may have merged or split, and the indexed runs in it now.
+
+        The bytes outside the edit are unchanged, so the runs reaching into it
+        from either side come from the index; runs it doesn't hold are shorter
+        than MIN_RUN. Only the edited bytes are scanned, however long those
+        runs are.
+        """
+        left = self.run_at(value, lo - 1) if lo > 0 else None
+        win_lo = left[0] if left else run_start(data, value, lo, max(0, lo - self.MIN_RUN))
+        right = self.run_at(value, hi)
+        win_hi = right[1] if right else run_end(data, value, hi, hi + self.MIN_RUN)
+
+        starts, ends = find_runs(data, value, 1, lo, hi)
+        if win_lo < lo:
+            if starts and starts[0] == lo:
+                starts[0] = win_lo
+            else:
+                starts.insert(0, win_lo)
+                ends.insert(0, lo)
+        if hi < win_hi:
+            if ends and ends[-1] == hi:
+                ends[-1] = win_hi
+            else:
+                starts.append(hi)
+                ends.append(win_hi)
+        keep = [i for i in range(len(starts)) if ends[i] - starts[i] >= self.MIN_RUN]
+        return win_lo, win_hi, [starts[i] for i in keep], [ends[i] for i in keep]
+
+    def update(self, data, lo, hi):
+        """Re-index the runs touched by an edit of data[lo:hi].
+
+        Only the tree leaves of the replaced runs and their ancestors are
+        refreshed. When the edit changes the number of runs every later
+        run moves, so the leaves from the splice on are marked stale and
+        refreshed by the next search, once for any number of edits; typing
+        in the hex editor never pays for the size of the ROM.
+        """
+        self.data = data
+        for value in self.FILL_VALUES:
+            win_lo, win_hi, new_starts, new_ends = self._edit_runs(data, value, lo, hi)
+            starts, ends = self.starts[value], self.ends[value]
+            first = bisect_right(ends, win_lo)
+            last = bisect_left(starts, win_hi)
+            count = len(starts)
+            starts[first:last] = new_starts
+            ends[first:last] = new_ends
+            stale = self.stale[value]
+            if len(new_starts) != last - first:
+                self.leaves[value] = max(self.leaves[value], count)
+                self.stale[value] = first if stale is None else min(stale, first)
+            else:
+                # Leaves from the stale point on are refreshed later anyway
+                stop = first + len(new_starts) if stale is None else min(first + len(new_starts), stale)
+                if stop > first:
+                    self._update_tree(value, first, stop)
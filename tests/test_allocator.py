@@ -0,0 +1,79 @@
+"""
+Validity checks for the batch allocator: every placement is aligned and
+inside a free run, placements never overlap, and a request is only left
+unplaced when no leftover hole could take it.
+"""
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from allocator import STRATEGIES, Placement, allocate
+from scan_engine import align_up
+
+def leftover_holes(runs, placements):
+    """The free runs minus the placed blocks"""
+    holes = []
+    for start, end in runs:
+        cuts = sorted((item.offset, item.offset + item.size) for item in placements
+                      if item.placed and start <= item.offset < end)
+        for lo, hi in cuts:
+            if lo > start:
+                holes.append((start, lo))
+            start = hi
+        if end > start:
+            holes.append((start, end))
+    return holes
+
+def fits(holes, size, alignment):
+    return any(align_up(start, alignment) + size <= end for start, end in holes)
+
+def check(runs, requests, strategy):
+    placements = allocate(runs, requests, strategy)
+    placed = sorted((item for item in placements if item.placed), key=lambda item: item.offset)
+    for item in placed:
+        assert item.offset % item.alignment == 0, item.name
+        assert any(start <= item.offset and item.offset + item.size <= end for start, end in runs), item.name
+    for before, after in zip(placed, placed[1:]):
+        assert before.offset + before.size <= after.offset, (before.name, after.name)
+    holes = leftover_holes(runs, placements)
+    for item in placements:
+        if not item.placed:
+            assert not fits(holes, item.size, item.alignment), item.name
+    return placements
+
+def test_misaligned_holes_before_a_fitting_one():
+    runs = [(i * 100 + 1, i * 100 + 11) for i in range(20)] + [(4096, 4106)]
+    for strategy in STRATEGIES:
+        assert check(runs, [Placement("x", 10, 16)], strategy)[0].offset == 4096
+
+def test_many_misaligned_chunks():
+    runs = [(i * 100 + 1, i * 100 + 11) for i in range(17 * 32)] + [(1 << 20, (1 << 20) + 10)]
+    for strategy in STRATEGIES:
+        assert check(runs, [Placement("x", 10, 16)], strategy)[0].offset == 1 << 20
+
+def test_short_hole_that_fits_once_aligned():
+    # 0x10..0x1A fits 10 bytes aligned to 16; the longer run starts misaligned
+    runs = [(0x10, 0x1A), (0x101, 0x120)]
+    assert check(runs, [Placement("x", 10, 16)], "best-fit")[0].offset == 0x10
+    assert check(runs, [Placement("x", 10, 16)], "first-fit-decreasing")[0].offset == 0x10
+
+def test_best_fit_takes_the_tightest_aligned_hole():
+    runs = [(0x0, 0x100), (0x201, 0x220), (0x300, 0x310)]
+    assert check(runs, [Placement("x", 16, 16)], "best-fit")[0].offset == 0x300
+
+def test_random_aligned_requests():
+    rng = random.Random(14)
+    for _ in range(200):
+        runs, pos = [], 0
+        for _ in range(rng.randrange(1, 60)):
+            pos += rng.randrange(1, 64)
+            length = rng.randrange(1, 96)
+            runs.append((pos, pos + length))
+            pos += length
+        requests = [Placement(f"r{i}", rng.randrange(1, 48), rng.choice((1, 2, 4, 16, 256)))
+                    for i in range(rng.randrange(1, 40))]
+        for strategy in STRATEGIES:
+            check(runs, requests, strategy)
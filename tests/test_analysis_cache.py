@@ -0,0 +1,118 @@
+"""
+Reopening a ROM must restore its indexes from the analysis cache,
+rescanning only the chunks whose CRCs changed, and anything that doesn't
+match the ROM or the index settings must count as a miss.
+"""
+
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analysis_cache
+import instrumentation
+from analysis_cache import AnalysisCache, changed_ranges
+from scan_engine import FreeRunIndex
+from ufsf_core import RomImage
+
+CHUNK = 4096
+
+@pytest.fixture
+def rom_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(analysis_cache, "HASH_CHUNK_SIZE", CHUNK)
+    rng = random.Random(19)
+    parts = []
+    while sum(map(len, parts)) < 16 * CHUNK:
+        parts.append(rng.randbytes(rng.randrange(1, 64)) if rng.randrange(2)
+                     else bytes([rng.choice((0xFF, 0x00))]) * rng.randrange(1, 300))
+    path = tmp_path / "rom.gba"
+    path.write_bytes(b"".join(parts)[:16 * CHUNK])
+    return path
+
+def load(path, cache):
+    """Load path through cache and return (indexes, cache counters)"""
+    instrumentation.reset()
+    rom = RomImage.load(str(path), cache=cache)
+    try:
+        indexes = (dict(rom.index.starts), dict(rom.index.ends),
+                   None if rom._pointers is None else list(rom._pointers.pointers))
+    finally:
+        rom.close()
+    counters = instrumentation.snapshot()["counters"]
+    return indexes, {name[len("analysis cache "):]: value for name, value in counters.items()
+                     if name.startswith("analysis cache ")}
+
+def scanned(path):
+    return load(path, None)[0]
+
+def rewrite(path, offset, data):
+    image = bytearray(path.read_bytes())
+    image[offset:offset + len(data)] = data
+    path.write_bytes(image)
+
+def test_changed_ranges_merge_adjacent_chunks(monkeypatch):
+    monkeypatch.setattr(analysis_cache, "HASH_CHUNK_SIZE", 10)
+    assert changed_ranges([1, 2, 3, 4, 5], [1, 0, 0, 4, 0]) == [(10, 30), (40, 50)]
+    assert changed_ranges([1, 2], [1, 2]) == []
+
+def test_exact_match_is_restored(rom_file, tmp_path):
+    cache = AnalysisCache(str(tmp_path / "cache"))
+    first, counters = load(rom_file, cache)
+    assert counters == {"misses": 1}
+    second, counters = load(rom_file, cache)
+    assert counters == {"hits": 1}
+    assert second == first == scanned(rom_file)
+
+def test_only_changed_chunks_are_rescanned(rom_file, tmp_path):
+    cache = AnalysisCache(str(tmp_path / "cache"))
+    load(rom_file, cache)
+    before = rom_file.read_bytes()
+    rewrite(rom_file, 5 * CHUNK - 100, b"\x00\xFF" * 100)  # Across two chunks
+    rewrite(rom_file, 12 * CHUNK + 7, b"\x5A\xA5" * 10)
+    after = rom_file.read_bytes()
+    changed = sum(before[lo:lo + CHUNK] != after[lo:lo + CHUNK] for lo in range(0, len(after), CHUNK))
+    assert changed == 3
+    restored, counters = load(rom_file, cache)
+    assert counters == {"hits": 1, "bytes rescanned": changed * CHUNK}
+    assert restored == scanned(rom_file)
+    # The rescanned analysis was stored under the new content
+    assert load(rom_file, cache)[1] == {"hits": 1}
+
+def test_pointer_index_is_cached_once_built(rom_file, tmp_path):
+    cache = AnalysisCache(str(tmp_path / "cache"))
+    rewrite(rom_file, 0x100, (0x08000000 + 0x2000).to_bytes(4, "little"))
+    load(rom_file, cache)
+    assert load(rom_file, cache)[0][2] is None
+    rom = RomImage.load(str(rom_file), cache=cache)
+    try:
+        assert rom.references(0x2000, 1) == [(0x2000, 0x100)]
+    finally:
+        rom.close()
+    rewrite(rom_file, 0x104, (0x08000000 + 0x2000).to_bytes(4, "little"))
+    restored, counters = load(rom_file, cache)
+    assert counters["hits"] == 1
+    assert restored[2] is not None and (0x2000, 0x104) in restored[2]
+
+def test_mismatches_are_misses(rom_file, tmp_path, monkeypatch):
+    cache = AnalysisCache(str(tmp_path / "cache"))
+    load(rom_file, cache)
+    with monkeypatch.context() as patched:
+        patched.setattr(FreeRunIndex, "MIN_RUN", 32)
+        assert load(rom_file, cache)[1] == {"misses": 1}
+    # A ROM of another size under the same path
+    rom_file.write_bytes(rom_file.read_bytes() + bytes(CHUNK))
+    assert load(rom_file, cache)[1] == {"misses": 1}
+
+def test_broken_entries_are_misses(rom_file, tmp_path):
+    cache = AnalysisCache(str(tmp_path / "cache"))
+    load(rom_file, cache)
+    for name in os.listdir(cache.directory):
+        if name.endswith(".pkl"):
+            with open(os.path.join(cache.directory, name), "wb") as f:
+                f.write(b"not a pickle")
+    indexes, counters = load(rom_file, cache)
+    assert counters == {"misses": 1}
+    assert indexes == scanned(rom_file)
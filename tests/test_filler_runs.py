@@ -0,0 +1,69 @@
+"""
+Filler runs, with and without stray-byte tolerance, must match a
+brute-force search for the maximal windows holding at most K strays.
+"""
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scan_engine import find_filler_runs
+
+def random_image(rng, size=3000):
+    """Filler runs broken up by short stretches and single stray bytes"""
+    parts = []
+    while sum(map(len, parts)) < size:
+        kind = rng.randrange(4)
+        if kind == 0:
+            parts.append(rng.randbytes(rng.randrange(1, 6)))
+        elif kind == 1:
+            parts.append(bytes([rng.choice((0x12, 0x34))]))
+        else:
+            parts.append(bytes(rng.choice((0xFF, 0x00)) for _ in range(rng.randrange(1, 40))))
+    return b"".join(parts)[:size]
+
+def brute_force_runs(data, fillers, min_length, tolerance):
+    tolerance = min(tolerance, min_length - 1)
+    strays = [0]
+    for byte in data:
+        strays.append(strays[-1] + (byte not in fillers))
+    windows = []
+    end = 0
+    for start in range(len(data)):
+        end = max(end, start)
+        while end < len(data) and strays[end + 1] - strays[start] <= tolerance:
+            end += 1
+        # Maximal: one more byte on the left would go over the tolerance
+        left_full = start == 0 or strays[end] - strays[start - 1] > tolerance
+        if left_full and end - start >= min_length:
+            windows.append((start, end))
+    return [start for start, _ in windows], [end for _, end in windows]
+
+def test_matches_brute_force():
+    rng = random.Random(16)
+    for _ in range(30):
+        data = random_image(rng)
+        fillers = rng.choice(({0xFF}, {0x00}, {0xFF, 0x00}))
+        for min_length in (1, 8, 30, 90):
+            for tolerance in (0, 1, 3):
+                assert (find_filler_runs(data, fillers, min_length, tolerance)
+                        == brute_force_runs(data, fillers, min_length, tolerance))
+
+def test_start_and_end_limit_the_search():
+    data = b"\x01" * 10 + b"\xFF" * 50 + b"\x01" + b"\xFF" * 50 + b"\x01" * 10
+    assert find_filler_runs(data, {0xFF}, 20, 1, start=30, end=100) == ([30], [100])
+    assert find_filler_runs(data, {0xFF}, 20) == ([10, 61], [60, 111])
+
+def test_find_free_space_with_fillers_and_skip():
+    from rom_buffer import RomBuffer
+    from ufsf_core import RomImage
+    # Mixed FF/00 runs of 40, 20 and 60 bytes
+    data = b"\x01" * 16 + b"\xFF\x00" * 20 + b"\x01" + b"\x00" * 20 + b"\x01" + b"\xFF" * 60 + b"\x01" * 16
+    rom = RomImage(RomBuffer(data))
+    found = rom.find_free_space(24, (0xFF, 0x00), skip=8)
+    assert (found.start, found.run_end) == (16, 56)
+    assert found.next_free_start == 78  # The 20-byte run can't take 24 + 8
+    # One stray allowed: the window takes in the stray byte before the first run
+    assert rom.find_free_space(24, (0xFF, 0x00), skip=8, tolerance=1).start == 15
@@ -0,0 +1,55 @@
+"""
+The free run index kept up to date edit by edit must match one built
+from scratch, both its runs and the first-fit answers of its tree.
+"""
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scan_engine import FreeRunIndex
+
+def random_image(rng, pieces=2000):
+    parts = []
+    for _ in range(pieces):
+        kind = rng.randrange(3)
+        if kind == 2:
+            parts.append(rng.randbytes(rng.randrange(1, 20)))
+        else:
+            parts.append(bytes([(0xFF, 0x00)[kind]]) * rng.randrange(1, 60))
+    return bytearray(b"".join(parts))
+
+def test_updates_match_a_fresh_index():
+    rng = random.Random(1)
+    data = random_image(rng)
+    index = FreeRunIndex(data)
+    for step in range(2000):
+        lo = rng.randrange(len(data))
+        hi = min(len(data), lo + rng.randrange(1, 80))
+        value = rng.choice((0xFF, 0x00, None))
+        data[lo:hi] = rng.randbytes(hi - lo) if value is None else bytes([value]) * (hi - lo)
+        index.update(data, lo, hi)
+        if step % 10:
+            continue
+        fresh = FreeRunIndex(data)
+        for value in FreeRunIndex.FILL_VALUES:
+            assert index.starts[value] == fresh.starts[value]
+            assert index.ends[value] == fresh.ends[value]
+            for need in (16, 40, 100):
+                for alignment in (1, 16):
+                    start = rng.randrange(len(data))
+                    assert (index.find_first_fit(value, need, start, alignment)
+                            == fresh.find_first_fit(value, need, start, alignment))
+
+def test_edit_inside_a_long_run():
+    data = bytearray(b"\x01" * 100 + b"\xFF" * 100000 + b"\x01" * 100)
+    index = FreeRunIndex(data)
+    data[50000] = 0x42
+    index.update(data, 50000, 50001)
+    assert list(zip(index.starts[0xFF], index.ends[0xFF])) == [(100, 50000), (50001, 100100)]
+    data[50000] = 0xFF
+    index.update(data, 50000, 50001)
+    assert list(zip(index.starts[0xFF], index.ends[0xFF])) == [(100, 100100)]
+    assert index.find_first_fit(0xFF, 60000) == (100, 100100)
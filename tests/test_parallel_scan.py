@@ -0,0 +1,84 @@
+"""
+Runs found chunk by chunk and merged must match a scan of the whole
+image, in-process and in the pool, and a cancelled scan must leave the
+pool fit for the next one.
+"""
+
+import os
+import random
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jobs
+import parallel_scan
+from scan_engine import find_filler_runs, find_runs
+
+def random_image(rng, size=5000):
+    parts = []
+    while sum(map(len, parts)) < size:
+        if rng.randrange(3):
+            parts.append(bytes([rng.choice((0xFF, 0x00))]) * rng.randrange(1, 50))
+        else:
+            parts.append(rng.randbytes(rng.randrange(1, 8)))
+    return b"".join(parts)[:size]
+
+def merged_runs(data, filler_sets, min_length, chunk_size, workers=1):
+    filler_sets = [frozenset(fillers) for fillers in filler_sets]
+    pieces = parallel_scan.map_chunks(data, parallel_scan._chunk_runs, (filler_sets, min_length),
+                                      chunk_size=chunk_size, workers=workers)
+    return [parallel_scan._merge_runs([(lo, hi, result[i]) for lo, hi, result in pieces], min_length)
+            for i in range(len(filler_sets))]
+
+def test_merged_chunks_match_a_whole_scan():
+    rng = random.Random(17)
+    for _ in range(6):
+        data = random_image(rng, 1500)
+        for chunk_size in (1, 7, 64, 1000):
+            for min_length in (1, 5, 40, 120):
+                ff, zero, mixed = merged_runs(data, [{0xFF}, {0x00}, {0xFF, 0x00}], min_length, chunk_size)
+                assert ff == tuple(find_runs(data, 0xFF, min_length))
+                assert zero == tuple(find_runs(data, 0x00, min_length))
+                assert mixed == find_filler_runs(data, {0xFF, 0x00}, min_length)
+
+def test_run_spanning_many_chunks():
+    data = b"\x01" + b"\xFF" * 100 + b"\x01"
+    assert merged_runs(data, [{0xFF}], 50, chunk_size=3) == [([1], [101])]
+    assert merged_runs(data, [{0xFF}], 101, chunk_size=3) == [([], [])]
+
+@pytest.fixture
+def pool(monkeypatch):
+    if parallel_scan._get_pool(2) is None:
+        pytest.skip("the pool can't be started with other threads running")
+    monkeypatch.setattr(parallel_scan, "PARALLEL_MIN_SIZE", 0)
+    yield
+    parallel_scan.shutdown()
+
+def test_pool_matches_in_process(pool):
+    rng = random.Random(3)
+    data = random_image(rng, 100000)
+    assert (merged_runs(data, [{0xFF}, {0xFF, 0x00}], 16, 8192, workers=2)
+            == merged_runs(data, [{0xFF}, {0xFF, 0x00}], 16, 8192))
+
+def test_cancelled_scan_leaves_the_pool_usable(pool):
+    data = random_image(random.Random(5), 100000)
+    job = jobs.Job(None, "scan", None, (), None, {})
+    job.cancel()
+    jobs._local.job = job
+    try:
+        with pytest.raises(jobs.JobCancelled):
+            merged_runs(data, [{0xFF}], 16, 1024, workers=2)
+    finally:
+        jobs._local.job = None
+    assert merged_runs(data, [{0xFF}], 16, 1024, workers=2) == [tuple(find_runs(data, 0xFF, 16))]
+
+def test_pool_is_not_forked_from_a_thread():
+    parallel_scan.shutdown()
+    pools = []
+    thread = threading.Thread(target=lambda: pools.append(parallel_scan._get_pool(2)))
+    thread.start()
+    thread.join()
+    assert pools == [None]
@@ -0,0 +1,104 @@
+"""
+IPS, UPS and BPS patches made from two images must turn the first into
+the second again, and damaged or mismatched patches must be rejected.
+"""
+
+import os
+import random
+import sys
+import zlib
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from patches import IPS_EOF_OFFSET, PATCH_FORMATS, crc32, encode_varint, make_patch, patch_changes
+
+def apply(patch, source):
+    target = bytearray(source)
+    for offset, data in patch_changes(patch, source):
+        target[offset:offset + len(data)] = data
+    return bytes(target)
+
+def edited(rng, source, edits=200):
+    """source with random literal edits and long runs of one byte (RLE / TargetCopy material)"""
+    target = bytearray(source)
+    for _ in range(edits):
+        offset = rng.randrange(len(target) - 300)
+        if rng.random() < 0.3:
+            size = rng.randrange(16, 300)
+            target[offset:offset + size] = bytes([rng.randrange(256)]) * size
+        else:
+            size = rng.randrange(1, 40)
+            target[offset:offset + size] = rng.randbytes(size)
+    return bytes(target)
+
+@pytest.mark.parametrize("fmt", PATCH_FORMATS)
+def test_round_trip(fmt):
+    rng = random.Random(fmt)
+    source = rng.randbytes(1 << 18)
+    target = edited(rng, source)
+    patch = make_patch(fmt, source, target)
+    assert apply(patch, source) == target
+
+@pytest.mark.parametrize("fmt", PATCH_FORMATS)
+def test_long_runs_are_compact(fmt):
+    source = bytes(1 << 16)
+    target = source[:1000] + b"\xFF" * 40000 + source[41000:]
+    patch = make_patch(fmt, source, target)
+    if fmt != "ups":  # UPS has no run encoding
+        assert len(patch) < 100
+    assert apply(patch, source) == target
+
+def test_ips_record_at_the_eof_offset():
+    source = bytes(IPS_EOF_OFFSET + 0x1000)
+    target = bytearray(source)
+    target[IPS_EOF_OFFSET] = 0x42
+    target[IPS_EOF_OFFSET + 0x100:IPS_EOF_OFFSET + 0x200] = b"\x07" * 0x100  # RLE record
+    for offset in (IPS_EOF_OFFSET, IPS_EOF_OFFSET + 0x100):
+        single = bytearray(source)
+        single[offset:offset + 0x100] = target[offset:offset + 0x100]
+        patch = make_patch("ips", source, bytes(single))
+        assert apply(patch, source) == bytes(single)
+    assert apply(make_patch("ips", source, bytes(target)), source) == bytes(target)
+
+def test_ips_past_16_mb_is_refused():
+    source = bytes(0x1000010)
+    target = source[:-1] + b"\x01"
+    with pytest.raises(ValueError):
+        make_patch("ips", source, target)
+
+@pytest.mark.parametrize("fmt", ("ups", "bps"))
+def test_corrupt_patch_is_rejected(fmt):
+    source = bytes(4096)
+    patch = bytearray(make_patch(fmt, source, b"\x01" * 10 + source[10:]))
+    patch[len(patch) // 2] ^= 0xFF
+    with pytest.raises(ValueError, match="corrupt"):
+        patch_changes(bytes(patch), source)
+
+@pytest.mark.parametrize("fmt", ("ups", "bps"))
+def test_patch_for_another_rom_is_rejected(fmt):
+    source = bytes(4096)
+    patch = make_patch(fmt, source, b"\x01" * 10 + source[10:])
+    with pytest.raises(ValueError, match="different ROM"):
+        patch_changes(patch, b"\x02" + source[1:])
+
+def test_bps_source_and_target_copy():
+    source = bytes(range(256)) * 4
+    # SourceCopy 16 bytes from offset 512, TargetRead "AB", TargetCopy 20 bytes of "AB" repeated, SourceRead the rest
+    target = source[512:528] + b"AB" + b"AB" * 10 + source[38:]
+    actions = bytearray()
+
+    def action(command, length, delta=None, literal=b""):
+        actions.extend(encode_varint(((length - 1) << 2) | command) + literal)
+        if delta is not None:
+            actions.extend(encode_varint((abs(delta) << 1) | (delta < 0)))
+
+    action(2, 16, delta=512)
+    action(1, 2, literal=b"AB")
+    action(3, 20, delta=16)
+    action(0, len(source) - 38)
+    patch = bytearray(b"BPS1" + encode_varint(len(source)) * 2 + encode_varint(0) + actions)
+    patch += crc32(source).to_bytes(4, "little") + crc32(target).to_bytes(4, "little")
+    patch += zlib.crc32(patch).to_bytes(4, "little")
+    assert apply(bytes(patch), source) == target
@@ -0,0 +1,74 @@
+"""
+Hex and Gen III text searches must find every match a brute-force scan
+finds, overlapping ones and ones across chunk edges included, with
+wildcards anywhere in the pattern and with case folded.
+"""
+
+import functools
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parallel_scan
+from pattern_search import CASE_FOLD, SearchPattern, encode_text, find_pattern, parse_hex_pattern
+
+@pytest.fixture(params=(1, 5, 64, parallel_scan.CHUNK_SIZE))
+def chunk_size(request, monkeypatch):
+    monkeypatch.setattr(parallel_scan, "map_chunks",
+                        functools.partial(parallel_scan.map_chunks, chunk_size=request.param))
+    return request.param
+
+def brute_force(data, values, table=None):
+    if table is not None:
+        data = data.translate(table)
+    return [offset for offset in range(len(data) - len(values) + 1)
+            if all(value is None or data[offset + i] == value for i, value in enumerate(values))]
+
+def test_parse_hex_pattern():
+    assert parse_hex_pattern("08 ?? 00 ??") == [8, None, 0, None]
+    assert parse_hex_pattern("08??0a, FF") == [8, None, 10, 255]
+    for bad in ("", "0", "0G", "?0"):
+        with pytest.raises(ValueError):
+            parse_hex_pattern(bad)
+
+def test_encode_text():
+    assert encode_text("Hi!") == bytes([0xC2, 0xDD, 0xAB])
+    assert encode_text("It's\\nok\\p") == bytes([0xC3, 0xE8, 0xB4, 0xE7, 0xFE, 0xE3, 0xDF, 0xFB])
+    for bad in ("", "\\x", "tab\t"):
+        with pytest.raises(ValueError):
+            encode_text(bad)
+
+def test_hex_wildcards_match_brute_force(chunk_size):
+    rng = random.Random(25)
+    data = bytes(rng.choice(b"\x00\x01\x08") for _ in range(600))
+    for _ in range(40):
+        values = [rng.choice((None, 0, 1, 8)) for _ in range(rng.randrange(1, 6))]
+        raw = " ".join("??" if value is None else f"{value:02X}" for value in values)
+        assert find_pattern(data, SearchPattern(raw)) == brute_force(data, values), raw
+
+def test_leading_wildcards_stop_at_the_start(chunk_size):
+    data = b"\x01\x02\x01\x02\x01"
+    assert find_pattern(data, SearchPattern("?? ?? 01")) == [0, 2]
+    assert find_pattern(data, SearchPattern("?? ??")) == [0, 1, 2, 3]
+    assert find_pattern(data, SearchPattern("01 ?? ??")) == [0, 2]
+
+def test_overlapping_matches_and_the_limit(chunk_size):
+    data = b"\x00" * 50
+    assert find_pattern(data, SearchPattern("00 00 00")) == list(range(48))
+    assert find_pattern(data, SearchPattern("00 00 00"), limit=5) == [0, 1, 2, 3, 4]
+    assert find_pattern(data, SearchPattern("?? 00"), limit=3) == [0, 1, 2]
+
+def test_text_ignoring_case(chunk_size):
+    rng = random.Random(250)
+    words = ["Oak", "OAK", "oak", "oAk", "Elm", "o", "k"]
+    data = b"\xFF".join(encode_text(rng.choice(words)) for _ in range(200))
+    assert find_pattern(data, SearchPattern("Oak", "text")) == brute_force(data, encode_text("Oak"))
+    folded = SearchPattern("OAK", "text", ignore_case=True)
+    assert folded.describe() == '"OAK" (any case)'
+    hits = find_pattern(data, folded)
+    assert hits == brute_force(data, encode_text("oak"), CASE_FOLD)
+    assert len(hits) == sum(data.count(encode_text(word)) for word in ("Oak", "OAK", "oak", "oAk"))
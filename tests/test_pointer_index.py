@@ -0,0 +1,83 @@
+"""
+The pointer index kept up to date through edits, undo and redo must match
+one built from scratch over the edited image.
+"""
+
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pointer_index import ROM_BASE, PointerIndex, find_pointers
+
+def pointer(target):
+    return (ROM_BASE + target).to_bytes(4, "little")
+
+def random_image(rng, size=4096):
+    """Random bytes, filler and pointers into the image, some of them misaligned"""
+    data = bytearray(rng.choice((0x00, 0xFF)) for _ in range(size))
+    for _ in range(size // 16):
+        offset = rng.randrange(size - 4)
+        data[offset:offset + 4] = pointer(rng.randrange(size)) if rng.random() < 0.7 else rng.randbytes(4)
+    return data
+
+def brute_force(data, alignment):
+    found = []
+    for source in range(0, len(data) - 3, alignment):
+        target = int.from_bytes(data[source:source + 4], "little") - ROM_BASE
+        if 0 <= target < len(data):
+            found.append((target, source))
+    return sorted(found)
+
+@pytest.mark.parametrize("alignment", (1, 4))
+def test_find_pointers_matches_brute_force(alignment):
+    data = random_image(random.Random(alignment))
+    sources, targets = find_pointers(bytes(data), alignment=alignment)
+    assert sorted(zip(targets, sources)) == brute_force(data, alignment)
+
+@pytest.mark.parametrize("alignment", (1, 4))
+def test_update_after_edits(alignment):
+    rng = random.Random(18 + alignment)
+    data = random_image(rng)
+    index = PointerIndex(bytes(data), alignment)
+    for _ in range(200):
+        lo = rng.randrange(len(data) - 8)
+        edit = pointer(rng.randrange(len(data))) if rng.random() < 0.5 else rng.randbytes(rng.randrange(1, 8))
+        if rng.random() < 0.3:
+            edit = bytes([rng.choice((0x00, 0x08))]) * rng.randrange(1, 8)  # Breaks or completes a pointer
+        data[lo:lo + len(edit)] = edit
+        index.update(bytes(data), lo, lo + len(edit))
+        assert index.pointers == brute_force(data, alignment)
+    assert index.sources == sorted(source for _, source in index.pointers)
+    assert index.target_of == {source: target for target, source in index.pointers}
+
+def test_rom_edits_keep_the_index_current():
+    from rom_buffer import RomBuffer
+    from ufsf_core import RomImage
+    data = bytearray(0x1000)
+    data[0x100:0x104] = pointer(0x800)
+    rom = RomImage(RomBuffer(bytes(data)))
+    assert rom.references(0x800, 0x10) == [(0x800, 0x100)]
+    rom.write(0x200, pointer(0x808))
+    rom.erase(0x101, 1, 0xFF)  # Breaks the first pointer
+    assert rom.references(0x800, 0x10) == [(0x808, 0x200)]
+    rom.undo()
+    assert rom.references(0x800, 0x10) == [(0x800, 0x100), (0x808, 0x200)]
+    rom.undo()
+    assert rom.pointer_index.referrers(0x800) == [0x100]
+    rom.redo()
+    assert rom.pointer_index.referrers(0x808) == [0x200]
+
+def test_search_looks_up_references_only_when_asked():
+    from rom_buffer import RomBuffer
+    from ufsf_core import RomImage
+    data = bytearray(b"\x01" * 0x1000)
+    data[0x800:0x900] = b"\xFF" * 0x100
+    data[0x100:0x104] = pointer(0x820)
+    rom = RomImage(RomBuffer(bytes(data)))
+    assert rom.find_free_space(0x80, 0xFF).references == ()
+    assert rom._pointers is None
+    assert rom.find_free_space(0x80, 0xFF, references=True).references == [(0x820, 0x100)]
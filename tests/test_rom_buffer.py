@@ -0,0 +1,42 @@
+"""
+The edit history stays within its step and byte budgets and still undoes
+the edits it kept.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rom_buffer import RomBuffer
+
+def test_history_byte_budget_drops_the_oldest_steps():
+    buffer = RomBuffer(bytes(1 << 20))
+    buffer.history.byte_limit = 300000
+    for i in range(5):
+        buffer.fill(i * 1000, 100000, 0xFF)
+    assert len(buffer.history.undo_stack) == 3
+    assert buffer.history.size == 300000
+    while buffer.undo():
+        pass
+    # Only the kept fills are undone: the first two stay
+    assert buffer[0:101000] == b"\xFF" * 101000
+    assert buffer[101000:] == bytes(len(buffer) - 101000)
+
+def test_new_edit_drops_the_redo_steps_bytes():
+    buffer = RomBuffer(bytes(4096))
+    buffer.write(0, b"abcd")
+    buffer.fill(100, 200, 0x01)
+    buffer.undo()
+    buffer.write(8, b"xy")
+    assert not buffer.history.redo_stack
+    assert buffer.history.size == 8 + 4
+
+def test_newest_step_is_kept_over_the_budget():
+    buffer = RomBuffer(bytes(4096))
+    buffer.history.byte_limit = 100
+    buffer.write(0, b"a")
+    buffer.fill(0, 1000, 0x01)
+    assert len(buffer.history.undo_stack) == 1
+    buffer.undo()
+    assert buffer[0:1000] == b"a" + bytes(999)
@@ -0,0 +1,91 @@
+"""
+ROMs opened after the base read its unchanged pages, and must keep their
+own contents when the base is saved over or closed.
+"""
+
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rom_buffer import PAGE_SIZE, SharedPageImage
+from workspace import Workspace
+
+PAGES = 32
+
+@pytest.fixture
+def roms(tmp_path):
+    """Paths of a base ROM and a build that differs in two pages and has another one moved"""
+    rng = random.Random(20)
+    base = rng.randbytes(PAGES * PAGE_SIZE)
+    build = bytearray(base)
+    build[3 * PAGE_SIZE + 10:3 * PAGE_SIZE + 20] = b"\xFF" * 10
+    build[7 * PAGE_SIZE:8 * PAGE_SIZE] = rng.randbytes(PAGE_SIZE)
+    build[20 * PAGE_SIZE:21 * PAGE_SIZE] = base[5 * PAGE_SIZE:6 * PAGE_SIZE]
+    build += b"tail"
+    paths = tmp_path / "base.gba", tmp_path / "build.gba"
+    paths[0].write_bytes(base)
+    paths[1].write_bytes(build)
+    return paths
+
+def contents(rom):
+    return bytes(rom.data[0:len(rom)])
+
+def test_shared_image_reads_like_the_file(roms):
+    build = roms[1].read_bytes()
+    image = SharedPageImage.open(str(roms[1]), lambda: roms[0].read_bytes())
+    assert len(image) == len(build)
+    assert image[0:len(image)] == build
+    assert image[PAGE_SIZE - 3:3 * PAGE_SIZE + 15] == build[PAGE_SIZE - 3:3 * PAGE_SIZE + 15]
+    assert image[-1] == build[-1]
+    assert image.refs[20] == 5  # The moved page is found by its CRC
+    assert image.shared_pages == PAGES - 2
+    assert image.find(b"tail") == len(build) - 4
+
+def test_shared_fraction(roms):
+    workspace = Workspace()
+    base, build = workspace.open(str(roms[0])), workspace.open(str(roms[1]))
+    try:
+        assert workspace.shared_fraction(base) == 0.0
+        assert workspace.shared_fraction(build) == (PAGES - 2) / (PAGES + 1)
+        assert contents(build) == roms[1].read_bytes()
+    finally:
+        workspace.close(base)
+        workspace.close(build)
+
+@pytest.mark.parametrize("atomic", (False, True))
+def test_saving_the_base_keeps_shared_contents(roms, atomic):
+    workspace = Workspace()
+    base, build = workspace.open(str(roms[0])), workspace.open(str(roms[1]))
+    expected = roms[1].read_bytes()
+    try:
+        base.write(5 * PAGE_SIZE + 100, b"\x00" * 8)  # A page the build shares twice
+        base.erase(10 * PAGE_SIZE, 2 * PAGE_SIZE, 0xFF)
+        workspace.save(base, backup=False, atomic=atomic)
+        assert contents(build) == expected
+        # Only the saved pages were copied, the rest is still shared
+        assert build.data.is_shared
+        assert build.data.base.shared_pages == PAGES - 2 - 4
+        assert contents(base) == roms[0].read_bytes()
+    finally:
+        workspace.close(base)
+        workspace.close(build)
+
+def test_closing_the_base_detaches_the_others(roms):
+    workspace = Workspace()
+    base, build = workspace.open(str(roms[0])), workspace.open(str(roms[1]))
+    build.write(0, b"edit")
+    expected = contents(build)
+    workspace.close(base)
+    try:
+        assert workspace.base is build
+        assert not build.data.is_shared
+        assert build.data.base.shared_pages == 0
+        assert contents(build) == expected
+        build.undo()
+        assert contents(build) == roms[1].read_bytes()
+    finally:
+        workspace.close(build)
@@ -0,0 +1,260 @@
+"""
+Command line interface for Ultimate Free Space Finder.
+
+Examples:
+    python ufsf_cli.py find --size 256 --type FF --start 0x720000 --align 4 rom.gba
+    python ufsf_cli.py find --size 256 --type FF+00 --tolerance 2 rom.gba
+    python ufsf_cli.py find --size 256 --all --sort largest --limit 20 rom.gba
+    python ufsf_cli.py search "08 ?? ?? 08" rom.gba
+    python ufsf_cli.py search --text --ignore-case "POKéMON" rom.gba
+    python ufsf_cli.py check --start 0x720000 --size 256 rom.gba
+    python ufsf_cli.py report --largest 20 rom.gba
+    python ufsf_cli.py allocate requests.txt --start 0x720000 rom.gba
+    python ufsf_cli.py erase --start 0x720000 --count 256 --type FF rom.gba
+    python ufsf_cli.py diff clean.gba hack.gba -o hack.bps
+    python ufsf_cli.py apply hack.bps clean.gba -o hack.gba
+    python ufsf_cli.py --timings timings.json report rom.gba
+"""
+
+import argparse
+import os
+import sys
+from itertools import islice
+
+import allocator
+import instrumentation
+import patches
+import pattern_search
+from analysis_cache import AnalysisCache
+from rom_buffer import RomBuffer
+from ufsf_core import (ALIGNMENTS, FILL_TYPES, FIND_ALL_ORDERS, REPORT_REGION_SIZE, FreeBlockList, RomImage,
+                       describe_references, end_offset, format_fillers, parse_fillers, parse_offset)
+
+def offset_arg(raw):
+    """argparse type for offsets: 0x/$ prefixed hex, otherwise decimal"""
+    raw = raw.strip()
+    try:
+        if raw.lower().startswith("0x"):
+            return parse_offset(raw, "0x")
+        if raw.startswith("$"):
+            return parse_offset(raw, "$")
+        return int(raw)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid offset: {raw!r}")
+
+#----------------------------------------------------------------------
+# COMMANDS
+#----------------------------------------------------------------------
+
+def fillers_arg(raw):
+    """argparse type for free byte values: FF, 00, FF+00 or hex bytes like 'FF 01'"""
+    try:
+        return parse_fillers(raw)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid free byte values: {raw!r}")
+
+def cmd_find(rom, args):
+    """Print the first free block that fits the request"""
+    if args.all:
+        return cmd_find_all(rom, args)
+    value = args.type
+    result = rom.find_free_space(args.size, value, args.start, args.skip, args.align, args.tolerance,
+                                 references=args.verbose)
+    if result is None:
+        print(f"No free space of {args.size + args.skip} bytes ({format_fillers(value)}) "
+              f"found starting from offset 0x{args.start:X}.")
+        return 1
+    if args.verbose:
+        print(result.describe(), end="")
+    else:
+        print(f"0x{result.start:X}")
+    return 0
+
+def cmd_find_all(rom, args):
+    """Print every free block that fits the request as 'offset free_bytes', in args.sort order"""
+    search = (args.size, args.type, args.start, args.skip, args.align, args.tolerance)
+    if args.sort == "offset":
+        blocks = islice(rom.iter_free_space(*search), args.limit)  # Streams, nothing is collected
+    else:
+        blocks = FreeBlockList(rom, *search, order=args.sort, page_size=args.limit or len(rom)).load_page()
+    found = 0
+    for start, end in blocks:
+        print(f"0x{start:X} {end - start}")
+        found += 1
+    if not found:
+        print(f"No free space of {args.size + args.skip} bytes ({format_fillers(args.type)}) "
+              f"found starting from offset 0x{args.start:X}.")
+        return 1
+    return 0
+
+def cmd_search(rom, args):
+    """Print the offset of every match of a hex pattern or Gen III text"""
+    pattern = pattern_search.SearchPattern(args.pattern, "text" if args.text else "hex", args.ignore_case)
+    hits = rom.find_pattern(pattern, args.limit)
+    for hit in hits:
+        print(f"0x{hit:X}")
+    if not hits:
+        print(f"No matches of {pattern.describe()} found.")
+        return 1
+    if len(hits) >= args.limit:
+        print(f"Stopped after {args.limit} matches.", file=sys.stderr)
+    return 0
+
+def cmd_check(rom, args):
+    """Report whether a range is free"""
+    end = end_offset(args.start, args.size)
+    if args.start < 0 or end >= len(rom):
+        print("Offset out of bounds.", file=sys.stderr)
+        return 2
+    value = rom.free_value(args.start, args.size)
+    if value is None:
+        print(f"0x{args.start:X}-0x{end:X}: WARNING: Range includes offsets used by the ROM!")
+        return 1
+    print(f"0x{args.start:X}-0x{end:X}: Range is free (0x{value:02X})")
+    references = rom.references(args.start, args.size)
+    print(describe_references(references), end="")
+    return 1 if references else 0
+
+def cmd_report(rom, args):
+    """Print free space totals, run lengths, the largest blocks and fragmentation"""
+    print(rom.free_space_report(args.largest, args.region_size).describe(), end="")
+    return 0
+
+def cmd_allocate(rom, args):
+    """Pack a list of requests into free space and print the placement table"""
+    with open(args.requests, 'r') as f:
+        requests = allocator.parse_requests(f.read())
+    placements = rom.allocate(requests, FILL_TYPES[args.type], args.strategy, args.start)
+    print(allocator.describe(placements), end="")
+    return 0 if all(item.placed for item in placements) else 1
+
+def cmd_erase(rom, args):
+    """Fill a range with FF/00 and save the ROM"""
+    rom.erase(args.start, args.count, FILL_TYPES[args.type])
+    saved = rom.save(args.output, backup=not args.no_backup, atomic=args.atomic)
+    print(f"Erased {args.count} bytes from 0x{args.start:X}")
+    print(saved.describe())
+    if saved.backup_path:
+        print(f"Backup created at: {saved.backup_path}")
+    return 0
+
+def cmd_diff(rom, args):
+    """Write a patch turning the source ROM into the target ROM"""
+    fmt = args.format or os.path.splitext(args.output)[1].lstrip(".").lower()
+    source = RomBuffer.open(args.source)
+    target = RomBuffer.open(args.target)
+    try:
+        patch = patches.make_patch(fmt, source, target)
+    finally:
+        source.close()
+        target.close()
+    with open(args.output, 'wb') as f:
+        f.write(patch)
+    print(f"Wrote {fmt.upper()} patch: {args.output} ({len(patch)} bytes)")
+    return 0
+
+def cmd_apply(rom, args):
+    """Apply a patch to the ROM and save it"""
+    with open(args.patch, 'rb') as f:
+        count = rom.apply_patch(f.read())
+    saved = rom.save(args.output, backup=not args.no_backup)
+    print(f"Applied {count} changes from {args.patch}")
+    print(saved.describe())
+    return 0
+
+#----------------------------------------------------------------------
+# ENTRY POINT
+#----------------------------------------------------------------------
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="ufsf", description="Pokémon Gen III free space tools")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="don't reuse or save the ROM analysis in the analysis cache")
+    parser.add_argument("--timings", metavar="FILE",
+                        help="write the timings and counters of the run to a JSON file ('-' prints them to stderr)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    find = commands.add_parser("find", help="find a block of free space")
+    find.add_argument("--size", type=int, required=True, help="bytes needed")
+    find.add_argument("--type", type=fillers_arg, default="FF",
+                      help="free byte values: FF, 00, FF+00 or hex bytes like 'FF,01'")
+    find.add_argument("--tolerance", type=int, default=0, help="stray bytes allowed inside the block")
+    find.add_argument("--start", type=offset_arg, default=0, help="offset to search from")
+    find.add_argument("--skip", type=int, default=0, help="extra headroom bytes")
+    find.add_argument("--align", type=int, choices=ALIGNMENTS, default=1, help="start on a multiple of this")
+    find.add_argument("-v", "--verbose", action="store_true", help="print the full search report, with the pointers into the block")
+    find.add_argument("--all", action="store_true", help="list every block that fits, one per free run")
+    find.add_argument("--sort", choices=FIND_ALL_ORDERS, default="offset", help="order of the --all list")
+    find.add_argument("--limit", type=int, help="list at most this many blocks with --all")
+    find.set_defaults(func=cmd_find)
+
+    search = commands.add_parser("search", help="find every match of a hex pattern or Gen III text")
+    search.add_argument("pattern", help="hex bytes with ?? wildcards, like '08 ?? ?? 08', or text with --text")
+    search.add_argument("--text", action="store_true", help="the pattern is text in the Gen III encoding")
+    search.add_argument("--ignore-case", action="store_true", help="match text in either case")
+    search.add_argument("--limit", type=int, default=pattern_search.MAX_HITS, help="stop after this many matches")
+    search.set_defaults(func=cmd_search)
+
+    check = commands.add_parser("check", help="check whether a range is free")
+    check.add_argument("--start", type=offset_arg, required=True)
+    check.add_argument("--size", type=int, required=True)
+    check.set_defaults(func=cmd_check)
+
+    report = commands.add_parser("report", help="print free space statistics")
+    report.add_argument("--largest", type=int, default=10, help="number of largest blocks to list")
+    report.add_argument("--region-size", type=offset_arg, default=REPORT_REGION_SIZE,
+                        help="region size for the fragmentation table (default 0x100000)")
+    report.set_defaults(func=cmd_report)
+
+    allocate = commands.add_parser("allocate", help="place many blocks of free space at once")
+    allocate.add_argument("requests", help="text file with one 'name size [alignment]' per line")
+    allocate.add_argument("--type", choices=FILL_TYPES, default="FF", help="free byte value")
+    allocate.add_argument("--start", type=offset_arg, default=0, help="offset to allocate from")
+    allocate.add_argument("--strategy", choices=allocator.STRATEGIES, default="best-fit")
+    allocate.set_defaults(func=cmd_allocate)
+
+    erase = commands.add_parser("erase", help="fill a range with FF/00")
+    erase.add_argument("--start", type=offset_arg, required=True)
+    erase.add_argument("--count", type=int, required=True)
+    erase.add_argument("--type", choices=FILL_TYPES, default="FF")
+    erase.add_argument("-o", "--output", help="write to this file instead of the input ROM")
+    erase.add_argument("--no-backup", action="store_true", help="don't create a .bak file")
+    erase.add_argument("--atomic", action="store_true",
+                       help="rewrite through a temp file and rename instead of patching in place")
+    erase.set_defaults(func=cmd_erase)
+
+    apply = commands.add_parser("apply", help="apply an IPS/UPS/BPS patch")
+    apply.add_argument("patch", help="patch file")
+    apply.add_argument("-o", "--output", help="write to this file instead of the input ROM")
+    apply.add_argument("--no-backup", action="store_true", help="don't create a .bak file")
+    apply.set_defaults(func=cmd_apply)
+
+    for sub in (find, search, check, report, allocate, erase, apply):
+        sub.add_argument("rom", help="path to the .gba ROM")
+
+    diff = commands.add_parser("diff", help="write a patch between two ROMs")
+    diff.add_argument("source", help="clean/base ROM")
+    diff.add_argument("target", help="modified ROM")
+    diff.add_argument("-o", "--output", required=True, help="patch file to write")
+    diff.add_argument("--format", choices=patches.PATCH_FORMATS,
+                      help="patch format (default: from the output extension)")
+    diff.set_defaults(func=cmd_diff)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        cache = None if args.no_cache else AnalysisCache()
+        rom = RomImage.load(args.rom, cache=cache) if getattr(args, "rom", None) else None
+        return args.func(rom, args)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    finally:
+        if args.timings == "-":
+            print(instrumentation.describe(), file=sys.stderr)
+        elif args.timings:
+            instrumentation.export_json(args.timings, {"command": args.command})
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,659 @@
+"""
+Core ROM model for Ultimate Free Space Finder.
+Everything here is GUI-free so build scripts, CI jobs and the command line
+interface (ufsf_cli.py) can load a ROM, search and check free space, erase
+ranges and do offset math without starting Tk.
+"""
+
+import heapq
+import os
+import shutil
+import tempfile
+import time
+from bisect import bisect_right
+from itertools import islice
+
+import allocator
+import instrumentation
+import parallel_scan
+import patches
+import pattern_search
+from analysis_cache import CachedAnalysis, chunk_hashes
+from pointer_index import POINTER_ALIGNMENT, PointerIndex
+from rom_buffer import RomBuffer
+from scan_engine import FreeRunIndex, align_up, classify_blocks, find_filler_runs, run_end, run_start
+
+FILL_TYPES = {"FF": 0xFF, "00": 0x00}  # Search/erase type name -> byte value
+FILLER_SETS = {"FF": (0xFF,), "00": (0x00,), "FF+00": (0xFF, 0x00)}  # Search type name -> free bytes
+ALIGNMENTS = (1, 2, 4, 16, 256)          # Start alignments offered by the finder
+SAVE_CHUNK_SIZE = 1 << 20                # Streaming chunk for full rewrites
+REPORT_REGION_SIZE = 1 << 20             # Region size for fragmentation stats
+REFERENCES_SHOWN = 8                     # Referring pointers listed per warning
+FIND_ALL_ORDERS = ("offset", "largest", "smallest")  # Find-all sort orders
+FIND_ALL_PAGE = 200                      # Blocks per find-all page
+
+#----------------------------------------------------------------------
+# OFFSET MATH
+#----------------------------------------------------------------------
+
+def parse_offset(raw, fmt):
+    """Parse offset string based on format (0x, $, plain)"""
+    raw = raw.strip()
+    if fmt == "0x":
+        if not raw.lower().startswith("0x"):
+            raise ValueError("Expected offset to start with '0x'")
+        return int(raw, 16)
+    elif fmt == "$":
+        if not raw.startswith("$"):
+            raise ValueError("Expected offset to start with '$'")
+        return int(raw[1:], 16)
+    elif fmt == "plain":
+        try:
+            return int(raw, 16)
+        except ValueError:
+            return int(raw)
+    else:
+        raise ValueError("Invalid format type.")
+
+def format_offset(offset, fmt):
+    """Format an offset for display in the given format (0x, $, plain)"""
+    if fmt == "0x":
+        return f"0x{offset:X}"
+    elif fmt == "$":
+        return f"${offset:X}"
+    return str(offset)
+
+def end_offset(start, size):
+    """Return the last offset of a block of size bytes starting at start"""
+    return start + size - 1
+
+#----------------------------------------------------------------------
+# FILLER SETS
+#----------------------------------------------------------------------
+
+def parse_fillers(raw):
+    """Parse a search type: a FILLER_SETS name or hex byte values like 'FF 00 01' / 'FF+00'"""
+    raw = raw.strip().upper()
+    if raw in FILLER_SETS:
+        return FILLER_SETS[raw]
+    fillers = []
+    for name in raw.replace("+", " ").replace(",", " ").split():
+        value = int(name[2:] if name.startswith("0X") else name.lstrip("$"), 16)
+        if not 0 <= value <= 0xFF:
+            raise ValueError(f"Not a byte value: {name}")
+        if value not in fillers:
+            fillers.append(value)
+    if not fillers:
+        raise ValueError("No free byte values given")
+    return tuple(fillers)
+
+def describe_references(references, limit=REFERENCES_SHOWN):
+    """Return a warning listing the [(target, source)] pointers into a range, or '' if there are none"""
+    if not references:
+        return ""
+    lines = [f"WARNING: {len(references)} pointer(s) into this range, it may still be in use!"]
+    for target, source in references[:limit]:
+        lines.append(f"  0x{source:X} -> 0x{target:X}")
+    if len(references) > limit:
+        lines.append(f"  ... and {len(references) - limit} more")
+    return "\n".join(lines) + "\n"
+
+def format_fillers(fillers):
+    """Format a fill value or set of fill values for display, like 0xFF/0x00"""
+    if isinstance(fillers, int):
+        fillers = (fillers,)
+    return "/".join(f"0x{value:02X}" for value in fillers)
+
+#----------------------------------------------------------------------
+# FREE SPACE RESULTS
+#----------------------------------------------------------------------
+
+class FreeSpaceResult:
+    """A block of free space returned by RomImage.find_free_space"""
+    def __init__(self, start, size, skip, value, run_end, next_free_start, rom_size, alignment=1, tolerance=0,
+                 references=()):
+        self.start = start
+        self.size = size
+        self.skip = skip
+        self.value = value                      # Fill value or tuple of filler values
+        self.alignment = alignment
+        self.tolerance = tolerance              # Stray bytes allowed in the block
+        self.references = references            # [(target, source)] pointers into the block
+        self.run_end = run_end                  # End (exclusive) of the free run
+        self.next_free_start = next_free_start  # Next run that also fits the allocation, or None
+        self.rom_size = rom_size
+
+    @property
+    def allocation(self):
+        return self.size + self.skip
+
+    @property
+    def end(self):
+        return end_offset(self.start, self.allocation)
+
+    @property
+    def block_size(self):
+        return self.run_end - self.start
+
+    def describe(self):
+        """Return the detailed multi-line report shown in the search results"""
+        result = (
+            f"Start: 0x{self.start:X}\n"
+            f"End: 0x{self.end:X}\n"
+            f"Size requested: {self.size} bytes\n"
+            f"Skip interval: {self.skip} bytes\n"
+            f"Alignment: {self.alignment} bytes\n"
+            f"Free bytes: {format_fillers(self.value)}\n"
+        )
+        if self.tolerance:
+            result += f"Stray bytes allowed: {self.tolerance}\n"
+        result += (
+            f"Total allocation: {self.allocation} bytes\n"
+            f"Total free block size: {self.block_size} bytes\n"
+            f"Remaining in block: {self.block_size - self.allocation} bytes\n"
+            f"Next available offset: 0x{self.start + self.allocation:X}\n"
+            f"Block extends to: 0x{self.run_end - 1:X}\n"
+        )
+
+        # Add info about the next block of data
+        if self.run_end < self.rom_size and self.next_free_start:
+            result += f"Next usable free block ({self.allocation}+ bytes): 0x{self.next_free_start:X}\n"
+            result += f"Bytes of allocated data between: {self.next_free_start - self.run_end}\n"
+        result += describe_references(self.references)
+        return result
+
+class FreeBlockList:
+    """The blocks of a find-all search, loaded a page at a time from RomImage.iter_free_space.
+
+    In offset order each page picks the search up where the last one
+    stopped. Ranking by size needs every block, so the size orders rerun
+    the search through heapq, keeping only the blocks loaded so far plus
+    RANK_PAGES pages; memory stays proportional to what has been shown.
+    """
+    RANK_PAGES = 5  # Pages ranked ahead per pass in the size orders
+
+    def __init__(self, rom, size, value, start=0, skip=0, alignment=1, tolerance=0, order="offset",
+                 page_size=FIND_ALL_PAGE):
+        if order not in FIND_ALL_ORDERS:
+            raise ValueError(f"Unknown order: {order}")
+        self.rom = rom
+        self.search = (size, value, skip, alignment, tolerance)
+        self.start = start
+        self.order = order
+        self.page_size = page_size
+        self.blocks = []        # (block_start, run_end) loaded so far, in order
+        self.exhausted = False  # True once the last block is loaded
+        self._resume = start    # Offset order: where the next page's search starts
+        self._ranked = []       # Size orders: the best blocks of the last pass, in order
+        self._ranked_all = False
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def _search(self, start):
+        size, value, skip, alignment, tolerance = self.search
+        return self.rom.iter_free_space(size, value, start, skip, alignment, tolerance)
+
+    @instrumentation.timed("find all: page")
+    def load_page(self):
+        """Load the next page and return its blocks ([] once exhausted)"""
+        if self.exhausted:
+            return []
+        if self.order == "offset":
+            page = list(islice(self._search(self._resume), self.page_size))
+            if page:
+                self._resume = page[-1][1]
+        else:
+            loaded = len(self.blocks)
+            if len(self._ranked) < loaded + self.page_size and not self._ranked_all:
+                keep = loaded + self.page_size * self.RANK_PAGES
+                # Equal sizes stay in offset order
+                if self.order == "largest":
+                    self._ranked = heapq.nlargest(keep, self._search(self.start),
+                                                  key=lambda block: (block[1] - block[0], -block[0]))
+                else:
+                    self._ranked = heapq.nsmallest(keep, self._search(self.start),
+                                                   key=lambda block: (block[1] - block[0], block[0]))
+                self._ranked_all = len(self._ranked) < keep
+            page = self._ranked[loaded:loaded + self.page_size]
+        self.exhausted = len(page) < self.page_size
+        self.blocks += page
+        return page
+
+class SaveResult:
+    """What RomImage.save wrote and how long it took"""
+    def __init__(self, path, mode, bytes_written, elapsed, backup_path=None):
+        self.path = path
+        self.mode = mode                  # "in-place" or "atomic"
+        self.bytes_written = bytes_written
+        self.elapsed = elapsed
+        self.backup_path = backup_path
+
+    def describe(self):
+        return f"Saved {self.bytes_written} bytes ({self.mode}) in {self.elapsed:.2f} sec"
+
+class FreeSpaceReport:
+    """Free space statistics for a whole ROM (see RomImage.free_space_report)"""
+    def __init__(self, rom_size, totals, run_counts, histogram, largest, regions, region_size):
+        self.rom_size = rom_size
+        self.totals = totals            # Fill value -> free bytes
+        self.run_counts = run_counts    # Fill value -> number of runs
+        self.histogram = histogram      # Fill value -> {k: runs of 2**k to 2**(k+1)-1 bytes}
+        self.largest = largest          # [(length, start, value)], largest first
+        self.regions = regions          # [(free bytes, largest run)] per region
+        self.region_size = region_size
+
+    @property
+    def total_free(self):
+        return sum(self.totals.values())
+
+    @staticmethod
+    def fragmentation(free, largest):
+        """0 when a region's free space is one block, approaching 1 as it splinters"""
+        return 1 - largest / free if free else 0.0
+
+    def describe(self):
+        """Return the report as text"""
+        lines = [f"ROM size: {self.rom_size} bytes ({self.rom_size / (1 << 20):.2f} MB)", "",
+                 "Free bytes (runs of 16+ bytes):"]
+        for value, total in self.totals.items():
+            lines.append(f"  0x{value:02X}: {total} bytes in {self.run_counts[value]} runs")
+        lines.append(f"  Total: {self.total_free} bytes "
+                     f"({self.total_free * 100 / max(1, self.rom_size):.1f}% of the ROM)")
+
+        lines += ["", "Run lengths:"]
+        buckets = sorted({bucket for counts in self.histogram.values() for bucket in counts})
+        for bucket in buckets:
+            counts = ", ".join(f"{self.histogram[value].get(bucket, 0)} x 0x{value:02X}"
+                               for value in self.histogram)
+            lines.append(f"  {1 << bucket}-{(2 << bucket) - 1} bytes: {counts}")
+
+        lines += ["", "Largest free blocks:"]
+        for length, start, value in self.largest:
+            lines.append(f"  0x{start:X}-0x{end_offset(start, length):X}: {length} bytes (0x{value:02X})")
+
+        lines += ["", f"Fragmentation per 0x{self.region_size:X} byte region:"]
+        for region, (free, largest) in enumerate(self.regions):
+            lines.append(f"  0x{region * self.region_size:07X}: {free} bytes free, "
+                         f"largest block {largest}, fragmentation {self.fragmentation(free, largest):.0%}")
+        return "\n".join(lines) + "\n"
+
+#----------------------------------------------------------------------
+# ROM MODEL
+#----------------------------------------------------------------------
+
+class RomImage:
+    """A loaded ROM: the edit buffer over the original image plus the free run index"""
+    def __init__(self, data, path='', cache=None):
+        if not isinstance(data, RomBuffer):
+            data = RomBuffer(bytes(data))
+        self.path = path
+        self.data = data  # Working copy; data.base is the original image
+        self.cache = cache  # AnalysisCache the indexes are restored from and saved to, if any
+        self.filler_runs = {}  # (fillers, tolerance, min_length) -> runs, for searches the index can't answer
+        self._pointers = None  # PointerIndex, built on first use
+        self.backup_made = False
+        self.listeners = []  # Called as listener(start, end) after every edit
+        if cache is None or not self._restore_analysis():
+            values = FreeRunIndex.FILL_VALUES
+            with instrumentation.timed("analysis: free runs"):
+                runs = parallel_scan.find_runs_parallel(self.data, [{value} for value in values], FreeRunIndex.MIN_RUN)
+                self.index = FreeRunIndex(self.data, dict(zip(values, runs)))
+            if cache is not None:
+                self.store_analysis()
+
+    @classmethod
+    @instrumentation.timed("load")
+    def load(cls, path, progress=None, use_mmap=True, cache=None):
+        """Load a ROM file, memory-mapped by default, calling progress(percent) when read.
+
+        With an AnalysisCache the free run and pointer indexes are restored
+        from it where the ROM is unchanged, and saved back after.
+        """
+        buffer = RomBuffer.open(path, use_mmap)
+        try:
+            if progress:
+                progress(100)
+            return cls(buffer, path, cache)
+        except BaseException:  # e.g. a cancelled load, don't leak the mapping
+            buffer.close()
+            raise
+
+    @staticmethod
+    def _analysis_params():
+        return (FreeRunIndex.MIN_RUN, POINTER_ALIGNMENT)
+
+    @instrumentation.timed("analysis: cache restore")
+    def _restore_analysis(self):
+        """Rebuild the indexes from the cache, rescanning only changed chunks. False on a miss."""
+        hashes = chunk_hashes(self.data)
+        cached = self.cache.lookup(self.path, len(self), hashes, self._analysis_params())
+        if cached is None:
+            instrumentation.count("analysis cache misses")
+            return False
+        analysis, changed = cached
+        instrumentation.count("analysis cache hits")
+        rescanned = sum(min(end, len(self)) - start for start, end in changed)
+        instrumentation.count("analysis cache bytes rescanned", rescanned)
+        self.index = FreeRunIndex(self.data, analysis.runs)
+        if analysis.pointers is not None:
+            self._pointers = PointerIndex(self.data, pointers=analysis.pointers)
+        for start, end in changed:
+            end = min(end, len(self))
+            self.index.update(self.data, start, end)
+            if self._pointers is not None:
+                self._pointers.update(self.data, start, end)
+        if changed:
+            self.store_analysis(hashes)
+        return True
+
+    @instrumentation.timed("analysis: cache store")
+    def store_analysis(self, hashes=None):
+        """Save the free run index, and the pointer index if it was built, of the unedited image to the cache"""
+        if self.cache is None or self.data.dirty:
+            return
+        hashes = chunk_hashes(self.data) if hashes is None else hashes
+        runs = {value: (self.index.starts[value], self.index.ends[value]) for value in FreeRunIndex.FILL_VALUES}
+        pointers = self._pointers
+        if pointers is not None:
+            pointers = (pointers.sources, [pointers.target_of[source] for source in pointers.sources])
+        analysis = CachedAnalysis(len(self), hashes, runs, pointers, self._analysis_params())
+        self.cache.store(self.path, analysis)
+
+    @property
+    def original(self):
+        """The original image as last loaded/saved"""
+        return self.data.base
+
+    def close(self):
+        """Release the file mapping, if any"""
+        self.data.close()
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def is_modified(self):
+        """True if the working copy differs from the original image"""
+        return bool(self.data.changed_ranges())
+
+    @property
+    def line_count(self):
+        """Number of 16-byte rows in the hex view"""
+        return (len(self.data) + 15) // 16
+
+    @property
+    def pointer_index(self):
+        """Reverse index of the pointers in the ROM, built on first use (and then cached, see store_analysis)"""
+        if self._pointers is None:
+            with instrumentation.timed("analysis: pointer index"):
+                self._pointers = PointerIndex(self.data)
+            self.store_analysis()
+        return self._pointers
+
+    def references(self, start, size):
+        """Return [(target, source)] of every pointer into start .. start+size-1"""
+        return self.pointer_index.references(start, start + size)
+
+    def is_range_free(self, start, size, value):
+        """Check if a block of memory is filled with a specific byte value"""
+        return self.index.is_range_free(start, size, value)
+
+    def free_value(self, start, size):
+        """Return the fill value (0xFF/0x00) a range is free with, or None"""
+        if not 0 <= start < len(self.data):
+            return None
+        # Only the value of the first byte can fill the whole range
+        value = self.data[start]
+        if value in FILL_TYPES.values() and self.is_range_free(start, size, value):
+            return value
+        return None
+
+    @instrumentation.timed("search")
+    def find_free_space(self, size, value, start=0, skip=0, alignment=1, tolerance=0, references=False):
+        """Find the first block of size + skip free bytes at or after start, starting on a multiple of alignment.
+
+        value is a fill value or a tuple of filler values that all count as
+        free; tolerance allows that many other bytes inside the block.
+        references=True also lists the pointers into the block, which
+        builds the pointer index on first use.
+        """
+        need = size + skip
+        fit = self._first_fit(value, tolerance, need, start, alignment)
+        if fit is None:
+            return None
+        block_start, run_end = fit
+
+        # Find the next free block after this one, in the runs the search above already found
+        next_fit = self._first_fit(value, tolerance, need, run_end, alignment)
+        next_free_start = next_fit[0] if next_fit else None
+        return FreeSpaceResult(block_start, size, skip, value, run_end, next_free_start, len(self.data),
+                               alignment, tolerance, self.references(block_start, need) if references else ())
+
+    def iter_free_space(self, size, value, start=0, skip=0, alignment=1, tolerance=0):
+        """Yield (block_start, run_end) for every free run at or after start that fits size + skip.
+
+        Same rules as find_free_space; block_start is the run's first fit.
+        Blocks come lazily in offset order, each search resuming at the end
+        of the last run, so nothing is held between blocks.
+        """
+        need = size + skip
+        while True:
+            fit = self._first_fit(value, tolerance, need, start, alignment)
+            if fit is None:
+                return
+            yield fit
+            start = fit[1]
+
+    def _first_fit(self, value, tolerance, need, start, alignment):
+        """Return (block_start, run_end) of the first fit, from the index when it covers the request"""
+        fillers = (value,) if isinstance(value, int) else tuple(value)
+        if len(fillers) == 1 and fillers[0] in self.index.FILL_VALUES and tolerance <= 0:
+            return self.index.find_first_fit(fillers[0], need, start, alignment)
+
+        key = (fillers, tolerance, need)
+        runs = self.filler_runs.get(key)
+        if runs is None:
+            if tolerance > 0:
+                instrumentation.count("bytes scanned", len(self.data))
+                runs = find_filler_runs(self.data, set(fillers), need, tolerance)
+            else:
+                runs = parallel_scan.find_runs_parallel(self.data, [fillers], need)[0]
+            self.filler_runs[key] = runs
+        starts, ends = runs
+        # Run ends increase, so every run past start follows the first one ending after it
+        for pos in range(bisect_right(ends, start), len(ends)):
+            block_start = align_up(max(starts[pos], start), alignment)
+            if ends[pos] - block_start >= need:
+                return block_start, ends[pos]
+        return None
+
+    @instrumentation.timed("pattern search")
+    def find_pattern(self, pattern, limit=pattern_search.MAX_HITS):
+        """Return the offsets of the first limit matches of a pattern_search.SearchPattern"""
+        return pattern_search.find_pattern(self.data, pattern, limit)
+
+    @instrumentation.timed("allocate")
+    def allocate(self, requests, value, strategy="best-fit", start=0):
+        """Pack allocator.Placement requests into the free runs of value at or after start"""
+        starts, ends = self.index.starts[value], self.index.ends[value]
+        runs = [(max(run_start, start), run_end) for run_start, run_end in zip(starts, ends) if run_end > start]
+        return allocator.allocate(runs, requests, strategy)
+
+    @instrumentation.timed("analysis: free space report")
+    def free_space_report(self, largest=10, region_size=REPORT_REGION_SIZE):
+        """Build a FreeSpaceReport in one pass over the indexed free runs"""
+        region_count = (len(self) + region_size - 1) // region_size
+        free = [0] * region_count
+        longest = [0] * region_count
+        totals, run_counts, histogram = {}, {}, {}
+        blocks = []
+        for value in FILL_TYPES.values():
+            starts, ends = self.index.starts[value], self.index.ends[value]
+            totals[value] = 0
+            run_counts[value] = len(starts)
+            counts = histogram[value] = {}
+            for start, end in zip(starts, ends):
+                length = end - start
+                totals[value] += length
+                bucket = length.bit_length() - 1
+                counts[bucket] = counts.get(bucket, 0) + 1
+                for region in range(start // region_size, (end - 1) // region_size + 1):
+                    part = min(end, (region + 1) * region_size) - max(start, region * region_size)
+                    free[region] += part
+                    longest[region] = max(longest[region], part)
+            blocks += heapq.nlargest(largest, ((e - s, s, value) for s, e in zip(starts, ends)))
+        return FreeSpaceReport(len(self), totals, run_counts,
+                               {value: dict(sorted(counts.items())) for value, counts in histogram.items()},
+                               heapq.nlargest(largest, blocks), list(zip(free, longest)), region_size)
+
+    @instrumentation.timed("analysis: block map")
+    def block_map(self, block_size, start=0, end=None):
+        """Classify the ROM in block_size blocks (scan_engine BLOCK_* codes) for the minimap.
+
+        Returns (first_block, classes) covering at least start .. end-1. The
+        range grows over the free runs around it, since an edit there can
+        merge or split runs reaching into neighbouring blocks.
+        """
+        end = len(self) if end is None else end
+        for value in FILL_TYPES.values():
+            start = min(start, run_start(self.data, value, start))
+            end = max(end, run_end(self.data, value, end))
+        first = start // block_size
+        stop = min(len(self), (end + block_size - 1) // block_size * block_size)
+        runs = {value: (self.index.starts[value], self.index.ends[value]) for value in FILL_TYPES.values()}
+        return first, classify_blocks(runs, block_size, first * block_size, stop)
+
+    @instrumentation.timed("erase")
+    def erase(self, start, count, value):
+        """Fill count bytes from start with value"""
+        if start < 0 or count < 0 or start + count > len(self.data):
+            raise ValueError("Out of bounds")
+        self.data.fill(start, count, value)
+        self._changed(start, start + count)
+
+    def write(self, offset, data):
+        """Overwrite bytes at offset"""
+        self.data.write(offset, data)
+        self._changed(offset, offset + len(data))
+
+    @instrumentation.timed("patch: make")
+    def make_patch(self, fmt):
+        """Build an IPS/UPS/BPS patch from the original image to the working copy"""
+        return patches.make_patch(fmt, self.original, self.data, self.data.changed_ranges())
+
+    @instrumentation.timed("patch: apply")
+    def apply_patch(self, patch):
+        """Apply an IPS/UPS/BPS patch as a single undo step, returning the number of writes.
+
+        Every record goes into the buffer first. The indexes are then
+        updated once per run of overlapping records and the listeners are
+        told once, about the range spanning all of them.
+        """
+        changes = patches.patch_changes(patch, self.data)
+        if not changes:
+            return 0
+        with self.data.history.group():
+            for offset, data in changes:
+                self.data.write(offset, data)
+        ranges = []
+        for start, end in sorted((offset, offset + len(data)) for offset, data in changes):
+            if ranges and start <= ranges[-1][1]:
+                ranges[-1][1] = max(ranges[-1][1], end)
+            else:
+                ranges.append([start, end])
+        self._changed(ranges[0][0], max(end for _, end in ranges), ranges)
+        return len(changes)
+
+    def undo(self):
+        """Undo the last edit, returning the (start, end) range it touched or None"""
+        changed = self.data.undo()
+        if changed:
+            self._changed(*changed)
+        return changed
+
+    def redo(self):
+        """Redo the last undone edit, returning the (start, end) range it touched or None"""
+        changed = self.data.redo()
+        if changed:
+            self._changed(*changed)
+        return changed
+
+    def _changed(self, start, end, ranges=None):
+        """Re-index bytes start .. end-1 (only its (start, end) ranges, if given) and tell the listeners they changed"""
+        with instrumentation.timed("edit: reindex"):
+            for lo, hi in ranges or [(start, end)]:
+                self.index.update(self.data, lo, hi)
+                if self._pointers is not None:
+                    self._pointers.update(self.data, lo, hi)
+            self.filler_runs.clear()
+        for listener in self.listeners:
+            listener(start, end)
+
+    @instrumentation.timed("save")
+    def save(self, path=None, backup=True, atomic=False):
+        """Write the working copy to disk and return a SaveResult.
+
+        By default only the changed ranges are written into the existing
+        file. atomic=True (or saving to a new path) streams the whole image
+        to a temp file, fsyncs it and renames it over the target instead.
+        backup copies the file to .bak once, before the first save.
+        """
+        save_start = time.perf_counter()
+        path = path or self.path
+        same_file = (os.path.exists(path) and self.path and os.path.exists(self.path)
+                     and os.path.samefile(path, self.path) and os.path.getsize(path) == len(self))
+        backup_path = None
+        if backup and not self.backup_made and os.path.exists(path):
+            backup_path = path + ".bak"
+            shutil.copyfile(path, backup_path)
+            self.backup_made = True
+
+        use_mmap = self.data.is_mapped
+        try:
+            if same_file and not atomic:
+                mode = "in-place"
+                changes = [(start, self.data.read(start, end - start))
+                           for start, end in self.data.changed_ranges()]
+                # The read-only mapping stays open: the bytes written match the overlay on top of it
+                with open(path, 'r+b') as f:
+                    for start, chunk in changes:
+                        f.seek(start)
+                        f.write(chunk)
+                    f.flush()
+                    os.fsync(f.fileno())
+                bytes_written = sum(len(chunk) for _, chunk in changes)
+            else:
+                mode = "atomic"
+                bytes_written = self._write_atomic(path, use_mmap)
+        except BaseException:
+            # Keep the edits on top of whatever is on disk now
+            if self.path and os.path.exists(self.path):
+                self.data.reopen(self.path, use_mmap)
+            raise
+
+        # The saved file becomes the new original image; the undo history stays
+        self.path = path
+        self.data.reopen(path, use_mmap, keep_edits=False)
+        self.store_analysis()
+        return SaveResult(path, mode, bytes_written, time.perf_counter() - save_start, backup_path)
+
+    def _write_atomic(self, path, use_mmap=True):
+        """Stream the image to a temp file, fsync it and rename it over path"""
+        size = len(self)
+        fd, temp_path = tempfile.mkstemp(prefix=".ufsf-", suffix=".tmp",
+                                         dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for start in range(0, size, SAVE_CHUNK_SIZE):
+                    f.write(self.data.read(start, SAVE_CHUNK_SIZE))
+                f.flush()
+                os.fsync(f.fileno())
+            # Read from the temp file while the old one is replaced. Windows can't
+            # rename a mapped file, so there it is read into memory instead
+            self.data.reopen(temp_path, use_mmap and os.name != 'nt')
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return size
@@ -0,0 +1,65 @@
+"""
+Multi-ROM workspace for Ultimate Free Space Finder.
+Holds several ROMs at once (e.g. a clean base ROM, the current build and a
+teammate's build), each with its own RomImage, edit history and indexes.
+The first ROM opened is the base: every ROM opened after it only keeps the
+pages that differ from the base (see rom_buffer.SharedPageImage), so a few
+near-identical images cost little more than one.
+"""
+
+from rom_buffer import RomBuffer
+from ufsf_core import RomImage
+
+class Workspace:
+    """The open ROMs, in tab order; roms[0] is the base the others share pages with"""
+    def __init__(self):
+        self.roms = []
+
+    def __len__(self):
+        return len(self.roms)
+
+    @property
+    def base(self):
+        return self.roms[0] if self.roms else None
+
+    def open(self, path, use_mmap=True, progress=None, cache=None, share=True):
+        """Load a ROM into the workspace and return its RomImage (standalone, not sharing the base's pages, unless share)"""
+        if self.base is None or not share:
+            rom = RomImage.load(path, progress, use_mmap, cache)
+        else:
+            buffer = RomBuffer.open_shared(path, self.base.data)
+            try:
+                if progress:
+                    progress(100)
+                rom = RomImage(buffer, path, cache)
+            except BaseException:
+                buffer.close()
+                raise
+        self.roms.append(rom)
+        return rom
+
+    def _sharing(self, rom):
+        """ROMs reading pages from rom's original image"""
+        if rom is not self.base:
+            return []
+        return [other for other in self.roms[1:] if other.data.is_shared]
+
+    def save(self, rom, path=None, backup=True, atomic=False):
+        """Save a ROM (see RomImage.save), first giving the ROMs that share its pages their own copies"""
+        ranges = rom.data.changed_ranges()
+        for other in self._sharing(rom):
+            other.data.base.detach(ranges)
+        return rom.save(path, backup, atomic)
+
+    def close(self, rom):
+        """Close a ROM; the next one becomes the base if it was the base"""
+        for other in self._sharing(rom):
+            other.data.base.detach()
+        self.roms.remove(rom)
+        rom.close()
+
+    def shared_fraction(self, rom):
+        """Fraction of rom's original image read from the base ROM's pages"""
+        if not rom.data.is_shared or not rom.data.base.refs:
+            return 0.0
+        return rom.data.base.shared_pages / len(rom.data.base.refs)